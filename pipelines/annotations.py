@@ -0,0 +1,217 @@
+"""
+	Loads the features of a GFF file, such as the annotations prokka writes, into a table of numpy arrays. The table is
+	cached next to the GFF file as `{filename}.features.npz` and reused until the GFF file changes, and can find the
+	features at thousands of positions at once or look up a feature by its locus tag.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import unquote
+
+import numpy
+
+from pipelines import fastqio, manifest
+
+VERSION = "1"
+
+# Feature types which describe a whole sequence rather than a part of it.
+IGNORED_TYPES = {'region', 'source', 'contig'}
+
+STRANDS = {'+': 1, '-': -1}
+
+
+@dataclass
+class Feature:
+	seq_id: str
+	start: int
+	end: int
+	strand: int
+	type: str
+	locus_tag: str
+	name: str
+	product: str
+
+
+def _parse_attributes(column: str) -> Dict[str, str]:
+	attributes = dict()
+	for item in column.strip().split(';'):
+		key, _, value = item.partition('=')
+		if key:
+			attributes[key] = unquote(value)
+	return attributes
+
+
+def parse_gff(filename: Path) -> 'FeatureTable':
+	""" Reads the features of a GFF3 file. The sequences at the end of prokka's GFF files are skipped."""
+	seq_ids, starts, ends, strands, types, locus_tags, names, products = [], [], [], [], [], [], [], []
+	with fastqio.open_reads(filename, text = True) as file1:
+		for line in file1:
+			if line.startswith('##FASTA'):
+				break
+			if line.startswith('#') or not line.strip():
+				continue
+			columns = line.rstrip('\r\n').split('\t')
+			if len(columns) < 9 or columns[2] in IGNORED_TYPES:
+				continue
+			attributes = _parse_attributes(columns[8])
+			seq_ids.append(columns[0])
+			starts.append(int(columns[3]))
+			ends.append(int(columns[4]))
+			strands.append(STRANDS.get(columns[6], 0))
+			types.append(columns[2])
+			locus_tags.append(attributes.get('locus_tag', attributes.get('ID', '')))
+			names.append(attributes.get('gene', attributes.get('Name', '')))
+			products.append(attributes.get('product', ''))
+	return FeatureTable(
+		seq_ids = numpy.array(seq_ids, dtype = str),
+		starts = numpy.array(starts, dtype = numpy.int64),
+		ends = numpy.array(ends, dtype = numpy.int64),
+		strands = numpy.array(strands, dtype = numpy.int8),
+		types = numpy.array(types, dtype = str),
+		locus_tags = numpy.array(locus_tags, dtype = str),
+		names = numpy.array(names, dtype = str),
+		products = numpy.array(products, dtype = str)
+	)
+
+
+class FeatureTable:
+	"""
+		The features of an annotation, sorted by sequence and start position. Positions are 1-based and inclusive, as
+		in the GFF file.
+	"""
+	COLUMNS = ['seq_ids', 'starts', 'ends', 'strands', 'types', 'locus_tags', 'names', 'products']
+
+	def __init__(self, seq_ids: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray, strands: numpy.ndarray,
+			types: numpy.ndarray, locus_tags: numpy.ndarray, names: numpy.ndarray, products: numpy.ndarray):
+		order = numpy.lexsort((starts, seq_ids)) if len(starts) else numpy.zeros(0, dtype = numpy.int64)
+		self.seq_ids = seq_ids[order]
+		self.starts = starts[order]
+		self.ends = ends[order]
+		self.strands = strands[order]
+		self.types = types[order]
+		self.locus_tags = locus_tags[order]
+		self.names = names[order]
+		self.products = products[order]
+
+		# Place every sequence one after the other, so a single sorted array covers all of them.
+		self.sequences, sequence_index = numpy.unique(self.seq_ids, return_inverse = True)
+		self.lengths = numpy.zeros(len(self.sequences), dtype = numpy.int64)
+		numpy.maximum.at(self.lengths, sequence_index, self.ends)
+		self.offsets = numpy.concatenate([[0], numpy.cumsum(self.lengths + 1)[:-1]]).astype(numpy.int64)
+		self._starts = self.starts + self.offsets[sequence_index]
+		self._ends = self.ends + self.offsets[sequence_index]
+		# The furthest any feature up to each index reaches. Features which end before a position can be skipped.
+		self._reach = numpy.maximum.accumulate(self._ends) if len(self._ends) else self._ends
+		self._locus_tags: Optional[Dict[str, int]] = None
+
+	def __len__(self) -> int:
+		return len(self.starts)
+
+	def feature(self, index: int) -> Feature:
+		return Feature(
+			str(self.seq_ids[index]), int(self.starts[index]), int(self.ends[index]), int(self.strands[index]),
+			str(self.types[index]), str(self.locus_tags[index]), str(self.names[index]), str(self.products[index])
+		)
+
+	def _to_global(self, seq_ids: numpy.ndarray, positions: numpy.ndarray) -> numpy.ndarray:
+		"""
+			Converts positions to the concatenated coordinates. Positions on unknown sequences, or past the last feature
+			of their sequence, become -1.
+		"""
+		index = numpy.minimum(numpy.searchsorted(self.sequences, seq_ids), len(self.sequences) - 1)
+		known = (self.sequences[index] == seq_ids) & (positions >= 0) & (positions <= self.lengths[index])
+		return numpy.where(known, self.offsets[index] + positions, -1)
+
+	def query(self, seq_ids, positions, feature_type: Optional[str] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+		"""
+			Finds every feature which contains each position.
+		Parameters
+		----------
+		seq_ids: Union[str, Iterable[str]]
+			The sequence of each position, or a single sequence for all of them.
+		positions: Iterable[int]
+		feature_type: Optional[str]
+			Only return features of this type, e.g. 'CDS'.
+		Returns
+		-------
+		Tuple[numpy.ndarray, numpy.ndarray]
+			Pairs of the index of a position and the index of a feature which contains it.
+		"""
+		positions = numpy.asarray(positions, dtype = numpy.int64)
+		seq_ids = numpy.broadcast_to(numpy.asarray(seq_ids, dtype = str), positions.shape)
+		if not len(self) or not len(positions):
+			return numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0, dtype = numpy.int64)
+		points = self._to_global(seq_ids, positions)
+		# Candidates start at or before the position and belong to a run of features which reaches the position.
+		upper = numpy.searchsorted(self._starts, points, side = 'right')
+		lower = numpy.searchsorted(self._reach, points, side = 'left')
+		counts = numpy.where(points >= 0, numpy.maximum(upper - lower, 0), 0)
+
+		query_index = numpy.repeat(numpy.arange(len(points)), counts)
+		feature_index = numpy.repeat(lower, counts) + numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+		keep = self._ends[feature_index] >= points[query_index]
+		if feature_type is not None:
+			keep &= self.types[feature_index] == feature_type
+		return query_index[keep], feature_index[keep]
+
+	def annotate(self, seq_ids, positions, feature_type: Optional[str] = None) -> numpy.ndarray:
+		""" The index of the first feature which contains each position, or -1 for intergenic positions."""
+		positions = numpy.asarray(positions, dtype = numpy.int64)
+		result = numpy.full(len(positions), -1, dtype = numpy.int64)
+		query_index, feature_index = self.query(seq_ids, positions, feature_type)
+		# Assign in reverse so the first feature of each position is the one kept.
+		result[query_index[::-1]] = feature_index[::-1]
+		return result
+
+	def overlapping(self, seq_id: str, start: int, end: int, feature_type: Optional[str] = None) -> List[Feature]:
+		""" The features which overlap `seq_id:start-end`, inclusive."""
+		index = int(numpy.searchsorted(self.sequences, seq_id))
+		if index >= len(self.sequences) or self.sequences[index] != seq_id:
+			return []
+		# Clip the region to the sequence so it can't reach the features of the neighboring sequences.
+		low = self.offsets[index] + max(start, 0)
+		high = self.offsets[index] + min(end, self.lengths[index])
+		if low > high:
+			return []
+		indices = numpy.arange(numpy.searchsorted(self._reach, low), numpy.searchsorted(self._starts, high, side = 'right'))
+		indices = indices[self._ends[indices] >= low]
+		if feature_type is not None:
+			indices = indices[self.types[indices] == feature_type]
+		return [self.feature(i) for i in indices]
+
+	def by_locus_tag(self, locus_tag: str) -> Optional[Feature]:
+		if self._locus_tags is None:
+			# Keep the first feature for each tag, which is the gene rather than its CDS when both have the same tag.
+			self._locus_tags = dict()
+			for index, tag in enumerate(self.locus_tags.tolist()):
+				self._locus_tags.setdefault(tag, index)
+		index = self._locus_tags.get(locus_tag)
+		return self.feature(index) if index is not None else None
+
+	def save(self, filename: Path, source: Path):
+		""" Saves the table as an npz file, which is reused until the GFF file `source` changes."""
+		arrays = {column: getattr(self, column) for column in self.COLUMNS}
+		manifest.save_sidecar(filename, VERSION, [source], arrays)
+
+	@classmethod
+	def load(cls, filename: Path, source: Path) -> Optional['FeatureTable']:
+		""" Loads a table saved by `save()`. Returns None if there is none or `source` changed since."""
+		arrays = manifest.load_sidecar(filename, VERSION, [source])
+		if arrays is None:
+			return None
+		return cls(**{column: arrays[column] for column in cls.COLUMNS})
+
+
+def get_cache_filename(filename: Path) -> Path:
+	return filename.with_name(filename.name + ".features.npz")
+
+
+def load_features(filename: Union[str, Path]) -> FeatureTable:
+	""" Loads the features of a GFF file from its cache, parsing the GFF file and saving the cache first if needed."""
+	filename = Path(filename)
+	cache = get_cache_filename(filename)
+	table = FeatureTable.load(cache, filename)
+	if table is None:
+		table = parse_gff(filename)
+		table.save(cache, filename)
+	return table
@@ -0,0 +1,234 @@
+"""
+	A persistent index of the samples and program outputs in a project folder. The catalog is saved as an sqlite
+	database and updated incrementally: folders are only listed and classified again when their modification time
+	changes, so listing the state of thousands of samples doesn't require walking the whole tree.
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from loguru import logger
+
+from pipelines import programio, sampleio, utilities
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+	path TEXT PRIMARY KEY,
+	parent TEXT,
+	mtime INTEGER NOT NULL,
+	type TEXT
+);
+CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent);
+CREATE TABLE IF NOT EXISTS samples (
+	folder TEXT PRIMARY KEY REFERENCES folders (path) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	forward TEXT NOT NULL,
+	reverse TEXT NOT NULL,
+	type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_name ON samples (name);
+CREATE TABLE IF NOT EXISTS outputs (
+	folder TEXT PRIMARY KEY REFERENCES folders (path) ON DELETE CASCADE,
+	sample TEXT NOT NULL,
+	type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_sample ON outputs (sample);
+"""
+
+# Folders with these types are the output of a single program. Their subfolders are never searched.
+TERMINAL_TYPES = {'spades', 'shovill', 'breseq', 'prokka', 'genbank', 'refseq'}
+
+# The `programio` class used to load each type of output folder.
+OUTPUT_CLASSES = {
+	'trimmomatic': programio.TrimmomaticOutput,
+	'shovill': programio.ShovillOutput,
+	'breseq': programio.BreseqOutput,
+	'prokka': programio.ProkkaOutput
+}
+
+
+class ProjectCatalog:
+	"""
+		An sqlite-backed catalog of a project folder.
+	Parameters
+	----------
+	filename: Path
+		The database file. Created if it does not exist.
+	"""
+
+	def __init__(self, filename: Union[str, Path]):
+		self.filename = Path(filename)
+		self._lock = threading.Lock()
+		self.connection = sqlite3.connect(str(self.filename), check_same_thread = False)
+		self.connection.execute("PRAGMA foreign_keys = ON")
+		self.connection.executescript(SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	def update(self, root: Path, max_depth: int = 3) -> int:
+		"""
+			Brings the catalog up to date with the folders under `root`.
+		Parameters
+		----------
+		root: Path
+		max_depth: int; default 3
+			How many levels of subfolders to search.
+		Returns
+		-------
+		int
+			The number of folders that had to be listed again.
+		"""
+		root = Path(root)
+		changed = 0
+		with self._lock, self.connection:
+			stack: List[Tuple[Path, int]] = [(root, 0)]
+			while stack:
+				folder, depth = stack.pop()
+				try:
+					mtime = os.stat(folder).st_mtime_ns
+				except FileNotFoundError:
+					self._remove(folder)
+					continue
+				row = self.connection.execute("SELECT mtime, type FROM folders WHERE path = ?", (str(folder),)).fetchone()
+				if row and row[0] == mtime:
+					# Nothing was added or removed, so the known subfolders are still correct.
+					folder_type = row[1]
+					subfolders = [Path(i) for i, in self.connection.execute("SELECT path FROM folders WHERE parent = ?", (str(folder),))]
+				else:
+					changed += 1
+					folder_type, subfolders = self._scan(root, folder, mtime)
+
+				if depth < max_depth and folder_type not in TERMINAL_TYPES:
+					stack.extend((i, depth + 1) for i in subfolders)
+		return changed
+
+	def _scan(self, root: Path, folder: Path, mtime: int) -> Tuple[Optional[str], List[Path]]:
+		snapshot = utilities.FolderSnapshot.of(folder)
+		try:
+			folder_type = utilities.get_folder_type(folder, silent = True)
+		except OSError:
+			folder_type = None
+		parent = str(folder.parent) if folder != root else None
+		self.connection.execute(
+			"INSERT OR REPLACE INTO folders (path, parent, mtime, type) VALUES (?, ?, ?, ?)", (str(folder), parent, mtime, folder_type)
+		)
+		# Forget any subfolders that were removed.
+		known = {i for i, in self.connection.execute("SELECT path FROM folders WHERE parent = ?", (str(folder),))}
+		for path in known - {str(i) for i in snapshot.folders}:
+			self._remove(Path(path))
+
+		self.connection.execute("DELETE FROM samples WHERE folder = ?", (str(folder),))
+		self.connection.execute("DELETE FROM outputs WHERE folder = ?", (str(folder),))
+		sample_name = get_sample_name(root, folder)
+		if folder_type in ('reads', 'trimmomatic'):
+			try:
+				if folder_type == 'reads':
+					reads = sampleio.SampleReads.from_folder(folder)
+				else:
+					reads = programio.TrimmomaticOutput.from_folder(folder)
+				self.connection.execute(
+					"INSERT INTO samples (folder, name, forward, reverse, type) VALUES (?, ?, ?, ?, ?)",
+					(str(folder), reads.name or sample_name, str(reads.forward), str(reads.reverse), folder_type)
+				)
+			except FileNotFoundError:
+				logger.warning(f"Catalog: Could not find the reads in '{folder}'")
+		if folder_type is not None and folder_type != 'reads':
+			self.connection.execute("INSERT INTO outputs (folder, sample, type) VALUES (?, ?, ?)", (str(folder), sample_name, folder_type))
+		return folder_type, snapshot.folders
+
+	def _remove(self, folder: Path):
+		""" Removes a folder and everything below it."""
+		prefix = str(folder)
+		self.connection.execute("DELETE FROM folders WHERE path = ? OR path LIKE ? ESCAPE '\\'", (prefix, _escape(prefix) + "/%"))
+
+	def samples(self, parent: Optional[Path] = None, trimmed: Optional[bool] = None) -> List[sampleio.SampleReads]:
+		"""
+			Lists the samples in the catalog.
+		Parameters
+		----------
+		parent: Optional[Path]
+			Only return the samples in the immediate subfolders of this folder.
+		trimmed: Optional[bool]
+			If given, only return the raw (`False`) or trimmed (`True`) reads.
+		"""
+		query = "SELECT samples.name, forward, reverse, samples.folder FROM samples JOIN folders ON folders.path = samples.folder"
+		conditions, parameters = list(), list()
+		if parent is not None:
+			conditions.append("folders.parent = ?")
+			parameters.append(str(parent))
+		if trimmed is not None:
+			conditions.append("samples.type = ?")
+			parameters.append('trimmomatic' if trimmed else 'reads')
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY samples.folder"
+		with self._lock:
+			rows = self.connection.execute(query, parameters).fetchall()
+		return [sampleio.SampleReads(name, Path(forward), Path(reverse), Path(folder)) for name, forward, reverse, folder in rows]
+
+	def load_samples(self, parent: Optional[Path] = None) -> List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]]:
+		"""
+			Same as `samples()`, but trimmed reads are loaded as `programio.TrimmomaticOutput`, like
+			`generic.get_reads_from_folder()` does.
+		"""
+		results = list()
+		trimmed = {str(i.folder) for i in self.samples(parent, trimmed = True)}
+		for sample in self.samples(parent):
+			if str(sample.folder) in trimmed:
+				results.append(OUTPUT_CLASSES['trimmomatic'].from_folder(sample.folder, sample.name))
+			else:
+				results.append(sample)
+		return results
+
+	def outputs(self, sample: Optional[str] = None, output_type: Optional[str] = None) -> List[Tuple[str, str, Path]]:
+		""" Lists the `(sample, type, folder)` of each program output, optionally filtered by sample and type."""
+		query = "SELECT sample, type, folder FROM outputs"
+		conditions, parameters = list(), list()
+		if sample is not None:
+			conditions.append("sample = ?")
+			parameters.append(sample)
+		if output_type is not None:
+			conditions.append("type = ?")
+			parameters.append(output_type)
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY sample, type"
+		with self._lock:
+			rows = self.connection.execute(query, parameters).fetchall()
+		return [(name, kind, Path(folder)) for name, kind, folder in rows]
+
+	def load_outputs(self, sample: str) -> List[programio.BaseSampleOutput]:
+		""" Loads the `programio` object for each of a sample's outputs."""
+		results = list()
+		for name, kind, folder in self.outputs(sample):
+			if kind in OUTPUT_CLASSES:
+				results.append(OUTPUT_CLASSES[kind].from_folder(folder, name))
+		return results
+
+	def status(self) -> Dict[str, Set[str]]:
+		""" The types of output that exist for each sample."""
+		result: Dict[str, Set[str]] = dict()
+		with self._lock:
+			rows = self.connection.execute("SELECT sample, type FROM outputs").fetchall()
+		for sample, kind in rows:
+			result.setdefault(sample, set()).add(kind)
+		return result
+
+
+def _escape(value: str) -> str:
+	return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_sample_name(root: Path, folder: Path) -> str:
+	"""
+		Projects are organized as `project/sample/program`, so the sample is the first folder below the project. Any
+		output which is listed by sample should be named this way.
+	"""
+	try:
+		parts = folder.relative_to(root).parts
+	except ValueError:
+		parts = ()
+	return parts[0] if parts else folder.name
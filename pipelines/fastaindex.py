@@ -0,0 +1,235 @@
+"""
+	Random access to the sequences of a fasta file without reading the whole file. The index is written as a
+	samtools-compatible `.fai` file, and `FastaFile` memory-maps the fasta file so fetching a region only reads the pages
+	it covers. Genbank references are converted to fasta once, and the converted file is reused until the genbank file
+	changes.
+"""
+import mmap
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+
+from pipelines import fastqio
+
+GENBANK_SUFFIXES = {'.gb', '.gbk', '.gbff', '.genbank'}
+
+# The number of bases on each line of converted genbank files.
+LINE_WIDTH = 80
+
+
+@dataclass
+class FastaRecord:
+	"""
+		A single line of a `.fai` index.
+	Attributes
+	----------
+	offset: int
+		The position of the first base of the sequence in the file.
+	line_bases, line_width: int
+		The number of bases on each line, and the number of bytes including the line ending.
+	"""
+	name: str
+	length: int
+	offset: int
+	line_bases: int
+	line_width: int
+
+	def to_line(self) -> str:
+		return f"{self.name}\t{self.length}\t{self.offset}\t{self.line_bases}\t{self.line_width}\n"
+
+	@classmethod
+	def from_line(cls, line: str) -> 'FastaRecord':
+		name, length, offset, line_bases, line_width = line.rstrip('\r\n').split('\t')[:5]
+		return cls(name, int(length), int(offset), int(line_bases), int(line_width))
+
+	def position(self, index: int) -> int:
+		""" The position in the file of the base at `index` (0-based) in the sequence."""
+		if not self.line_bases:
+			return self.offset
+		return self.offset + (index // self.line_bases) * self.line_width + index % self.line_bases
+
+
+def get_index_filename(path: Union[str, Path]) -> Path:
+	path = Path(path)
+	return path.with_name(path.name + ".fai")
+
+
+def build_index(path: Union[str, Path]) -> List[FastaRecord]:
+	"""
+		Indexes an uncompressed fasta file. Like samtools, every line of a sequence except the last must have the same
+		length.
+	"""
+	path = Path(path)
+	records: List[FastaRecord] = list()
+	record: Optional[FastaRecord] = None
+	# Set once a sequence has a line shorter than the others, which must be its last line.
+	short_line = False
+	offset = 0
+	with path.open('rb') as file1:
+		for number, line in enumerate(file1, start = 1):
+			if line.startswith(b'>'):
+				record = FastaRecord(line[1:].split()[0].decode() if line[1:].strip() else "", 0, offset + len(line), 0, 0)
+				records.append(record)
+				short_line = False
+			elif record is None:
+				if line.strip():
+					message = f"{path} does not start with a fasta header"
+					raise ValueError(message)
+			else:
+				bases = len(line.rstrip(b'\r\n'))
+				if bases:
+					if short_line or (record.line_bases and bases > record.line_bases):
+						message = f"Line {number} of {path} is a different length than the other lines of {record.name}"
+						raise ValueError(message)
+					if not record.line_bases:
+						record.line_bases, record.line_width = bases, len(line)
+					elif bases < record.line_bases or len(line) != record.line_width:
+						short_line = True
+					record.length += bases
+				else:
+					short_line = True
+			offset += len(line)
+	return records
+
+
+def get_index(path: Union[str, Path]) -> List[FastaRecord]:
+	""" Loads the `.fai` index of a fasta file, building and saving it first if it is missing or older than the file."""
+	path = Path(path)
+	filename = get_index_filename(path)
+	if filename.exists() and filename.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+		try:
+			return [FastaRecord.from_line(line) for line in filename.read_text().splitlines() if line]
+		except ValueError:
+			logger.warning(f"Could not read the fasta index {filename}")
+	records = build_index(path)
+	try:
+		filename.write_text("".join(i.to_line() for i in records))
+	except OSError:
+		logger.warning(f"Could not save the index of {path}")
+	return records
+
+
+class FastaFile:
+	"""
+		Fetches regions of the sequences in an uncompressed fasta file, which is memory-mapped rather than read.
+	Usage
+	-----
+		with FastaFile(filename) as fasta:
+			region = fasta.fetch("contig1", 100, 200)
+	"""
+
+	def __init__(self, filename: Union[str, Path]):
+		self.filename = Path(filename)
+		if fastqio.get_compression(self.filename):
+			message = f"Cannot memory-map the compressed file {self.filename}"
+			raise ValueError(message)
+		self.records: Dict[str, FastaRecord] = {i.name: i for i in get_index(self.filename)}
+		self._file = self.filename.open('rb')
+		try:
+			self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		except ValueError:
+			# Empty files can't be mapped.
+			self._map = None
+
+	def __enter__(self) -> 'FastaFile':
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		self._file.close()
+
+	@property
+	def names(self) -> List[str]:
+		return list(self.records)
+
+	@property
+	def lengths(self) -> Dict[str, int]:
+		return {name: record.length for name, record in self.records.items()}
+
+	def fetch(self, name: str, start: int = 0, end: Optional[int] = None) -> str:
+		"""
+			The bases of `name` from `start` up to, but not including, `end`. Positions are 0-based, as in pysam.
+		"""
+		try:
+			record = self.records[name]
+		except KeyError:
+			message = f"{self.filename} does not contain a sequence named {name}"
+			raise KeyError(message) from None
+		end = record.length if end is None else min(end, record.length)
+		start = max(start, 0)
+		if start >= end:
+			return ""
+		region = self._map[record.position(start):record.position(end - 1) + 1]
+		return region.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+	def __getitem__(self, name: str) -> str:
+		return self.fetch(name)
+
+
+def is_genbank(path: Path) -> bool:
+	""" Whether a file is in genbank format, going by the suffix or, failing that, the first line."""
+	name = fastqio.get_read_stem(path) if fastqio.get_compression(path) else path.name
+	if Path(name).suffix.lower() in GENBANK_SUFFIXES:
+		return True
+	try:
+		with fastqio.open_reads(path) as file1:
+			return file1.readline().startswith(b'LOCUS')
+	except OSError:
+		return False
+
+
+def genbank_to_fasta(genbank: Union[str, Path], output: Optional[Path] = None) -> Path:
+	"""
+		Converts the sequences in a genbank file to fasta. The conversion is skipped if `output` is newer than the
+		genbank file.
+	Parameters
+	----------
+	genbank: Path
+		The genbank file, which may be compressed.
+	output: Optional[Path]
+		Defaults to `{genbank}.fasta` next to the genbank file.
+	"""
+	genbank = Path(genbank)
+	output = output or genbank.with_name(genbank.name + ".fasta")
+	if output.exists() and output.stat().st_mtime_ns >= genbank.stat().st_mtime_ns:
+		return output
+
+	temporary = output.with_name(output.name + ".tmp")
+	with fastqio.open_reads(genbank, text = True) as file1, temporary.open('w') as file2:
+		name = None
+		in_sequence = False
+		remainder = ""
+		for line in file1:
+			if line.startswith('LOCUS'):
+				name = line.split()[1]
+			elif line.startswith('VERSION') and len(line.split()) > 1:
+				# The versioned accession is the name other tools use for the sequence.
+				name = line.split()[1]
+			elif line.startswith('ORIGIN'):
+				file2.write(f">{name}\n")
+				in_sequence = True
+			elif line.startswith('//'):
+				if remainder:
+					file2.write(remainder + "\n")
+				in_sequence, remainder = False, ""
+			elif in_sequence:
+				remainder += "".join(line.split()[1:])
+				while len(remainder) >= LINE_WIDTH:
+					file2.write(remainder[:LINE_WIDTH] + "\n")
+					remainder = remainder[LINE_WIDTH:]
+	temporary.replace(output)
+	logger.info(f"Converted {genbank} to {output}")
+	return output
+
+
+def get_fasta(reference: Union[str, Path]) -> Path:
+	""" The fasta version of a reference, converting genbank references the first time they are used."""
+	reference = Path(reference)
+	return genbank_to_fasta(reference) if is_genbank(reference) else reference
@@ -0,0 +1,337 @@
+"""
+	Reads FASTQ files whether or not they are compressed. Python code reads them through `open_reads()`. Programs which
+	can't read a format have their command wrapped by `decompress_command()`, which gives them a named pipe filled by a
+	(parallel, when installed) decompressor while the program runs, or a temporary plain copy for programs which read
+	their input more than once.
+"""
+import bz2
+import gzip
+import io
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy
+
+READ_SUFFIXES = ['.fastq', '.fq']
+
+# The compression format of each file suffix.
+COMPRESSION_SUFFIXES = {
+	'.gz': 'gzip',
+	'.bz2': 'bzip2',
+	'.zst': 'zstd'
+}
+
+# The programs which can decompress each format to stdout, in order of preference. The parallel versions come first.
+DECOMPRESSORS = {
+	'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+	'bzip2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+	'zstd': [['zstd', '-dcq']]
+}
+
+# The programs which compress stdin to stdout. The compression level is added to the end of each command.
+COMPRESSORS = {
+	'gzip': [['pigz', '-c'], ['gzip', '-c']],
+	'bzip2': [['lbzip2', '-c'], ['pbzip2', '-c'], ['bzip2', '-c']],
+	'zstd': [['zstd', '-cq']]
+}
+
+
+def get_compression(path: Union[str, Path]) -> Optional[str]:
+	""" Returns the compression format of a file (`gzip`, `bzip2`, or `zstd`) based on its suffix, or None."""
+	return COMPRESSION_SUFFIXES.get(Path(path).suffix)
+
+
+def get_read_stem(path: Union[str, Path]) -> str:
+	""" The filename without the compression and fastq suffixes. Ex. `sample_R1_001.fastq.gz` -> `sample_R1_001`"""
+	name = Path(path).name
+	for suffix in COMPRESSION_SUFFIXES:
+		if name.endswith(suffix):
+			name = name[:-len(suffix)]
+			break
+	for suffix in READ_SUFFIXES:
+		if name.endswith(suffix):
+			name = name[:-len(suffix)]
+			break
+	return name
+
+
+def is_read_file(path: Union[str, Path]) -> bool:
+	""" Whether the file looks like a fastq file, compressed or not. Files without a suffix are assumed to be reads."""
+	name = Path(path).name
+	stem = name
+	if get_compression(name):
+		stem = Path(name).stem
+	suffix = Path(stem).suffix
+	return suffix in READ_SUFFIXES or (suffix == '' and stem == name)
+
+
+def get_decompressor(compression: str) -> List[str]:
+	"""
+		Returns the command used to decompress a file to stdout.
+	Raises
+	------
+	FileNotFoundError: None of the programs which can decompress the format are installed.
+	"""
+	for command in DECOMPRESSORS[compression]:
+		if shutil.which(command[0]):
+			return command
+	message = f"Could not find a program to decompress {compression} files. Tried {[i[0] for i in DECOMPRESSORS[compression]]}"
+	raise FileNotFoundError(message)
+
+
+class _ProcessReader:
+	""" Wraps the stdout of a decompressor so it can be used like a file. Raises an error on close if the decompressor failed."""
+
+	def __init__(self, command: List[str], path: Path):
+		self.path = path
+		self.process = subprocess.Popen(command + [str(path)], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+		self.stream = self.process.stdout
+
+	def __getattr__(self, item):
+		return getattr(self.stream, item)
+
+	def __iter__(self):
+		return iter(self.stream)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	@property
+	def closed(self) -> bool:
+		return self.stream.closed
+
+	def close(self):
+		if self.stream.closed:
+			return
+		# Reading may have stopped early, so the decompressor can be stopped without checking its status.
+		finished = self.stream.read(1) == b""
+		self.stream.close()
+		if not finished:
+			self.process.kill()
+		self.process.wait()
+		stderr = self.process.stderr.read().decode()
+		self.process.stderr.close()
+		if finished and self.process.returncode != 0:
+			message = f"Could not decompress {self.path}: {stderr.strip()}"
+			raise OSError(message)
+
+
+def open_reads(path: Union[str, Path], text: bool = False) -> IO:
+	"""
+		Opens a fastq file for reading, decompressing it if needed.
+	Parameters
+	----------
+	path: Path
+	text: bool; default False
+		Whether to return a text stream rather than a binary one. Binary is much faster to parse.
+	"""
+	path = Path(path)
+	compression = get_compression(path)
+	if compression is None:
+		handle = path.open('rb')
+	else:
+		try:
+			handle = _ProcessReader(get_decompressor(compression), path)
+		except FileNotFoundError:
+			handle = _open_with_python(path, compression)
+	if text:
+		return io.TextIOWrapper(handle)
+	return handle
+
+
+@contextmanager
+def open_output(path: Union[str, Path], level: int = 1) -> Iterator[IO]:
+	"""
+		Opens a fastq file for writing in binary mode, compressing it according to its suffix. The data is compressed by
+		a separate (parallel, when installed) program, so compression doesn't hold up the python process.
+	Raises
+	------
+	OSError: The compressor failed.
+	"""
+	path = Path(path)
+	compression = get_compression(path)
+	if compression is None:
+		with path.open('wb') as file1:
+			yield file1
+		return
+	command = next((i for i in COMPRESSORS[compression] if shutil.which(i[0])), None)
+	if command is None:
+		with _open_with_python(path, compression, 'wb', level) as file1:
+			yield file1
+		return
+
+	with path.open('wb') as output:
+		process = subprocess.Popen(command + [f"-{level}"], stdin = subprocess.PIPE, stdout = output)
+		try:
+			yield process.stdin
+		finally:
+			process.stdin.close()
+			process.wait()
+	if process.returncode != 0:
+		message = f"Could not compress {path}: `{' '.join(command)}` exited with {process.returncode}"
+		raise OSError(message)
+
+
+def _open_with_python(path: Path, compression: str, mode: str = 'rb', level: int = 9) -> IO:
+	if compression == 'gzip':
+		return gzip.open(path, mode, compresslevel = level)
+	if compression == 'bzip2':
+		return bz2.open(path, mode, compresslevel = level)
+	try:
+		import zstandard
+	except ImportError:
+		message = f"Reading or writing {path} requires either the `zstd` program or the `zstandard` package."
+		raise FileNotFoundError(message)
+	if mode == 'wb':
+		return zstandard.ZstdCompressor(level = level).stream_writer(path.open('wb'), closefd = True)
+	return zstandard.ZstdDecompressor().stream_reader(path.open('rb'), closefd = True)
+
+
+# Decompresses reads for a program which can't read their format. Called as
+# `bash -c DECOMPRESS_SCRIPT bash mode folder decompressor1 source1 target1 ... -- program ...`
+# In the 'pipe' mode each target is a named pipe filled while the program runs. Otherwise the reads are decompressed
+# into the targets before the program starts.
+DECOMPRESS_SCRIPT = """
+mode=$1; folder=$2; shift 2
+mkdir -p "$folder"
+pids=(); status=0
+while [ "$1" != "--" ]; do
+	if [ "$mode" = "pipe" ]; then
+		mkfifo "$3"
+		$1 "$2" > "$3" &
+		pids+=($!)
+	else
+		$1 "$2" > "$3" || status=1
+	fi
+	shift 3
+done
+shift
+if [ $status -eq 0 ]; then
+	"$@"
+	status=$?
+fi
+# The program is finished, so any decompressor still running is waiting on a pipe which will never be read.
+kill "${pids[@]}" 2> /dev/null
+for pid in "${pids[@]}"; do
+	wait "$pid"
+	# Only fail for decompressors which exited on their own. 141 and 143 are SIGPIPE and SIGTERM.
+	code=$?
+	[ $code -eq 0 ] || [ $code -eq 141 ] || [ $code -eq 143 ] || status=1
+done
+rm -rf "$folder"
+exit $status
+"""
+
+
+def get_decompression_folder(output_folder: Path, program: str) -> Path:
+	"""
+		Where a program's reads are decompressed when it can't read their format. This is next to the output folder rather
+		than inside it, since some programs (ex. shovill with `--force`) clear their output folder when they start.
+	"""
+	output_folder = Path(output_folder)
+	return output_folder.parent / f".{output_folder.name}.{program}.reads"
+
+
+def decompress_command(command: List[str], reads: Iterable[Path], supported: Iterable[Optional[str]], folder: Path,
+		single_pass: bool = True) -> List[str]:
+	"""
+		Lets a program read fastq files compressed with a format it can't open itself. Each of `reads` compressed with a
+		format missing from `supported` is replaced in `command` by a plain fastq file in `folder`. The decompression
+		happens inside the returned command, so it also works for commands which run on another node (ex. slurm job arrays).
+		The command is returned unchanged if the program can read every file.
+	Parameters
+	----------
+	command: List[str]
+	reads: Iterable[Path]
+		The read files given to the program.
+	supported: Iterable[Optional[str]]
+		The compression formats the program can read, with None for uncompressed files.
+	folder: Path
+		Where the plain files are created while the program runs. Should not be inside the program's output folder.
+	single_pass: bool; default True
+		Whether the program reads each file once from beginning to end, so it can be given a named pipe. Otherwise the
+		reads are decompressed to disk before the program starts and removed once it finishes.
+	"""
+	supported = set(supported)
+	command = [str(i) for i in command]
+	files = list()
+	for source in reads:
+		compression = get_compression(source)
+		if compression in supported:
+			continue
+		target = folder / (get_read_stem(source) + ".fastq")
+		command = [str(target) if i == str(source) else i for i in command]
+		files += [" ".join(get_decompressor(compression)), str(source), str(target)]
+	if not files:
+		return command
+	mode = "pipe" if single_pass else "file"
+	return ["bash", "-c", DECOMPRESS_SCRIPT, "bash", mode, str(folder)] + files + ["--"] + command
+
+
+def iter_record_chunks(path: Union[str, Path], chunk_size: int = 2 ** 22, start: int = 0, end: Optional[int] = None,
+		strict: bool = False) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray, int]]:
+	"""
+		Reads a fastq file in chunks of complete records.
+	Parameters
+	----------
+	path: Path
+	chunk_size: int; default 4 MiB
+		The number of bytes to read at once.
+	start, end: int
+		The byte range to read, in the uncompressed file. `start` should be the beginning of a record (ex. an offset
+		from a `readindex.ReadIndex`). Compressed files can't seek, so anything before `start` is read and discarded.
+	strict: bool; default False
+		Whether to raise a ValueError if the file ends partway through a record. Otherwise the partial record is ignored.
+	Yields
+	------
+	buffer: numpy.ndarray
+		The bytes of the chunk.
+	newlines: numpy.ndarray
+		The position of the four newlines of each record in `buffer`, with shape `(records, 4)`.
+	offset: int
+		The position of `buffer` in the uncompressed file.
+	"""
+	leftover = b""
+	offset = start
+	remaining = None if end is None else end - start
+	with open_reads(path) as file1:
+		if start:
+			if get_compression(path) is None:
+				file1.seek(start)
+			else:
+				skipped = 0
+				while skipped < start:
+					discarded = file1.read(min(chunk_size, start - skipped))
+					if not discarded:
+						break
+					skipped += len(discarded)
+		while True:
+			size = chunk_size if remaining is None else min(chunk_size, remaining)
+			chunk = file1.read(size) if size > 0 else b""
+			if remaining is not None:
+				remaining -= len(chunk)
+			data = leftover + chunk
+			if not chunk and data and not data.endswith(b"\n"):
+				data += b"\n"
+			buffer = numpy.frombuffer(data, dtype = numpy.uint8)
+			newlines = numpy.flatnonzero(buffer == ord("\n"))
+			count = len(newlines) // 4
+			if count:
+				newlines = newlines[:count * 4].reshape(count, 4)
+				yield buffer, newlines, offset
+				used = int(newlines[-1, -1]) + 1
+				offset += used
+				leftover = data[used:]
+			else:
+				leftover = data
+			if not chunk:
+				break
+	if strict and leftover.strip():
+		message = f"{path} ends partway through a record."
+		raise ValueError(message)
@@ -0,0 +1,312 @@
+"""
+	Reads the GenomeDiff (`output/output.gd`) files breseq writes for each sample and merges the mutations of a whole
+	cohort into a single matrix of frequencies, with one row per mutation and one column per sample. The matrix is saved
+	as a `.npz` file and updated one sample at a time, so a sample is only read again when its GenomeDiff changes.
+	The format is described at https://barricklab.org/twiki/pub/Lab/ToolsBacterialGenomeResequencing/documentation/gd_format.html
+"""
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest, utilities
+
+VERSION = "1"
+
+# The positional fields of each record type, after the type, id, and parent ids.
+FIELDS = {
+	# Mutations
+	'SNP': ['seq_id', 'position', 'new_seq'],
+	'SUB': ['seq_id', 'position', 'size', 'new_seq'],
+	'DEL': ['seq_id', 'position', 'size'],
+	'INS': ['seq_id', 'position', 'new_seq'],
+	'MOB': ['seq_id', 'position', 'repeat_name', 'strand', 'duplication_size'],
+	'AMP': ['seq_id', 'position', 'size', 'new_copy_number'],
+	'CON': ['seq_id', 'position', 'size', 'region'],
+	'INV': ['seq_id', 'position', 'size'],
+	# Evidence
+	'RA': ['seq_id', 'position', 'insert_position', 'ref_base', 'new_base'],
+	'MC': ['seq_id', 'start', 'end', 'start_range', 'end_range'],
+	'JC': ['side_1_seq_id', 'side_1_position', 'side_1_strand', 'side_2_seq_id', 'side_2_position', 'side_2_strand', 'overlap'],
+	'UN': ['seq_id', 'start', 'end'],
+	'CN': ['seq_id', 'start', 'end', 'copy_number'],
+	# Validation
+	'TSEQ': ['seq_id', 'primer1_start', 'primer1_end', 'primer2_start', 'primer2_end'],
+	'PFLP': ['seq_id', 'primer1_start', 'primer1_end', 'primer2_start', 'primer2_end'],
+	'RFLP': ['seq_id', 'primer1_start', 'primer1_end', 'primer2_start', 'primer2_end', 'enzyme'],
+	'PFGE': ['seq_id', 'restriction_enzyme'],
+	'PHYL': ['gd'],
+	'CURA': ['expert'],
+	'FPOS': ['expert'],
+	'PHYLO': ['gd']
+}
+MUTATIONS = {'SNP', 'SUB', 'DEL', 'INS', 'MOB', 'AMP', 'CON', 'INV'}
+EVIDENCE = {'RA', 'MC', 'JC', 'UN', 'CN'}
+
+
+def _convert(value: str) -> Union[int, float, str]:
+	""" Converts numeric values. Everything else (sequences, names, `NA`, etc.) is kept as a string."""
+	try:
+		return int(value)
+	except ValueError:
+		pass
+	try:
+		return float(value)
+	except ValueError:
+		return value
+
+
+@dataclass
+class Record:
+	"""
+		A single line of a GenomeDiff file.
+	Attributes
+	----------
+	parents: List[int]
+		The ids of the evidence supporting a mutation. Empty for evidence.
+	values: Dict[str, Union[int, float, str]]
+		The positional fields of the record type (see `FIELDS`) along with any `key=value` fields.
+	"""
+	type: str
+	id: int
+	parents: List[int]
+	values: Dict[str, Union[int, float, str]] = field(default_factory = dict)
+
+	@property
+	def seq_id(self) -> Optional[str]:
+		return self.values.get('seq_id', self.values.get('side_1_seq_id'))
+
+	@property
+	def position(self) -> Optional[int]:
+		return self.values.get('position', self.values.get('start', self.values.get('side_1_position')))
+
+	@property
+	def frequency(self) -> float:
+		""" Mutations and evidence without a frequency were predicted in every read."""
+		frequency = self.values.get('frequency', 1.0)
+		return float(frequency) if isinstance(frequency, (int, float)) else 1.0
+
+	@property
+	def allele(self) -> str:
+		""" Describes the change, which separates different mutations at the same position."""
+		for key in ['new_seq', 'new_base', 'repeat_name', 'new_copy_number', 'region']:
+			if key in self.values:
+				return str(self.values[key])
+		return str(self.values.get('size', ''))
+
+	@classmethod
+	def from_line(cls, line: str) -> 'Record':
+		columns = line.rstrip('\r\n').split('\t')
+		record_type, identifier, parents, *remaining = columns
+		names = FIELDS.get(record_type, [])
+		values = dict()
+		for index, value in enumerate(remaining):
+			if index < len(names):
+				values[names[index]] = _convert(value)
+			else:
+				key, _, value = value.partition('=')
+				values[key] = _convert(value)
+		parents = [int(i) for i in parents.split(',') if i not in {'', '.'}]
+		return cls(record_type, int(identifier), parents, values)
+
+
+@dataclass
+class GenomeDiff:
+	"""
+	Attributes
+	----------
+	metadata: Dict[str, List[str]]
+		The `#=KEY value` header lines. Keys such as `READSEQ` can appear more than once.
+	"""
+	filename: Path
+	metadata: Dict[str, List[str]]
+	mutations: List[Record]
+	evidence: List[Record]
+	validation: List[Record]
+
+	@classmethod
+	def from_file(cls, filename: Path) -> 'GenomeDiff':
+		metadata = dict()
+		mutations, evidence, validation = list(), list(), list()
+		with Path(filename).open() as file1:
+			for line in file1:
+				if line.startswith('#='):
+					key, _, value = line[2:].rstrip('\r\n').partition('\t')
+					metadata.setdefault(key, []).append(value.strip())
+				elif line.strip() and not line.startswith('#'):
+					record = Record.from_line(line)
+					if record.type in MUTATIONS:
+						mutations.append(record)
+					elif record.type in EVIDENCE:
+						evidence.append(record)
+					else:
+						validation.append(record)
+		return cls(Path(filename), metadata, mutations, evidence, validation)
+
+	def evidence_for(self, mutation: Record) -> List[Record]:
+		""" The evidence records which support a mutation."""
+		parents = set(mutation.parents)
+		return [i for i in self.evidence if i.id in parents]
+
+	def polymorphisms(self) -> List[Record]:
+		""" Read alignment evidence which breseq considers a polymorphism rather than a mutation of the whole sample."""
+		return [i for i in self.evidence if i.type == 'RA' and i.values.get('prediction') == 'polymorphism']
+
+
+def iter_metadata(filename: Path) -> Iterator[Tuple[str, str]]:
+	""" Yields the `#=KEY value` header lines of a GenomeDiff file without reading the records."""
+	with Path(filename).open() as file1:
+		for line in file1:
+			if not line.startswith('#'):
+				break
+			if line.startswith('#='):
+				key, _, value = line[2:].rstrip('\r\n').partition('\t')
+				yield key, value.strip()
+
+
+def get_sample_name(filename: Path) -> Optional[str]:
+	""" Gets the name of a sample from the first read file listed in the header of its GenomeDiff file."""
+	for key, value in iter_metadata(filename):
+		if key == 'READSEQ':
+			return utilities.get_name_from_reads(value) or fastqio.get_read_stem(value).split('.')[0]
+	return None
+
+
+class CohortMatrix:
+	"""
+		The frequency of each mutation in each sample of a cohort. Samples without a mutation have a frequency of 0.
+	Attributes
+	----------
+	seq_ids, positions, types, alleles: numpy.ndarray
+		Identify each mutation (row).
+	samples: List[str]
+		The name of each sample (column).
+	frequencies: numpy.ndarray
+		A float32 array with shape `(mutations, samples)`.
+	sources: Dict[str, Optional[Dict]]
+		The fingerprint of the GenomeDiff file each sample was loaded from.
+	"""
+
+	def __init__(self):
+		self.seq_ids = numpy.zeros(0, dtype = object)
+		self.positions = numpy.zeros(0, dtype = numpy.int64)
+		self.types = numpy.zeros(0, dtype = object)
+		self.alleles = numpy.zeros(0, dtype = object)
+		self.samples: List[str] = list()
+		self.frequencies = numpy.zeros((0, 0), dtype = numpy.float32)
+		self.sources: Dict[str, Dict] = dict()
+		self._rows: Dict[Tuple[str, int, str, str], int] = dict()
+
+	def __len__(self) -> int:
+		return len(self.positions)
+
+	def _get_rows(self, mutations: List[Record]) -> numpy.ndarray:
+		""" The row of each mutation, adding rows for mutations which haven't been seen in any other sample."""
+		rows = list()
+		new = list()
+		for mutation in mutations:
+			key = (str(mutation.seq_id), int(mutation.position), mutation.type, mutation.allele)
+			if key not in self._rows:
+				self._rows[key] = len(self._rows)
+				new.append(key)
+			rows.append(self._rows[key])
+		if new:
+			seq_ids, positions, types, alleles = zip(*new)
+			self.seq_ids = numpy.concatenate([self.seq_ids, numpy.array(seq_ids, dtype = object)])
+			self.positions = numpy.concatenate([self.positions, numpy.array(positions, dtype = numpy.int64)])
+			self.types = numpy.concatenate([self.types, numpy.array(types, dtype = object)])
+			self.alleles = numpy.concatenate([self.alleles, numpy.array(alleles, dtype = object)])
+			padding = numpy.zeros((len(new), len(self.samples)), dtype = numpy.float32)
+			self.frequencies = numpy.concatenate([self.frequencies, padding])
+		return numpy.array(rows, dtype = numpy.int64)
+
+	def add_sample(self, name: str, genomediff: GenomeDiff):
+		""" Adds the mutations of a sample, replacing any previous values for the same sample."""
+		rows = self._get_rows(genomediff.mutations)
+		if name in self.samples:
+			column = self.samples.index(name)
+			self.frequencies[:, column] = 0
+		else:
+			column = len(self.samples)
+			self.samples.append(name)
+			self.frequencies = numpy.concatenate([self.frequencies, numpy.zeros((len(self), 1), dtype = numpy.float32)], axis = 1)
+		self.frequencies[rows, column] = [i.frequency for i in genomediff.mutations]
+		self.sources[name] = {str(genomediff.filename): manifest.fingerprint(genomediff.filename)}
+
+	def is_current(self, name: str, filename: Path) -> bool:
+		""" Whether the sample was already added from the current version of `filename`."""
+		expected = self.sources.get(name, {})
+		return str(filename) in expected and manifest.fingerprint_matches(filename, expected[str(filename)])
+
+	def update(self, samples: Dict[str, Path]) -> List[str]:
+		"""
+			Adds each sample whose GenomeDiff file changed since it was last added.
+		Parameters
+		----------
+		samples: Dict[str, Path]
+			The GenomeDiff file of each sample.
+		Returns
+		-------
+		List[str]
+			The samples which were added or updated.
+		"""
+		updated = list()
+		for name, filename in samples.items():
+			filename = Path(filename)
+			if self.is_current(name, filename):
+				continue
+			self.add_sample(name, GenomeDiff.from_file(filename))
+			updated.append(name)
+		return updated
+
+	def save(self, filename: Path):
+		# Each sample is checked against its own GenomeDiff file, so the matrix as a whole doesn't have any sources.
+		arrays = {
+			'seq_ids': self.seq_ids.astype(str),
+			'positions': self.positions,
+			'types': self.types.astype(str),
+			'alleles': self.alleles.astype(str),
+			'samples': numpy.array(self.samples, dtype = str),
+			'frequencies': self.frequencies,
+			'sources': numpy.array(json.dumps(self.sources))
+		}
+		manifest.save_sidecar(filename, VERSION, [], arrays, compress = True)
+
+	@classmethod
+	def load(cls, filename: Path) -> 'CohortMatrix':
+		""" Loads a saved matrix. Returns an empty matrix if there is none or it was saved by an older version."""
+		matrix = cls()
+		arrays = manifest.load_sidecar(filename, VERSION, [])
+		if arrays is None:
+			return matrix
+		matrix.seq_ids = arrays['seq_ids'].astype(object)
+		matrix.positions = arrays['positions']
+		matrix.types = arrays['types'].astype(object)
+		matrix.alleles = arrays['alleles'].astype(object)
+		matrix.samples = arrays['samples'].tolist()
+		matrix.frequencies = arrays['frequencies'].reshape(len(matrix.positions), len(matrix.samples))
+		matrix.sources = json.loads(str(arrays['sources']))
+		matrix._rows = {key: index for index, key in enumerate(zip(matrix.seq_ids, matrix.positions.tolist(), matrix.types, matrix.alleles))}
+		return matrix
+
+	def sample(self, name: str) -> Dict[Tuple[str, int, str, str], float]:
+		""" The frequency of every mutation found in a single sample."""
+		column = self.frequencies[:, self.samples.index(name)]
+		return {key: float(column[index]) for key, index in self._rows.items() if column[index] > 0}
+
+	def shared(self, minimum: float = 0.0) -> numpy.ndarray:
+		""" The number of samples each mutation was found in with a frequency above `minimum`."""
+		return (self.frequencies > minimum).sum(axis = 1)
+
+
+def update_cohort_matrix(filename: Path, samples: Dict[str, Path]) -> CohortMatrix:
+	""" Loads the cohort matrix saved at `filename`, adds any new or updated samples, and saves it again."""
+	matrix = CohortMatrix.load(filename)
+	updated = matrix.update(samples)
+	if updated:
+		logger.info(f"Added {len(updated)} samples to the cohort matrix at {filename}")
+		matrix.save(filename)
+	return matrix
@@ -0,0 +1,148 @@
+"""
+	Makes each step's output appear atomically and keeps a project-level journal of every step.
+	Programs write into a staging folder next to their output folder, which is only moved into place once the
+	program finishes successfully. The journal records when each step starts, finishes, or fails, so an interrupted
+	run can be cleaned up and resumed without redoing the samples that already finished.
+"""
+import json
+import shlex
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
+
+from loguru import logger
+
+
+class StagedOutput:
+	"""
+		The staging folder for a single step.
+	Parameters
+	----------
+	folder: Path
+		The final output folder.
+	tool: str
+		The name of the program. Lets several programs share an output folder without sharing a staging folder.
+	"""
+
+	def __init__(self, folder: Path, tool: str):
+		self.folder = Path(folder)
+		self.tool = tool
+		self.staging = self.folder.parent / f".{self.folder.name}.{tool}.staging"
+
+	@property
+	def key(self) -> str:
+		return f"{self.tool}:{self.folder}"
+
+	def prepare(self):
+		""" Creates an empty staging folder, removing anything left by an interrupted run."""
+		self.discard()
+		self.staging.mkdir(parents = True)
+
+	def discard(self):
+		if self.staging.exists():
+			shutil.rmtree(self.staging)
+
+	def rewrite(self, command: List[str], inputs: Iterable[Path] = ()) -> List[str]:
+		""" Points every argument inside the output folder at the staging folder instead. Input files are left alone."""
+		inputs = {str(i) for i in inputs}
+		prefix = str(self.folder)
+		result = list()
+		for argument in command:
+			if argument not in inputs and (argument == prefix or argument.startswith(prefix + "/")):
+				argument = str(self.staging) + argument[len(prefix):]
+			result.append(argument)
+		return result
+
+	def commit(self):
+		"""
+			Moves the contents of the staging folder into the output folder. Other files already in the output folder
+			are left in place, since some output folders are shared (ex. a sample folder containing trimmed reads and a
+			breseq folder).
+		"""
+		if not self.folder.exists() or not any(self.folder.iterdir()):
+			if self.folder.exists():
+				self.folder.rmdir()
+			self.staging.replace(self.folder)
+			return
+		for source in self.staging.iterdir():
+			target = self.folder / source.name
+			if target.is_dir() and not target.is_symlink():
+				shutil.rmtree(target)
+			source.replace(target)
+		self.staging.rmdir()
+
+	def commit_command(self) -> str:
+		""" A shell version of `commit()`, for commands which run on another machine (ex. slurm job arrays)."""
+		staging = shlex.quote(str(self.staging))
+		folder = shlex.quote(str(self.folder))
+		return (
+			f"mkdir -p {folder} && "
+			f"find {staging} -mindepth 1 -maxdepth 1 -exec sh -c 'rm -rf \"$1/$(basename \"$2\")\" && mv \"$2\" \"$1/\"' _ {folder} {{}} \\; && "
+			f"rmdir {staging}"
+		)
+
+
+class RunJournal:
+	"""
+		An append-only log of step events, saved as one json object per line.
+		Each event is one of 'start', 'finish', or 'fail'.
+	"""
+
+	def __init__(self, filename: Union[str, Path]):
+		self.filename = Path(filename)
+		self._lock = threading.Lock()
+
+	def record(self, event: str, staged: StagedOutput, **details):
+		line = {
+			'time': datetime.now().isoformat(),
+			'event': event,
+			'key': staged.key,
+			'folder': str(staged.folder),
+			'staging': str(staged.staging),
+			**details
+		}
+		with self._lock, self.filename.open('a') as file1:
+			file1.write(json.dumps(line) + "\n")
+
+	def start(self, staged: StagedOutput):
+		self.record('start', staged)
+
+	def finish(self, staged: StagedOutput):
+		self.record('finish', staged)
+
+	def fail(self, staged: StagedOutput, exit_code: int = None):
+		self.record('fail', staged, exit_code = exit_code)
+
+	def events(self) -> Dict[str, Dict]:
+		""" The most recent event for each step."""
+		latest = dict()
+		if not self.filename.exists():
+			return latest
+		with self.filename.open() as file1:
+			for line in file1:
+				try:
+					event = json.loads(line)
+				except ValueError:
+					# The last line may be incomplete if the driver was killed while writing it.
+					continue
+				latest[event['key']] = event
+		return latest
+
+	def completed(self) -> List[str]:
+		return [key for key, event in self.events().items() if event['event'] == 'finish']
+
+	def interrupted(self) -> List[Dict]:
+		""" Steps which started but never finished or failed. These were running when the driver or node died."""
+		return [event for event in self.events().values() if event['event'] == 'start']
+
+	def recover(self):
+		""" Removes the staging folders left behind by interrupted steps."""
+		for event in self.interrupted():
+			staging = Path(event['staging'])
+			logger.warning(f"Journal: '{event['key']}' was interrupted. Removing {staging}")
+			if staging.exists():
+				shutil.rmtree(staging)
+			with self._lock, self.filename.open('a') as file1:
+				file1.write(json.dumps({**event, 'time': datetime.now().isoformat(), 'event': 'fail'}) + "\n")
@@ -0,0 +1,134 @@
+"""
+	A machine-readable record of the resources used by every command run through `systemio.CommandRunner`.
+	Each line of the ledger is a json object describing a single command.
+
+	Commands run through srun or a slurm job array can't be measured by the driver, so they are wrapped with
+	`measure_command()`. This runs the program through this file where the program runs, and saves its usage for the
+	driver to add to the ledger. This module only uses the standard library, so it runs as a plain script.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+
+@dataclass
+class LedgerRecord:
+	tool: str
+	command: List[str]
+	start: str  # ISO 8601 timestamp
+	wall_seconds: float
+	user_seconds: float
+	system_seconds: float
+	max_rss_kb: int
+	exit_code: int
+	threads: int
+	# The size of each input file given on the command line, in bytes.
+	inputs: Dict[str, int] = field(default_factory = dict)
+	# Whether the command was run with srun. If so, the cpu and memory usage refer to the srun client rather than the
+	# program, unless `in_job` is set.
+	srun: bool = False
+	# Whether the usage was measured by `measure()` inside the srun allocation or slurm job.
+	in_job: bool = False
+
+	@property
+	def input_bytes(self) -> int:
+		return sum(self.inputs.values())
+
+	@property
+	def cpu_seconds(self) -> float:
+		return self.user_seconds + self.system_seconds
+
+
+class RunLedger:
+	def __init__(self, filename: Union[str, Path]):
+		self.filename = Path(filename)
+		self._lock = threading.Lock()
+
+	def append(self, record: LedgerRecord):
+		line = json.dumps(asdict(record))
+		with self._lock, self.filename.open('a') as file1:
+			file1.write(line + "\n")
+
+	def records(self, tool: Optional[str] = None) -> List[LedgerRecord]:
+		""" Reads the ledger. If `tool` is given, only the records for that tool are returned."""
+		if not self.filename.exists():
+			return []
+		records = list()
+		with self.filename.open() as file1:
+			for line in file1:
+				if not line.strip():
+					continue
+				record = LedgerRecord(**json.loads(line))
+				if tool is None or record.tool == tool:
+					records.append(record)
+		return records
+
+
+def get_input_sizes(command: List[str], output_folder: Optional[Path] = None) -> Dict[str, int]:
+	""" Finds the arguments of a command which refer to existing files, ignoring anything inside the output folder."""
+	sizes = dict()
+	for argument in command:
+		path = Path(argument)
+		try:
+			if not path.is_file():
+				continue
+		except OSError:
+			# Arguments such as long option strings may not be valid paths.
+			continue
+		if output_folder and Path(output_folder) in path.parents:
+			continue
+		sizes[argument] = path.stat().st_size
+	return sizes
+
+
+def get_usage_filename(output_folder: Path, tool: str) -> Path:
+	""" Where `measure()` saves the usage of a program. This is next to the output folder, which may be staged or replaced."""
+	output_folder = Path(output_folder)
+	return output_folder.parent / f".{output_folder.name}.{tool}.usage.json"
+
+
+def measure_command(command: List[str], filename: Path) -> List[str]:
+	""" Wraps a command so its resource usage is measured wherever it runs and saved to `filename`."""
+	return [sys.executable, str(Path(__file__).resolve()), str(filename)] + [str(i) for i in command]
+
+
+def measure(filename: Path, command: List[str]) -> int:
+	""" Runs a command and saves its resource usage to `filename` as json. Returns the command's exit code."""
+	start = datetime.now()
+	process = subprocess.Popen(command)
+	# `Popen.wait()` would discard the resource usage of the child, so reap it directly.
+	_, status, usage = os.wait4(process.pid, 0)
+	exit_code = os.waitstatus_to_exitcode(status)
+	result = {
+		'start': start.isoformat(),
+		'wall_seconds': (datetime.now() - start).total_seconds(),
+		'user_seconds': usage.ru_utime,
+		'system_seconds': usage.ru_stime,
+		'max_rss_kb': usage.ru_maxrss,
+		'exit_code': exit_code
+	}
+	Path(filename).write_text(json.dumps(result))
+	# Programs stopped by a signal exit with a negative code. Report them the way a shell would.
+	return exit_code if exit_code >= 0 else 128 - exit_code
+
+
+def read_usage(filename: Path) -> Optional[Dict]:
+	""" Loads and removes the usage saved by `measure()`. Returns None if the program never finished."""
+	filename = Path(filename)
+	try:
+		usage = json.loads(filename.read_text())
+	except (OSError, ValueError):
+		return None
+	filename.unlink()
+	return usage
+
+
+if __name__ == "__main__":
+	# Called as `python ledger.py usage.json program ...` by `measure_command()`.
+	sys.exit(measure(Path(sys.argv[1]), sys.argv[2:]))
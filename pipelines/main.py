@@ -6,24 +6,33 @@ from typing import Dict, List, Optional, Tuple, Union
 
 from loguru import logger
 
-from pipelines import sampleio
+from pipelines import fastqio, sampleio, slurm, systemio
 #from pipelines.processes import read_assembly
 from pipelines.processes.variant_calling import sample_variant_calling
 from pipelines.processes.read_trimming import trim
+from pipelines.processes import pipeline
+from pipelines.programs import breseq, trimmomatic
 from pipelines import utilities
+from pipelines.programs.registry import registry
 #from pipelines import programio
 
 def _shelly_get_sample_reads_from_folder(folder:Path)->Optional[Tuple[Path,Path]]:
-	reads = list(folder.iterdir())
+	reads = utilities.FolderSnapshot.of(folder).paths
 	try:
-		read_forward = [i for i in reads if i.stem.endswith('1')][0]
-		read_reverse = [i for i in reads if i.stem.endswith('2')][0]
+		read_forward = [i for i in reads if fastqio.get_read_stem(i).endswith('1')][0]
+		read_reverse = [i for i in reads if fastqio.get_read_stem(i).endswith('2')][0]
 	except IndexError:
 		return None
 	return read_forward, read_reverse
 
-def collect_samples_from_folder(folder:Path)->List[Dict[str,Union[str,Path]]]:
+def collect_samples_from_folder(folder:Path, catalog = None)->List[Dict[str,Union[str,Path]]]:
 	result = list()
+	if catalog is not None:
+		# The catalog only lists the folders which changed since the last launch.
+		catalog.update(folder, max_depth = 1)
+		for sample in catalog.samples(parent = folder):
+			result.append({'sampleName': sample.folder.name, 'readForward': sample.forward, 'readReverse': sample.reverse})
+		return result
 	for subfolder in folder.iterdir():
 		reads = _shelly_get_sample_reads_from_folder(subfolder)
 
@@ -39,7 +48,7 @@ def collect_samples_from_folder(folder:Path)->List[Dict[str,Union[str,Path]]]:
 			logger.warning(message)
 	return result
 
-def main_shelly():
+def main_shelly(batch: bool = False):
 	logger.info(" Running the large dataset of samples.")
 
 	project_folder = Path.home() / "projects" / "shelly"
@@ -48,8 +57,26 @@ def main_shelly():
 
 	reference = project_folder / "T4.gbff"
 	samples = sampleio.get_samples_from_table(table_filename)
-	# Trim the reads
-	trimmed_output = trim(samples, project_output_folder)
-	trimmed_samples = [i.as_sample() for i in trimmed_output]
-	# Call variants
-	sample_variant_calling(reference, trimmed_samples, project_output_folder, ispop = True)
\ No newline at end of file
+	# Probe every program up front so each stage doesn't have to.
+	registry.resolve(["trimmomatic", "breseq"])
+	if batch:
+		# Submit each stage as a single job array. Variant calling is queued right away and starts once trimming finishes.
+		backend = slurm.SlurmBackend(project_folder / "slurm")
+		with systemio.command_runner.batch(backend, "trimmomatic", wait = False) as trimming:
+			trimmed_output = trim(samples, project_output_folder)
+		trimmed_samples = [i.as_sample() for i in trimmed_output]
+		with systemio.command_runner.batch(backend, "breseq", dependency = trimming.job):
+			sample_variant_calling(reference, trimmed_samples, project_output_folder, ispop = True, verify = False)
+		# Trimming finished before variant calling started. This saves its manifests and journal entries.
+		backend.wait(trimming.job)
+		return
+
+	# Each sample moves on to variant calling as soon as its own reads are trimmed.
+	systemio.command_runner.set_command_log(project_output_folder / "commandlog.sh")
+	stages = [
+		# The trimmed reads are saved directly in each sample's folder.
+		pipeline.trimming_stage(trimmomatic.Trimmomatic(), folder_name = "."),
+		pipeline.variant_calling_stage(breseq.Breseq(reference, threads = 16, population = True))
+	]
+	workflow = pipeline.Pipeline(project_output_folder, stages)
+	workflow.run(samples)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+	Records what produced each step's output so a rerun can tell whether the output is still valid.
+	A manifest is only written once a step finishes successfully, so a partially-written output from a killed job is
+	never mistaken for a finished one. A step is redone when any of its inputs, its command, or the program version
+	change.
+"""
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from loguru import logger
+
+# Whether to also compare the full sha256 hash of each input when the size or modification time changed.
+# This catches files which were copied or touched without being modified, at the cost of reading them.
+full_hash: bool = False
+
+
+def get_hash(path: Path) -> str:
+	digest = hashlib.sha256()
+	with path.open('rb') as file1:
+		for chunk in iter(lambda: file1.read(2 ** 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def fingerprint(path: Path, include_hash: bool = False) -> Optional[Dict[str, Union[int, str]]]:
+	""" Describes the current state of a file. Returns None if the file does not exist."""
+	try:
+		stat = path.stat()
+	except FileNotFoundError:
+		return None
+	result = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+	if include_hash and path.is_file():
+		result['sha256'] = get_hash(path)
+	return result
+
+
+def fingerprint_matches(path: Path, expected: Optional[Dict]) -> bool:
+	current = fingerprint(path)
+	if current is None or expected is None:
+		return current == expected
+	if current['size'] != expected['size']:
+		return False
+	if current['mtime'] == expected['mtime']:
+		return True
+	# Same size but a different modification time. Only the content hash can tell whether it actually changed.
+	if 'sha256' in expected and path.is_file():
+		return get_hash(path) == expected['sha256']
+	return False
+
+
+def save_sidecar(filename: Path, version: str, sources: Iterable[Path], contents: Dict[str, Any],
+		parameters: Optional[Dict] = None, compress: bool = False):
+	"""
+		Saves a result calculated from `sources`, such as an index or a set of statistics, so it can be reused until
+		any of the sources change. The result is saved as json, or as the arrays of an npz file when `filename` ends
+		with `.npz`. Failing to save is only logged, since the result can always be calculated again.
+	Parameters
+	----------
+	filename: Path
+	version: str
+		Should change whenever how `contents` is calculated or laid out changes, so older results are regenerated.
+	sources: Iterable[Path]
+		The files `contents` was calculated from.
+	contents: Dict[str, Any]
+		A json-serializable dictionary, or a dictionary of numpy arrays for npz files.
+	parameters: Optional[Dict]
+		Any options which affect `contents`. A saved result is only reused with the same parameters.
+	compress: bool; default False
+		Whether to compress the arrays of an npz file.
+	"""
+	details = {
+		'version': version,
+		'parameters': parameters or dict(),
+		'inputs': {str(i): fingerprint(Path(i)) for i in sources}
+	}
+	# Write to a temporary file first so a crash, or another process saving the same result, doesn't leave a partial
+	# file behind.
+	temporary = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+	try:
+		filename.parent.mkdir(parents = True, exist_ok = True)
+		with temporary.open('wb') as file1:
+			if filename.suffix == '.npz':
+				import numpy
+				save = numpy.savez_compressed if compress else numpy.savez
+				save(file1, details = numpy.array(json.dumps(details)), **contents)
+			else:
+				file1.write(json.dumps({**details, 'contents': contents}, indent = 4).encode())
+		temporary.replace(filename)
+	except OSError:
+		logger.warning(f"Could not save {filename}")
+
+
+def load_sidecar(filename: Path, version: str, sources: Iterable[Path],
+		parameters: Optional[Dict] = None) -> Optional[Dict[str, Any]]:
+	"""
+		Loads the contents saved by `save_sidecar()`. Returns None if there is nothing saved, or if it was saved by
+		a different version, with different parameters, or from different or modified sources.
+	"""
+	try:
+		if filename.suffix == '.npz':
+			import numpy
+			with numpy.load(filename) as arrays:
+				details = json.loads(str(arrays['details']))
+				contents = {key: arrays[key] for key in arrays.files if key != 'details'}
+		else:
+			details = json.loads(filename.read_text())
+			contents = details['contents']
+		current = details['version'] == version and details['parameters'] == (parameters or dict())
+		inputs = details['inputs']
+	except (OSError, ValueError, TypeError, KeyError):
+		return None
+	if not current or sorted(inputs) != sorted(str(i) for i in sources):
+		return None
+	if not all(fingerprint_matches(Path(path), expected) for path, expected in inputs.items()):
+		return None
+	return contents
+
+
+@dataclass
+class StepManifest:
+	tool: str
+	version: Optional[str]
+	command: List[str]
+	inputs: Dict[str, Optional[Dict]] = field(default_factory = dict)
+	outputs: Dict[str, Optional[Dict]] = field(default_factory = dict)
+
+
+class Step:
+	"""
+		A single run of a program that produces files in `folder`.
+	Parameters
+	----------
+	folder: Path
+		The output folder of the step. The manifest is saved here as `.{tool}.manifest.json`.
+	tool: str
+	command: List[str]
+		The full command. Any change to the parameters changes the command and invalidates the output.
+	inputs: Iterable[Path]
+		The files the step reads.
+	outputs: Iterable[Path]
+		The files that must exist for the step to be considered finished.
+	version: Optional[str]
+		The version of the program.
+	"""
+
+	def __init__(self, folder: Path, tool: str, command: List[str], inputs: Iterable[Path], outputs: Iterable[Path],
+			version: Optional[str] = None):
+		self.folder = Path(folder)
+		self.tool = tool
+		self.command = [str(i) for i in command]
+		self.inputs = [Path(i) for i in inputs if i is not None]
+		self.outputs = [Path(i) for i in outputs if i is not None]
+		self.version = version
+
+	@property
+	def filename(self) -> Path:
+		return self.folder / f".{self.tool}.manifest.json"
+
+	def load(self) -> Optional[StepManifest]:
+		try:
+			return StepManifest(**json.loads(self.filename.read_text()))
+		except (OSError, ValueError, TypeError):
+			return None
+
+	def is_current(self) -> bool:
+		""" Checks whether the step's outputs were produced from the same inputs, command, and program version."""
+		previous = self.load()
+		if previous is None:
+			logger.debug(f"{self.tool}: No manifest in {self.folder}")
+			return False
+		if previous.command != self.command or previous.version != self.version:
+			logger.info(f"{self.tool}: The command or program version changed for {self.folder}")
+			return False
+		if sorted(previous.inputs) != sorted(str(i) for i in self.inputs):
+			return False
+		for filename, expected in list(previous.inputs.items()) + list(previous.outputs.items()):
+			if not fingerprint_matches(Path(filename), expected):
+				logger.info(f"{self.tool}: '{filename}' changed since {self.folder} was generated")
+				return False
+		return all(i.exists() for i in self.outputs)
+
+	def record(self):
+		""" Saves the manifest. Should only be called after the step finished successfully."""
+		manifest = StepManifest(
+			tool = self.tool,
+			version = self.version,
+			command = self.command,
+			inputs = {str(i): fingerprint(i, full_hash) for i in self.inputs},
+			outputs = {str(i): fingerprint(i, full_hash) for i in self.outputs}
+		)
+		if not self.folder.exists():
+			logger.error(f"{self.tool}: Could not save the manifest to {self.folder}")
+			return
+		self.filename.write_text(json.dumps(asdict(manifest), indent = 4))
@@ -0,0 +1,256 @@
+"""
+	A persistent index of the mutations breseq found in every sample of a project, so questions like "which samples have
+	a mutation in gene X" don't require reading every breseq folder. The index is an sqlite database keyed by reference
+	position and by gene. It is updated incrementally: a sample is only read again when its GenomeDiff file changes.
+"""
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from loguru import logger
+
+from pipelines import genomediff, manifest
+from pipelines.catalog import get_sample_name
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+	sample TEXT PRIMARY KEY,
+	filename TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mutations (
+	id INTEGER PRIMARY KEY,
+	sample TEXT NOT NULL REFERENCES sources (sample) ON DELETE CASCADE,
+	seq_id TEXT NOT NULL,
+	start INTEGER NOT NULL,
+	end INTEGER NOT NULL,
+	type TEXT NOT NULL,
+	allele TEXT NOT NULL,
+	frequency REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mutations_position ON mutations (seq_id, start);
+CREATE INDEX IF NOT EXISTS mutations_sample ON mutations (sample);
+CREATE TABLE IF NOT EXISTS genes (
+	mutation INTEGER NOT NULL REFERENCES mutations (id) ON DELETE CASCADE,
+	gene TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS genes_gene ON genes (gene);
+CREATE INDEX IF NOT EXISTS genes_mutation ON genes (mutation);
+"""
+
+# The annotation fields breseq adds to each mutation which name the genes it affects.
+GENE_FIELDS = ['gene_name', 'locus_tag', 'genes_overlapping', 'genes_inactivated']
+
+# Mutations whose `size` spans several bases of the reference.
+SIZED_TYPES = {'SUB', 'DEL', 'AMP', 'CON', 'INV'}
+
+
+@dataclass
+class MutationHit:
+	sample: str
+	seq_id: str
+	start: int
+	end: int
+	type: str
+	allele: str
+	frequency: float
+	genes: List[str]
+
+
+def get_genes(mutation: genomediff.Record) -> List[str]:
+	"""
+		The genes and locus tags affected by a mutation. Intergenic mutations list both neighboring genes, e.g.
+		`geneA/geneB`, and breseq writes `–` for a missing neighbor.
+	"""
+	genes = list()
+	for key in GENE_FIELDS:
+		value = mutation.values.get(key)
+		if not isinstance(value, str):
+			continue
+		for part in value.replace('/', ',').replace('–', ',').split(','):
+			part = part.strip().strip('[]').strip()
+			if part and part not in {'-', 'NA'} and part not in genes:
+				genes.append(part)
+	return genes
+
+
+def get_span(mutation: genomediff.Record) -> Tuple[int, int]:
+	""" The first and last reference positions affected by a mutation."""
+	start = int(mutation.position)
+	size = mutation.values.get('size')
+	if mutation.type in SIZED_TYPES and isinstance(size, int) and size > 0:
+		return start, start + size - 1
+	return start, start
+
+
+def get_genomediff_filename(breseq_folder: Path) -> Path:
+	""" The annotated GenomeDiff file includes the genes affected by each mutation, so use it when it exists."""
+	annotated = breseq_folder / "output" / "evidence" / "annotated.gd"
+	return annotated if annotated.exists() else breseq_folder / "output" / "output.gd"
+
+
+class MutationIndex:
+	"""
+		An sqlite-backed index of the mutations in a project.
+	Parameters
+	----------
+	filename: Path
+		The database file. Created if it does not exist.
+	"""
+
+	def __init__(self, filename: Union[str, Path]):
+		self.filename = Path(filename)
+		self._lock = threading.Lock()
+		self.connection = sqlite3.connect(str(self.filename), check_same_thread = False)
+		self.connection.execute("PRAGMA foreign_keys = ON")
+		self.connection.executescript(SCHEMA)
+		# The longest mutation on each sequence, which bounds how far before a region `region()` has to search.
+		self._spans: Optional[Dict[str, int]] = None
+		self._spans_version: Optional[int] = None
+
+	def close(self):
+		self.connection.close()
+
+	def add_sample(self, sample: str, filename: Path):
+		""" Indexes the mutations in a GenomeDiff file, replacing anything indexed for the sample before."""
+		gd = genomediff.GenomeDiff.from_file(filename)
+		current = manifest.fingerprint(filename)
+		with self._lock, self.connection:
+			self.connection.execute("DELETE FROM sources WHERE sample = ?", (sample,))
+			self.connection.execute(
+				"INSERT INTO sources (sample, filename, size, mtime) VALUES (?, ?, ?, ?)",
+				(sample, str(filename), current['size'], current['mtime'])
+			)
+			for mutation in gd.mutations:
+				start, end = get_span(mutation)
+				cursor = self.connection.execute(
+					"INSERT INTO mutations (sample, seq_id, start, end, type, allele, frequency) VALUES (?, ?, ?, ?, ?, ?, ?)",
+					(sample, str(mutation.seq_id), start, end, mutation.type, mutation.allele, mutation.frequency)
+				)
+				self.connection.executemany(
+					"INSERT INTO genes (mutation, gene) VALUES (?, ?)", [(cursor.lastrowid, gene) for gene in get_genes(mutation)]
+				)
+			self._spans = None
+
+	def remove_sample(self, sample: str):
+		with self._lock, self.connection:
+			self.connection.execute("DELETE FROM sources WHERE sample = ?", (sample,))
+			self._spans = None
+
+	def is_current(self, sample: str, filename: Path) -> bool:
+		with self._lock:
+			row = self.connection.execute("SELECT filename, size, mtime FROM sources WHERE sample = ?", (sample,)).fetchone()
+		if row is None or row[0] != str(filename):
+			return False
+		return manifest.fingerprint_matches(filename, {'size': row[1], 'mtime': row[2]})
+
+	def update(self, samples: Dict[str, Path], remove_missing: bool = True) -> List[str]:
+		"""
+			Indexes each sample whose GenomeDiff file is new or changed.
+		Parameters
+		----------
+		samples: Dict[str, Path]
+			The GenomeDiff file of each sample.
+		remove_missing: bool; default True
+			Whether to remove samples which aren't in `samples`.
+		Returns
+		-------
+		List[str]
+			The samples which were added or updated.
+		"""
+		updated = list()
+		for sample, filename in samples.items():
+			filename = Path(filename)
+			if not self.is_current(sample, filename):
+				self.add_sample(sample, filename)
+				updated.append(sample)
+		if remove_missing:
+			for sample in set(self.samples()) - set(samples):
+				self.remove_sample(sample)
+		if updated:
+			logger.info(f"Mutation index: Indexed {len(updated)} samples")
+		return updated
+
+	def update_project(self, project_folder: Path, catalog = None) -> List[str]:
+		"""
+			Indexes every breseq folder in a project. If a `catalog.ProjectCatalog` is given, it is used to find the
+			breseq folders instead of searching the whole project.
+		"""
+		project_folder = Path(project_folder)
+		if catalog is not None:
+			catalog.update(project_folder)
+			# The catalog can also list folders outside the project, which were named relative to another folder.
+			folders = sorted(folder for _, _, folder in catalog.outputs(output_type = 'breseq') if project_folder in folder.parents)
+		else:
+			# Projects are organized as `project/sample/breseq`.
+			folders = [i.parent.parent for i in sorted(project_folder.glob("*/*/output/output.gd"))]
+		# Both ways of finding the breseq folders name the samples after the sample folder.
+		samples = {get_sample_name(project_folder, folder): get_genomediff_filename(folder) for folder in folders}
+		return self.update({sample: filename for sample, filename in samples.items() if filename.exists()})
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			return [i for i, in self.connection.execute("SELECT sample FROM sources ORDER BY sample")]
+
+	def _get_longest_spans(self) -> Dict[str, int]:
+		"""
+			The longest `end - start` of the mutations on each sequence. Calculated once and reused until the index
+			changes, either through this instance or through another connection to the same database. Should be called
+			while holding the lock.
+		"""
+		# `data_version` only changes when another connection modifies the database.
+		version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+		if self._spans is None or version != self._spans_version:
+			rows = self.connection.execute("SELECT seq_id, MAX(end - start) FROM mutations GROUP BY seq_id")
+			self._spans = {seq_id: longest for seq_id, longest in rows}
+			self._spans_version = version
+		return self._spans
+
+	def _query(self, conditions: List[str], parameters: List, min_frequency: float, samples: Optional[Iterable[str]]) -> List[MutationHit]:
+		conditions = conditions + ["mutations.frequency >= ?"]
+		parameters = parameters + [min_frequency]
+		if samples is not None:
+			samples = list(samples)
+			conditions.append(f"mutations.sample IN ({', '.join('?' * len(samples))})")
+			parameters += samples
+		query = f"""
+			SELECT mutations.id, sample, seq_id, start, end, type, allele, frequency, group_concat(genes.gene, char(9))
+			FROM mutations LEFT JOIN genes ON genes.mutation = mutations.id
+			WHERE {' AND '.join(conditions)}
+			GROUP BY mutations.id
+			ORDER BY seq_id, start, sample
+		"""
+		with self._lock:
+			rows = self.connection.execute(query, parameters).fetchall()
+		return [
+			MutationHit(sample, seq_id, start, end, kind, allele, frequency, genes.split('\t') if genes else [])
+			for _, sample, seq_id, start, end, kind, allele, frequency, genes in rows
+		]
+
+	def region(self, seq_id: str, start: int, end: int, min_frequency: float = 0.0,
+			samples: Optional[Iterable[str]] = None) -> List[MutationHit]:
+		""" The mutations which overlap `seq_id:start-end`, inclusive."""
+		# Only `start` is indexed, so limit the search to mutations which start close enough to reach the region.
+		with self._lock:
+			longest = self._get_longest_spans().get(seq_id, 0)
+		conditions = ["mutations.seq_id = ?", "mutations.start BETWEEN ? AND ?", "mutations.end >= ?"]
+		return self._query(conditions, [seq_id, start - longest, end, start], min_frequency, samples)
+
+	def gene(self, name: str, min_frequency: float = 0.0, samples: Optional[Iterable[str]] = None) -> List[MutationHit]:
+		""" The mutations in or next to a gene, by gene name or locus tag."""
+		conditions = ["mutations.id IN (SELECT mutation FROM genes WHERE gene = ?)"]
+		return self._query(conditions, [name], min_frequency, samples)
+
+	def carriers(self, name: str, min_frequency: float = 0.0) -> Dict[str, float]:
+		""" The samples with a mutation in a gene, along with the highest frequency of those mutations in each sample."""
+		result: Dict[str, float] = dict()
+		for hit in self.gene(name, min_frequency):
+			result[hit.sample] = max(result.get(hit.sample, 0.0), hit.frequency)
+		return result
+
+	def genes(self) -> Set[str]:
+		with self._lock:
+			return {i for i, in self.connection.execute("SELECT DISTINCT gene FROM genes")}
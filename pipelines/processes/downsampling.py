@@ -0,0 +1,140 @@
+"""
+	Reduces samples sequenced far deeper than needed to a target depth of coverage before assembly or variant calling.
+	Whether a read pair is kept only depends on the seed and the pair's position in the files, so the forward and reverse
+	files are subsampled independently and still keep the same pairs, and rerunning with the same seed gives the same reads.
+"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest, readindex, sampleio, utilities
+
+VERSION = "1"
+
+# The suffix of the subsampled reads for each supported compression.
+COMPRESSION_SUFFIXES = {
+	None: ".fastq",
+	'gzip': ".fastq.gz",
+	'zstd': ".fastq.zst"
+}
+
+
+def get_genome_size(reference: Path) -> int:
+	""" The total length of a reference genome, from either a fasta file or the LOCUS lines of a genbank file."""
+	with fastqio.open_reads(reference) as file1:
+		first = file1.readline()
+		lines = itertools.chain([first], file1)
+		if first.startswith(b"LOCUS"):
+			# LOCUS       NC_002516             6264404 bp    DNA     circular CON 31-MAR-2017
+			return sum(int(line.split()[2]) for line in lines if line.startswith(b"LOCUS"))
+		return sum(len(line.strip()) for line in lines if not line.startswith(b">"))
+
+
+def get_selection(record_numbers: numpy.ndarray, fraction: float, seed: int) -> numpy.ndarray:
+	""" Whether to keep each record. The same record number is always kept or dropped for a given seed."""
+	threshold = min(int(fraction * 2 ** 64), 2 ** 64 - 1)
+	return utilities.splitmix64(record_numbers, seed) < numpy.uint64(threshold)
+
+
+def subsample_reads(source: Path, destination: Path, fraction: float, seed: int = 0, chunk_size: int = 2 ** 22) -> int:
+	"""
+		Writes a random subset of the reads in `source` to `destination`.
+	Returns
+	-------
+	int
+		The number of reads kept.
+	"""
+	kept = 0
+	record = 0
+	with fastqio.open_output(destination) as output:
+		for buffer, newlines, _ in fastqio.iter_record_chunks(source, chunk_size):
+			count = len(newlines)
+			selected = get_selection(numpy.arange(record, record + count), fraction, seed)
+			end = int(newlines[-1, -1]) + 1
+			record_lengths = numpy.diff(numpy.concatenate([[0], newlines[:, 3] + 1]))
+			output.write(buffer[:end][numpy.repeat(selected, record_lengths)].tobytes())
+			kept += int(selected.sum())
+			record += count
+	return kept
+
+
+class Downsampler:
+	"""
+		Subsamples paired reads to a target depth of coverage.
+	Parameters
+	----------
+	depth: float
+		The target depth of coverage.
+	genome_size: Optional[int]
+		The expected size of the genome. Calculated from `reference` if not given.
+	reference: Optional[Path]
+		A fasta or genbank file of the reference genome.
+	seed: int; default 0
+	compression: str; default 'gzip'
+		How to compress the subsampled reads. Must be readable by whatever program uses them next.
+	"""
+	program = "downsample"
+
+	def __init__(self, depth: float, genome_size: Optional[int] = None, reference: Optional[Path] = None, seed: int = 0,
+			compression: str = 'gzip'):
+		if genome_size is None:
+			if reference is None:
+				message = "Either the genome size or a reference is needed to calculate the depth of coverage."
+				raise ValueError(message)
+			genome_size = get_genome_size(reference)
+		self.depth = depth
+		self.genome_size = genome_size
+		self.seed = seed
+		if compression not in COMPRESSION_SUFFIXES:
+			message = f"Unsupported compression: '{compression}'. Expected one of {[i for i in COMPRESSION_SUFFIXES if i]}"
+			raise ValueError(message)
+		self.suffix = COMPRESSION_SUFFIXES[compression]
+
+	@staticmethod
+	def version() -> str:
+		return VERSION
+
+	def get_fraction(self, forward: Path, reverse: Path) -> float:
+		""" The fraction of read pairs to keep. Uses the read indexes, so the reads are only counted once."""
+		coverage = readindex.estimate_coverage([forward, reverse], self.genome_size)
+		return self.depth / coverage if coverage else 1.0
+
+	def run(self, forward: Path, reverse: Path, output_folder: Path, sample_name: str) -> sampleio.SampleReads:
+		"""
+			Subsamples a pair of reads. The original reads are returned when they are already below the target depth.
+		"""
+		if readindex.get_index(forward).reads != readindex.get_index(reverse).reads:
+			message = f"The forward and reverse reads of {sample_name} have a different number of reads."
+			raise ValueError(message)
+		fraction = self.get_fraction(forward, reverse)
+		if fraction >= 1:
+			logger.info(f"Downsampling: {sample_name} is already below {self.depth}x coverage.")
+			return sampleio.SampleReads(sample_name, forward, reverse)
+
+		utilities.checkdir(output_folder)
+		# Named like sequencer output so the sample name and read direction can still be read from the filenames.
+		output = sampleio.SampleReads(
+			sample_name,
+			output_folder / f"{sample_name}_downsampled_R1_001{self.suffix}",
+			output_folder / f"{sample_name}_downsampled_R2_001{self.suffix}",
+			output_folder
+		)
+		command = [self.program, f"depth={self.depth}", f"genome_size={self.genome_size}", f"seed={self.seed}", str(forward), str(reverse)]
+		step = manifest.Step(output_folder, self.program, command, [forward, reverse], output.reads(), self.version())
+		if step.is_current():
+			return output
+
+		logger.info(f"Downsampling: Keeping {fraction:.1%} of the reads for {sample_name}")
+		with ThreadPoolExecutor(max_workers = 2) as executor:
+			futures = [
+				executor.submit(subsample_reads, source, destination, fraction, self.seed)
+				for source, destination in [(forward, output.forward), (reverse, output.reverse)]
+			]
+			kept = [future.result() for future in futures]
+		logger.info(f"Downsampling: Kept {kept[0]} read pairs for {sample_name}")
+		step.record()
+		return output
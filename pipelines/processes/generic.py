@@ -1,9 +1,9 @@
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 from loguru import logger
-from pipelines.programs import trimmomatic, shovill
-from pipelines.processes import read_assembly
+from pipelines.programs import mash, trimmomatic, shovill
+from pipelines.processes import read_assembly, variant_calling
 from pipelines import programio, sampleio, utilities
 
 
@@ -11,14 +11,18 @@ class GenericVariantCalling:
 	# Implements a method to run variant calling on any combination of input parameters.
 	def __init__(self, project_folder:Path):
 		self.project_folder = utilities.checkdir(project_folder)
-	def run(self, reference: Union[str, Path], samples: Union[Path, List], output_folder: Path):
+		# The sketches are cached with the project rather than next to the reads.
+		self.sketcher = mash.Sketcher(cache_folder = utilities.get_cache_folder(self.project_folder) / "sketches")
+
+	def run(self, reference: Union[str, Path, List[Path]], samples: Union[Path, List], output_folder: Path,
+			skip_duplicates: bool = False) -> List[programio.BreseqOutput]:
 		"""
 			Attempts to run variant calling by converting the input arguments into the required filetypes.
 			This may require the function for invoke other processes, extract the reference from the samples, etc.
 
 		Parameters
 		----------
-		reference: Union[str,Path]
+		reference: Union[str, Path, List[Path]]
 			This can come in several states:
 			- `assembly`: Path (file)
 				The reference assembly only exists, so no further manipulation is required.
@@ -28,6 +32,8 @@ class GenericVariantCalling:
 				The trimmed reads that must be assembled in order to have a reference.
 			- `sample`: str
 				The sample name to use as a reference. Assume that this must be trimmed and assembled.
+			- `candidates`: List[Path]
+				Several assemblies, of which the one closest to most of the samples is used.
 		samples: Union[Path, sampleio.SampleReads, trimmomatic.TrimmomaticOutput]
 			The samples can be provided in several states:
 			- `folder`: Path (folder_
@@ -36,11 +42,19 @@ class GenericVariantCalling:
 				A list of raw reads for the workflow. These still need to be trimmed.
 			- List[trimmomatic.TrimmomaticOutput]
 				A list of trimmed reads to include in the workflow.
-		samples
-		output_folder
+		output_folder: Path
+			The project folder for the variant calling results.
+		skip_duplicates: bool; default False
+			Whether to only call variants for the first of each set of samples which `mash.find_duplicates()` finds are
+			the same isolate. Clones evolved from the same ancestor can be just as similar, so this should only be used
+			for unrelated isolates.
 		"""
 
 		sample_reads = self.load_samples(samples)  # May need to still trim some.
+		if skip_duplicates:
+			sample_reads = self.remove_duplicates(sample_reads)
+		reference_assembly = self.process_reference(reference, sample_reads)
+		return variant_calling.sample_variant_calling(reference_assembly, sample_reads, output_folder)
 
 	@staticmethod
 	def load_samples(samples: Union[Path, List]) -> List[sampleio.SampleReads]:
@@ -51,7 +65,40 @@ class GenericVariantCalling:
 		return project_samples
 
 
-	def process_reference(self, reference: Union[str, Path, sampleio.SampleReads, programio.TrimmomaticOutput]) -> Path:
+	def remove_duplicates(self, samples: List[sampleio.SampleReads]) -> List[sampleio.SampleReads]:
+		""" Removes every sample which is a duplicate of an earlier sample."""
+		sketches = self.sketcher.sketch_samples(samples)
+		duplicates = set()
+		for left, right, distance in mash.find_duplicates([sketches[sample.name] for sample in samples]):
+			if left not in duplicates and right not in duplicates:
+				logger.warning(f"Skipping sample {right}, which is a duplicate of sample {left} ({distance:.4f})")
+				duplicates.add(right)
+		return [sample for sample in samples if sample.name not in duplicates]
+
+	@staticmethod
+	def select_reference(samples: List[sampleio.SampleReads], candidates: List[Path], sketcher: Optional[mash.Sketcher] = None) -> Path:
+		"""
+			Picks the candidate assembly which is closest to the most samples, using the cached sketches of each.
+		"""
+		sketcher = sketcher or mash.Sketcher()
+		references = sketcher.sketch_assemblies({str(i): Path(i) for i in candidates})
+		votes = dict.fromkeys(references, 0)
+		for sketch in sketcher.sketch_samples(samples).values():
+			closest, distance = mash.closest_reference(sketch, references)
+			logger.debug(f"The closest reference to {sketch.name} is {closest} ({distance:.4f})")
+			votes[closest] += 1
+		selected = max(votes, key = votes.get)
+		logger.info(f"Selected {selected} as the reference for {len(samples)} samples")
+		return Path(selected)
+
+	def process_reference(self, reference: Union[str, Path, List[Path], sampleio.SampleReads, programio.TrimmomaticOutput],
+			samples: Optional[List[sampleio.SampleReads]] = None) -> Path:
+		""" If `reference` is a list of candidate assemblies, the one closest to `samples` is used."""
+		if isinstance(reference, list):
+			if not samples:
+				message = "The samples are needed to choose between several references."
+				raise ValueError(message)
+			return self.select_reference(samples, reference, self.sketcher)
 
 		# If the reference already points to an assembly, return it without modification.
 		if isinstance(reference, Path) and reference.is_file():
@@ -74,21 +121,30 @@ class GenericVariantCalling:
 
 
 def get_reads_from_folder(folder: Path) -> Union[None, sampleio.SampleReads, programio.TrimmomaticOutput]:
-	folder_type = utilities.get_folder_type(folder)
+	folder_type = utilities.get_folder_type(folder, silent = True)
 	if folder_type == 'reads':
 		result = sampleio.SampleReads.from_folder(folder)
 	elif folder_type == 'trimmomatic':
 		result = programio.TrimmomaticOutput.from_folder(folder)
 	else:
 		logger.warning(f"Could not load samples from the folder '{folder}'")
-		result = None
+		return None
+	# Same as `catalog.ProjectCatalog`, which names samples after their folder when the reads don't give a name.
+	if not result.name:
+		result.name = folder.name
 	return result
 
 
-def get_reads_from_folders(folder: Path) -> List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]]:
-	"""Loads all sample folders in a given folder."""
+def get_reads_from_folders(folder: Path, catalog = None) -> List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]]:
+	"""
+		Loads all sample folders in a given folder. If a `catalog.ProjectCatalog` is given, the samples are looked up
+		in the catalog instead of reading every folder.
+	"""
+	if catalog is not None:
+		catalog.update(folder, max_depth = 1)
+		return catalog.load_samples(parent = folder)
 	samples = list()
-	for subfolder in folder.iterdir():
+	for subfolder in sorted(folder.iterdir()):
 		result = get_reads_from_folder(subfolder)
 		if result:
 			samples.append(result)
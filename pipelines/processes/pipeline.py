@@ -0,0 +1,188 @@
+"""
+	Runs a set of dependent stages over a group of samples. Each sample moves to its next stage as soon as that
+	stage's requirements are finished for that sample, so one sample can be assembling while another is still being
+	trimmed.
+"""
+import heapq
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from loguru import logger
+
+from pipelines import programio, sampleio, systemio, utilities
+
+Sample = Union[sampleio.SampleReads, programio.TrimmomaticOutput]
+
+
+@dataclass
+class Stage:
+	"""
+		A single step of the pipeline.
+	Parameters
+	----------
+	name: str
+	function: Callable[[Sample, Dict[str, Any], Path], Any]
+		Called as `function(sample, inputs, sample_folder)`, where `inputs` maps the name of each required stage to the
+		output that stage produced for the same sample. Should return the `programio` output of the step.
+	requires: List[str]
+		The names of the stages that must finish first.
+	"""
+	name: str
+	function: Callable[[Sample, Dict[str, Any], Path], Any]
+	requires: List[str] = field(default_factory = list)
+
+
+class Pipeline:
+	def __init__(self, project_folder: Path, stages: List[Stage]):
+		self.project_folder = project_folder
+		self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+		if len(self.stages) != len(stages):
+			message = "Each stage must have a unique name."
+			raise ValueError(message)
+		self.depth = self._get_depths()
+
+	def _get_depths(self) -> Dict[str, int]:
+		""" Finds how far each stage is from the start of the pipeline. Also checks that the stages form a valid graph."""
+		depths = dict()
+		visiting = set()
+
+		def visit(name: str) -> int:
+			if name not in self.stages:
+				message = f"Unknown stage: '{name}'"
+				raise ValueError(message)
+			if name in depths:
+				return depths[name]
+			if name in visiting:
+				message = f"The stages contain a cycle involving '{name}'"
+				raise ValueError(message)
+			visiting.add(name)
+			depths[name] = 1 + max((visit(i) for i in self.stages[name].requires), default = -1)
+			visiting.remove(name)
+			return depths[name]
+
+		for stage_name in self.stages:
+			visit(stage_name)
+		return depths
+
+	def dependents(self, name: str) -> List[Stage]:
+		return [stage for stage in self.stages.values() if name in stage.requires]
+
+	def run(self, samples: List[Sample], validate: bool = False) -> Dict[str, Dict[str, Any]]:
+		"""
+			Runs every stage on every sample.
+		Parameters
+		----------
+		samples: List[Sample]
+		validate: bool; default False
+			Whether to check that every pair of reads is intact before starting. See `sampleio.verify_samples()`. The
+			verdicts are saved in the project's cache folder.
+		Returns
+		-------
+		Dict[str, Dict[str, Any]]
+			The output of each stage for each sample, as `results[sample_name][stage_name]`. Stages which failed, or which
+			depend on a stage that failed, are missing.
+		"""
+		cache_folder = utilities.get_cache_folder(self.project_folder) / "validation"
+		if not sampleio.verify_samples(samples, deep = validate, cache_folder = cache_folder):
+			message = "Something went wrong when validating the samples!"
+			raise ValueError(message)
+		utilities.checkdir(self.project_folder)
+		if systemio.command_runner.journal:
+			# Clean up after any steps that were running when a previous run was killed.
+			systemio.command_runner.journal.recover()
+
+		results: Dict[str, Dict[str, Any]] = {sample.name: dict() for sample in samples}
+		# Stages which are ready to run, ordered so that samples further along the pipeline go first.
+		ready: List[Tuple[int, int, str]] = list()
+		for index, sample in enumerate(samples):
+			for stage in self.stages.values():
+				if not stage.requires:
+					heapq.heappush(ready, (-self.depth[stage.name], index, stage.name))
+
+		# Only hand as many steps to the executor as it can run at once, so newly ready stages are not stuck
+		# behind every sample's first stage.
+		limit = systemio.command_runner.budget.total
+		running: Dict[Future, Tuple[int, str]] = dict()
+		while ready or running:
+			while ready and len(running) < limit:
+				_, index, stage_name = heapq.heappop(ready)
+				sample = samples[index]
+				logger.info(f"Pipeline: Starting '{stage_name}' for sample {index + 1} of {len(samples)}: {sample.name}")
+				future = systemio.command_runner.submit_task(self._run_stage, self.stages[stage_name], sample, results[sample.name])
+				running[future] = (index, stage_name)
+
+			done, _ = wait(list(running), return_when = FIRST_COMPLETED)
+			for future in done:
+				index, stage_name = running.pop(future)
+				sample = samples[index]
+				try:
+					results[sample.name][stage_name] = future.result()
+				except Exception as exception:
+					logger.error(f"Pipeline: '{stage_name}' failed for sample {sample.name}: {exception}")
+					continue
+				for dependent in self.dependents(stage_name):
+					if all(i in results[sample.name] for i in dependent.requires):
+						heapq.heappush(ready, (-self.depth[dependent.name], index, dependent.name))
+		return results
+
+	def _run_stage(self, stage: Stage, sample: Sample, sample_results: Dict[str, Any]) -> Any:
+		inputs = {name: sample_results[name] for name in stage.requires}
+		sample_folder = utilities.checkdir(self.project_folder / sample.name)
+		return stage.function(sample, inputs, sample_folder)
+
+
+def trimming_stage(trimmomatic_workflow, folder_name: str = "trimmomatic", name: str = "trim") -> Stage:
+	""" Trims the raw reads. Samples which are already trimmed are passed through unchanged."""
+
+	def trim_sample(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> programio.TrimmomaticOutput:
+		if isinstance(sample, programio.TrimmomaticOutput):
+			return sample
+		output_folder = utilities.checkdir(sample_folder / folder_name)
+		return trimmomatic_workflow.run(sample.forward, sample.reverse, output_folder, sample.name)
+
+	return Stage(name, trim_sample)
+
+
+def downsampling_stage(downsampler, requires: str = "trim", folder_name: str = "downsampled", name: str = "downsample") -> Stage:
+	""" Subsamples the reads to a target depth. Stages which should use the subsampled reads should require this stage."""
+
+	def downsample_sample(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> sampleio.SampleReads:
+		reads = inputs[requires]
+		return downsampler.run(reads.forward, reads.reverse, sample_folder / folder_name, sample.name)
+
+	return Stage(name, downsample_sample, [requires])
+
+
+def assembly_stage(shovill_workflow, requires: str = "trim", folder_name: str = "shovill", name: str = "assemble") -> Stage:
+	def assemble_sample(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> programio.ShovillOutput:
+		reads = inputs[requires]
+		output_folder = utilities.checkdir(sample_folder / folder_name)
+		return shovill_workflow.run(reads.forward, reads.reverse, output_folder, sample_folder.name)
+
+	return Stage(name, assemble_sample, [requires])
+
+
+def annotation_stage(prokka_workflow, requires: str = "assemble", folder_name: str = "prokka", name: str = "annotate") -> Stage:
+	def annotate_sample(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> programio.ProkkaOutput:
+		assembly: programio.ShovillOutput = inputs[requires]
+		return prokka_workflow.run(assembly.contigs, sample_folder / folder_name)
+
+	return Stage(name, annotate_sample, [requires])
+
+
+def variant_calling_stage(breseq_workflow, requires: str = "trim", folder_name: str = "breseq", name: str = "variants") -> Stage:
+	def call_variants(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> programio.BreseqOutput:
+		reads = inputs[requires]
+		return breseq_workflow.run(sample_folder / folder_name, reads.forward, reads.reverse)
+
+	return Stage(name, call_variants, [requires])
+
+
+def qc_stage(fastqc_workflow, requires: str = "trim", folder_name: str = "fastqc", name: str = "qc") -> Stage:
+	def check_quality(sample: Sample, inputs: Dict[str, Any], sample_folder: Path) -> programio.FastQCOutput:
+		reads = inputs[requires]
+		return fastqc_workflow.run(sample_folder / folder_name, reads.forward, reads.reverse)
+
+	return Stage(name, check_quality, [requires])
@@ -1,21 +1,36 @@
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 from loguru import logger
 
 from pipelines import programio, sampleio, systemio, utilities
+from pipelines.processes import downsampling
 from pipelines.programs import shovill, trimmomatic
 from pipelines.utilities import checkdir
 
 
 class AssemblyWorkflow:
-	def __init__(self, project_folder: Path):
+	"""
+	Parameters
+	----------
+	project_folder: Path
+	compress_trimmed: bool; default False
+		Whether to save the trimmed reads as gzipped fastq files. Shovill reads its input several times, so the trimmed
+		reads can't be streamed into it through a pipe. Reading the compressed reads still cuts the trimming output and
+		the data shovill reads back from disk to a fraction of the uncompressed reads.
+	downsampler: Optional[downsampling.Downsampler]
+		If given, the trimmed reads are subsampled to a target depth before assembly.
+	"""
+
+	def __init__(self, project_folder: Path, compress_trimmed: bool = False, downsampler: Optional[downsampling.Downsampler] = None):
 		systemio.command_runner.set_command_log(project_folder / "commandlog_trimming.sh")
 		systemio.command_runner.write_command_to_commandlog(['module', 'load', 'trimmomatic'])
 		systemio.command_runner.write_command_to_commandlog(['module', 'load', 'shovill'])
 
-		self.trimmomatic_workflow = trimmomatic.Trimmomatic(stringent = True)
+		compression = 'gzip' if compress_trimmed else None
+		self.trimmomatic_workflow = trimmomatic.Trimmomatic(stringent = True, compression = compression)
 		self.shovill_workflow = shovill.Shovill()
+		self.downsampler = downsampler
 
 	def run(self, samples: List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]], project_folder: Path) -> List[programio.ShovillOutput]:
 		logger.info(f"Assembling {len(samples)} samples...")
@@ -27,12 +42,13 @@ class AssemblyWorkflow:
 
 		utilities.checkdir(project_folder)
 
-		output_files = list()
+		futures = list()
 		for index, sample in enumerate(samples, start = 1):
 			logger.info(f"Assembling sample {index} of {len(samples)}: {sample.name}")
 			sample_folder = checkdir(project_folder / sample.name)
-			result = self.assemble_sample(sample, sample_folder)
-			output_files.append(result)
+			futures.append(systemio.command_runner.submit_task(self.assemble_sample, sample, sample_folder))
+		# Collect the results in the same order as the samples.
+		output_files = [future.result() for future in futures]
 		return output_files
 
 	def assemble_sample(self, sample: Union[sampleio.SampleReads, programio.TrimmomaticOutput], sample_folder: Path) -> programio.ShovillOutput:
@@ -45,11 +61,16 @@ class AssemblyWorkflow:
 			logger.info(f"\t'{sample.name}' is already trimmed. Skipping...")
 			trimmomatic_output = sample
 
-		result = self.shovill_workflow.run(trimmomatic_output.forward, trimmomatic_output.reverse, shovill_folder, sample_folder.name)
+		reads = trimmomatic_output
+		if self.downsampler:
+			reads = self.downsampler.run(reads.forward, reads.reverse, sample_folder / "downsampled", sample.name)
+
+		result = self.shovill_workflow.run(reads.forward, reads.reverse, shovill_folder, sample_folder.name)
 		return result
 
 
-def read_assembly(samples: List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]], project_folder: Path) -> List[programio.ShovillOutput]:
-	workflow = AssemblyWorkflow(project_folder)
+def read_assembly(samples: List[Union[sampleio.SampleReads, programio.TrimmomaticOutput]], project_folder: Path,
+		compress_trimmed: bool = False) -> List[programio.ShovillOutput]:
+	workflow = AssemblyWorkflow(project_folder, compress_trimmed)
 	results = workflow.run(samples, project_folder)
 	return results
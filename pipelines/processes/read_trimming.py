@@ -3,6 +3,7 @@ from pathlib import Path
 from pipelines.programs import trimmomatic
 from pipelines import programio
 from pipelines import sampleio
+from pipelines import systemio
 from typing import List
 from loguru import logger
 
@@ -14,10 +15,14 @@ def trim(samples:List[sampleio.SampleReads], project_folder:Path, stringent:bool
 		raise ValueError(message)
 
 	trimmomatic_workflow = trimmomatic.Trimmomatic(stringent = stringent)
-	output_files = list()
+	futures = list()
 	for index, sample in enumerate(samples):
 		logger.info(f"Trimming sample {index} of {len(samples)}: {sample.name}")
 
-		trimmomatic_output = trimmomatic_workflow.run(sample.forward, sample.reverse, project_folder / sample.name, sample.name)
-		output_files.append(trimmomatic_output)
+		future = systemio.command_runner.submit_task(
+			trimmomatic_workflow.run, sample.forward, sample.reverse, project_folder / sample.name, sample.name
+		)
+		futures.append(future)
+	# Collect the results in the same order as the samples.
+	output_files = [future.result() for future in futures]
 	return output_files
\ No newline at end of file
@@ -1,13 +1,16 @@
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 from loguru import logger
 
-from pipelines import programio, sampleio, systemio, utilities
-from pipelines.programs import breseq
+from pipelines import genomediff, programio, sampleio, systemio, utilities
+from pipelines.processes import downsampling
+from pipelines.programs import breseq, trimmomatic
 
 
-def sample_variant_calling(reference: Path, samples: List[sampleio.SampleReads], project_folder: Path, ispop:bool = False):
+def sample_variant_calling(reference: Path, samples: List[sampleio.SampleReads], project_folder: Path, ispop:bool = False, verify: bool = True,
+		trimmomatic_workflow: Optional[trimmomatic.Trimmomatic] = None, keep_trimmed: bool = False,
+		downsampler: Optional[downsampling.Downsampler] = None):
 	"""
 		Performs simple variant calling between the supplied reference and the given samples.
 	Parameters
@@ -20,10 +23,25 @@ def sample_variant_calling(reference: Path, samples: List[sampleio.SampleReads],
 		The folder to use for the overall project.
 	ispop: bool; default False
 		Whether to run variant calling as populations or clones.
+	verify: bool; default True
+		Whether to check that the sample reads exist. Should be disabled when the reads are produced by a slurm job
+		this stage depends on, since they won't exist until that job finishes.
+	trimmomatic_workflow: Optional[trimmomatic.Trimmomatic]
+		If given, each sample is trimmed while breseq runs and the trimmed reads are streamed straight into breseq.
+	keep_trimmed: bool; default False
+		Whether to also save a compressed copy of the streamed trimmed reads in `{sample}/trimmomatic`.
+	downsampler: Optional[downsampling.Downsampler]
+		If given, the reads are subsampled to a target depth before variant calling (and before trimming, when the
+		trimmed reads are streamed).
+	Returns
+	-------
+	List[programio.BreseqOutput]
+		The mutations of every sample are also collected in `{project_folder}/mutations.npz`, which can be read with
+		`genomediff.CohortMatrix.load()`.
 	"""
 	# First validate the input parameters
 	cancel = not utilities.verify_file_exists(reference)
-	cancel = cancel or not sampleio.verify_samples(samples)
+	cancel = cancel or (verify and not sampleio.verify_samples(samples))
 
 	if cancel:
 		message = "Something went wrong when validating the variant calling parameters!"
@@ -38,14 +56,31 @@ def sample_variant_calling(reference: Path, samples: List[sampleio.SampleReads],
 	breseq_workflow = breseq.Breseq(reference, threads = 16, population = ispop)
 	breseq_workflow.test()
 
-	results = list()
+	def call_variants(sample: sampleio.SampleReads, sample_folder: Path) -> programio.BreseqOutput:
+		breseq_folder = sample_folder / "breseq"
+		if downsampler:
+			sample = downsampler.run(sample.forward, sample.reverse, sample_folder / "downsampled", sample.name)
+		if trimmomatic_workflow:
+			trimmomatic_folder = utilities.checkdir(sample_folder / "trimmomatic")
+			stream = trimmomatic.TrimmedStream(trimmomatic_workflow, sample.forward, sample.reverse, trimmomatic_folder, sample.name, keep_trimmed)
+			return breseq_workflow.run(breseq_folder, stream = stream)
+		return breseq_workflow.run(breseq_folder, sample.forward, sample.reverse)
+
+	futures = list()
 	for index, sample in enumerate(samples):
 		logger.info(f"Running variant calling on sample {index} of {len(samples)}: {sample.name}")
 		sample_folder = utilities.checkdir(project_folder / sample.name)
-		breseq_folder = sample_folder / "breseq"
-
-		result = breseq_workflow.run(breseq_folder, sample.forward, sample.reverse)
+		futures.append(systemio.command_runner.submit_task(call_variants, sample, sample_folder))
+	# Collect the results in the same order as the samples, adding each sample's mutations to the cohort matrix as soon
+	# as it finishes.
+	matrix_filename = project_folder / "mutations.npz"
+	matrix = genomediff.CohortMatrix.load(matrix_filename)
+	results = list()
+	for future in futures:
+		result = future.result()
 		results.append(result)
+		if result.gd is not None and result.gd.exists() and matrix.update({result.name: result.gd}):
+			matrix.save(matrix_filename)
 	return results
 
 
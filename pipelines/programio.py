@@ -7,7 +7,7 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional
 from loguru import logger
-from pipelines import sampleio, utilities
+from pipelines import fastqio, sampleio, utilities
 
 
 @dataclass
@@ -33,43 +33,85 @@ class BaseSampleOutput:
 class BreseqOutput(BaseSampleOutput):
 	index: Path
 	summary: Path
+	gd: Optional[Path] = None
 
 	@classmethod
 	def from_folder(cls, folder: Path, sample_name: Optional[str] = None) -> "BreseqOutput":
 		index = folder / "output" / "index.html"
 		summary = folder / "output" / "summary.html"
+		gd = folder / "output" / "output.gd"
 
 		if not sample_name:
-			# Try to extract the sample name from the breseq output files.
-			sample_name = _extract_sample_name_from_breseq_summary(summary)
+			# Try to extract the sample name from the breseq output files. The header of the GenomeDiff file lists the
+			# reads, which is much faster than searching the summary.
+			if gd.exists():
+				from pipelines import genomediff
+				sample_name = genomediff.get_sample_name(gd)
+			if not sample_name and summary.exists():
+				sample_name = _extract_sample_name_from_breseq_summary(summary)
 			if sample_name is None:
 				logger.warning(f"Could not extract the filename from {summary}")
 
-		return BreseqOutput(sample_name, folder, index, summary)
+		return BreseqOutput(sample_name, folder, index, summary, gd)
 
 	@classmethod
 	def expected(cls, folder, sample_name: Optional[str] = None) -> "BreseqOutput":
-		return cls.from_folder(folder)
+		return cls.from_folder(folder, sample_name)
 
 	def exists(self) -> bool:
 		return self.index.exists()
 
+	def load(self):
+		""" Loads the mutations and evidence breseq found as a `genomediff.GenomeDiff`."""
+		from pipelines import genomediff
+		return genomediff.GenomeDiff.from_file(self.gd)
+
 @dataclass
 class FastQCOutput(BaseSampleOutput):
-	folder: Path
 	reports: List[Path]
+	# The profile generated by `qc.QualityProfiler`, if it was used instead of fastqc.
+	profile: Optional[Path] = None
 
 	@classmethod
-	def from_folder(cls, folder: Path, sample_name: Optional[str]) -> "FastQCOutput":
-		raise NotImplementedError
+	def from_folder(cls, folder: Path, sample_name: Optional[str] = None) -> "FastQCOutput":
+		snapshot = utilities.FolderSnapshot.of(folder)
+		reports = snapshot.match("*_fastqc.html")
+		profiles = snapshot.match("*.qc.npz")
+		if sample_name is None:
+			if profiles:
+				sample_name = profiles[0].name[:-len(".qc.npz")]
+			elif reports:
+				sample_name = utilities.get_name_from_reads(reports[0].name[:-len("_fastqc.html")])
+		# Folders with fastqc reports only don't have a profile, which `exists()` would otherwise report as missing.
+		profile_name = f"{sample_name}.qc.npz"
+		profile = folder / profile_name if sample_name and profile_name in snapshot else None
+		return cls(sample_name, folder, reports, profile)
 
-	@ classmethod
+	@classmethod
 	def expected(cls, folder, sample_name: str) -> "FastQCOutput":
-		raise NotImplementedError
+		# The fastqc reports are named after each read file, so only the profile can be predicted from the sample name.
+		return cls(sample_name, folder, [], folder / f"{sample_name}.qc.npz")
 
 	def exists(self):
+		if self.profile is not None and not self.profile.exists():
+			return False
 		return all(i.exists() for i in self.reports)
 
+	@property
+	def archives(self) -> List[Path]:
+		""" The zip archive fastqc writes next to each report, which contains the data behind the report."""
+		return [i.with_name(i.name[:-len(".html")] + ".zip") for i in self.reports]
+
+	def load(self):
+		""" Loads the `qc.ReadProfile` of each read file, keyed by the name of the read file."""
+		from pipelines import qc
+		return qc.load_profiles(self.profile)
+
+	def load_reports(self):
+		""" Parses the `fastqc.FastQCReport` of each read file, in the same order as `reports`."""
+		from pipelines.programs import fastqc
+		return [fastqc.load_report(i) for i in self.archives]
+
 
 @dataclass
 class ProkkaOutput(BaseSampleOutput):
@@ -90,12 +132,17 @@ class ProkkaOutput(BaseSampleOutput):
 	def exists(self):
 		return self.gff.exists()
 
+	def features(self):
+		""" Loads the annotations in the gff file as an `annotations.FeatureTable`, which is cached next to it."""
+		from pipelines import annotations
+		return annotations.load_features(self.gff)
+
 	@classmethod
 	def from_folder(cls, folder: Path, sample_name: Optional[str] = None) -> "ProkkaOutput":
 		if sample_name is None:
 			# Assume that the fna file exists. Otherwise the output folder is incomplete and this should fail anyway.
 			try:
-				expected_fna = [i for i in folder.iterdir() if i.suffix == '.fna'][0]
+				expected_fna = utilities.FolderSnapshot.of(folder).with_suffix('.fna', files_only = False)[0]
 				sample_name = expected_fna.stem
 			except IndexError:
 				message = f"The prokka output folder is incomplete: '{folder}'"
@@ -164,6 +211,16 @@ class ShovillOutput(BaseSampleOutput):
 	def exists(self) -> bool:
 		return self.contigs.exists()
 
+	def stats(self):
+		""" The `quast.AssemblyStats` of the contigs, which are cached next to them."""
+		from pipelines.programs import quast
+		return quast.get_stats(self.contigs, self.name)
+
+	def sequences(self):
+		""" Opens the contigs as a memory-mapped `fastaindex.FastaFile`."""
+		from pipelines import fastaindex
+		return fastaindex.FastaFile(self.contigs)
+
 
 @dataclass
 class TrimmomaticOutput(BaseSampleOutput):
@@ -194,11 +251,12 @@ class TrimmomaticOutput(BaseSampleOutput):
 		return cls(sample_name, folder, forward, reverse, unpaired_forward, unpaired_reverse)
 
 	@classmethod
-	def expected(cls, folder: Path, sample_name: str) -> 'TrimmomaticOutput':
-		forward: Path = folder / f'{sample_name}.forward.trimmed.paired.fastq'
-		reverse: Path = folder / f'{sample_name}.reverse.trimmed.paired.fastq'
-		unpaired_forward: Optional[Path] = folder / f'{sample_name}.forward.trimmed.unpaired.fastq'
-		unpaired_reverse: Optional[Path] = folder / f'{sample_name}.reverse.trimmed.unpaired.fastq'
+	def expected(cls, folder: Path, sample_name: str, suffix: str = ".fastq") -> 'TrimmomaticOutput':
+		""" `suffix` includes the compression, if any. Ex. `.fastq.gz`"""
+		forward: Path = folder / f'{sample_name}.forward.trimmed.paired{suffix}'
+		reverse: Path = folder / f'{sample_name}.reverse.trimmed.paired{suffix}'
+		unpaired_forward: Optional[Path] = folder / f'{sample_name}.forward.trimmed.unpaired{suffix}'
+		unpaired_reverse: Optional[Path] = folder / f'{sample_name}.reverse.trimmed.unpaired{suffix}'
 		return cls(sample_name, folder, forward, reverse, unpaired_forward, unpaired_reverse)
 
 	def as_sample(self) -> sampleio.SampleReads:
@@ -228,8 +286,8 @@ def _get_sample_name_from_shovill_log(filename: Path) -> Optional[str]:
 
 	index_r1 = command.index('--R1')
 	index_r2 = command.index('--R2')
-	filename_forward = Path(command[index_r1 + 1]).stem  # Only want the filename, not the full path.
-	filename_reverse = Path(command[index_r2 + 1]).stem
+	filename_forward = fastqio.get_read_stem(command[index_r1 + 1])  # Only want the filename, not the full path.
+	filename_reverse = fastqio.get_read_stem(command[index_r2 + 1])
 	sample_name = utilities.get_longest_substring(filename_forward, filename_reverse)
 	if sample_name.endswith('.'): sample_name = sample_name[:-1]
 	if not sample_name:
@@ -238,7 +296,7 @@ def _get_sample_name_from_shovill_log(filename: Path) -> Optional[str]:
 
 
 def _get_unpaired_read(folder: Path, isforward: bool) -> Optional[Path]:
-	files = list(i for i in folder.iterdir() if i.suffix == '.fastq')
+	files = [i for i in utilities.FolderSnapshot.of(folder).paths if fastqio.is_read_file(i) and i.suffix]
 
 	readtype = 'forward' if isforward else 'reverse'
 	try:
@@ -1,11 +1,15 @@
 from pathlib import Path
 from typing import List, Optional
 
-from pipelines import systemio, utilities, programio
+from pipelines import fastqio, manifest, systemio, utilities, programio
+from pipelines.programs import trimmomatic
+from pipelines.programs.registry import registry
 
 
 class Breseq:
 	program = "breseq"
+	# The compression formats breseq can read. Other formats are decompressed while it runs.
+	compressions = {None, 'gzip'}
 
 	def __init__(self, reference: Path, threads: int = 8, population: bool = False):
 		self.reference = reference
@@ -14,7 +18,7 @@ class Breseq:
 
 	@staticmethod
 	def version() -> Optional[str]:
-		return systemio.check_output(["breseq", "--version"])
+		return registry.version("breseq")
 
 	def test(self):
 		result = self.version()
@@ -22,13 +26,40 @@ class Breseq:
 			message = "Breseq cannot be found"
 			raise FileNotFoundError(message)
 
-	def run(self, output_folder: Path, *reads) -> programio.BreseqOutput:
-		sample_name = utilities.get_name_from_reads(reads[0])
+	def run(self, output_folder: Path, *reads, stream: Optional[trimmomatic.TrimmedStream] = None) -> programio.BreseqOutput:
+		"""
+			Runs breseq on the given reads.
+		Parameters
+		----------
+		output_folder: Path
+		reads: Path
+		stream: Optional[trimmomatic.TrimmedStream]
+			If given, the sample is trimmed while breseq runs and the trimmed reads are streamed into breseq instead of
+			being read from disk. `reads` is ignored.
+		"""
+		if stream:
+			sample_name = stream.sample_name
+			reads = [stream.reads]
+			inputs = stream.inputs
+		else:
+			sample_name = utilities.get_name_from_reads(reads[0])
+			inputs = list(reads)
 		output = programio.BreseqOutput.expected(output_folder, sample_name)
 		command = self.get_command(output_folder, *reads)
+		if stream:
+			command = stream.wrap(command)
+		else:
+			folder = fastqio.get_decompression_folder(output_folder, self.program)
+			command = fastqio.decompress_command(command, reads, self.compressions, folder)
+		step = manifest.Step(output_folder, self.program, command, [self.reference, *inputs], [output.index], self.version())
 
-		if not output.exists():
-			systemio.command_runner.run(command, output_folder, threads = self.threads)
+		current = step.is_current()
+		process = None
+		if not current:
+			process = systemio.command_runner.run(command, output_folder, threads = self.threads, step = step)
+		# Commands added to a job array haven't run yet, so the trimmed reads can't be checked until the next run.
+		if stream and (current or process is not None):
+			stream.finish(succeeded = current or process.returncode == 0)
 		return output
 
 	def get_command(self, output_folder: Path, *reads) -> List[str]:
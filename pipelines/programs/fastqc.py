@@ -1,35 +1,268 @@
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from pipelines import programio, systemio, utilities
+from loguru import logger
+
+from pipelines import fastqio, manifest, programio, systemio, utilities
+from pipelines.programs.registry import registry
+
+# The basic statistics included in the cohort table, in order.
+BASIC_STATISTICS = ["Total Sequences", "Sequences flagged as poor quality", "Sequence length", "%GC"]
 
 
 class FastQC:
+	"""
+	Parameters
+	----------
+	threads: int; default 4
+		The most read files a single fastqc process analyzes at once. fastqc uses one thread per file.
+	"""
 	program = "fastqc"
+	# The compression formats fastqc can read. Other formats are decompressed while it runs.
+	compressions = {None, 'gzip', 'bzip2'}
 
-	def __init__(self):
-		pass
+	def __init__(self, threads: int = 4):
+		self.threads = threads
 
 	@staticmethod
-	def version() -> str:
-		return systemio.check_output(["fastqc", "--version"])
+	def version() -> Optional[str]:
+		return registry.version("fastqc")
+
+	def get_step(self, output_folder: Path, reads: List[Path], output: programio.FastQCOutput) -> manifest.Step:
+		# The number of threads doesn't change the reports, so it isn't part of the recorded command.
+		command = self.get_command(output_folder, reads)
+		return manifest.Step(output_folder, self.program, command, reads, output.reports, self.version())
 
 	def run(self, output_folder: Path, *reads) -> programio.FastQCOutput:
 		utilities.checkdir(output_folder)
-		command = self.get_command(output_folder, reads)
 		output = self.get_output(output_folder, reads)
+		step = self.get_step(output_folder, list(reads), output)
 
-		if not output.exists():
-			systemio.command_runner.run(command, output_folder, srun = False)
+		if not step.is_current():
+			threads = min(self.threads, len(reads))
+			command = self.get_command(output_folder, reads, threads)
+			folder = fastqio.get_decompression_folder(output_folder, self.program)
+			command = fastqio.decompress_command(command, reads, self.compressions, folder)
+			systemio.command_runner.run(command, output_folder, srun = False, threads = threads, step = step)
 		return output
 
-	def get_command(self, output_folder: Path, reads: Iterable[Path]) -> List[str]:
-		command = [self.program, "--outdir", output_folder] + list(reads)
+	def run_samples(self, samples: Iterable[Tuple[Path, List[Path]]]) -> List[programio.FastQCOutput]:
+		"""
+			Runs fastqc on many samples with fewer, multi-threaded fastqc processes. The read files of several samples are
+			analyzed by a single fastqc process, and each of these batches is run in the `command_runner` worker pool.
+			While `command_runner.batch()` is active each sample is queued as its own task of the job array instead.
+		Parameters
+		----------
+		samples: Iterable[Tuple[Path, List[Path]]]
+			The output folder and read files of each sample.
+		"""
+		if systemio.command_runner.batching:
+			return [self.run(output_folder, *reads) for output_folder, reads in samples]
+
+		outputs = list()
+		batches: List[List[Tuple[Path, List[Path], programio.FastQCOutput, manifest.Step]]] = [[]]
+		# The report names of the current batch. fastqc names each report after its read file, so reads with the same
+		# name from different samples have to be analyzed by separate processes.
+		names: Set[str] = set()
+		for output_folder, reads in samples:
+			reads = [Path(i) for i in reads]
+			utilities.checkdir(output_folder)
+			output = self.get_output(output_folder, reads)
+			outputs.append(output)
+			step = self.get_step(output_folder, reads, output)
+			if step.is_current():
+				continue
+			stems = {fastqio.get_read_stem(i) for i in reads}
+			# Start a new batch once the current one has enough files to use every thread.
+			full = sum(len(i[1]) for i in batches[-1]) + len(reads) > self.threads
+			if batches[-1] and (full or stems & names):
+				batches.append([])
+				names = set()
+			batches[-1].append((output_folder, reads, output, step))
+			names |= stems
+
+		futures = [systemio.command_runner.submit_task(self._run_batch, batch) for batch in batches if batch]
+		for future in futures:
+			future.result()
+		return outputs
+
+	def _run_batch(self, batch: List[Tuple[Path, List[Path], programio.FastQCOutput, manifest.Step]]):
+		""" Runs a single fastqc process for several samples, then moves each sample's reports to its own folder."""
+		reads = [read for _, sample_reads, _, _ in batch for read in sample_reads]
+		threads = min(self.threads, len(reads))
+		# Write next to the first sample so moving the reports doesn't copy them across filesystems.
+		batch_folder = Path(tempfile.mkdtemp(prefix = ".fastqc.batch.", dir = batch[0][0].parent))
+		command = self.get_command(batch_folder, reads, threads)
+		command = fastqio.decompress_command(command, reads, self.compressions, batch_folder / ".reads")
+		logger.info(f"FastQC: Analyzing {len(reads)} read files from {len(batch)} samples")
+		process = systemio.command_runner.run(command, batch_folder, srun = False, threads = threads)
+		if process.returncode != 0:
+			# Keep the batch folder, which has fastqc's stdout and stderr.
+			names = ", ".join(output.name for _, _, output, _ in batch)
+			logger.error(f"FastQC: fastqc exited with {process.returncode} for {names}. See the logs in {batch_folder}")
+			return
+
+		missing = list()
+		for output_folder, sample_reads, output, step in batch:
+			for read in sample_reads:
+				for suffix in ['_fastqc.html', '_fastqc.zip']:
+					source = batch_folder / (fastqio.get_read_stem(read) + suffix)
+					if source.exists():
+						source.replace(output_folder / source.name)
+			if output.exists():
+				step.record()
+			else:
+				missing.append(output.name)
+		if missing:
+			logger.error(f"FastQC: Could not find the reports of {', '.join(missing)}. See the logs in {batch_folder}")
+		else:
+			shutil.rmtree(batch_folder, ignore_errors = True)
+
+	def get_command(self, output_folder: Path, reads: Iterable[Path], threads: int = 1) -> List[str]:
+		command = [self.program, "--outdir", output_folder]
+		if threads > 1:
+			command += ["--threads", threads]
+		command += list(reads)
 		return systemio.format_command(command)
 
 	@staticmethod
 	def get_output(output_folder: Path, reads: Iterable[Path]) -> programio.FastQCOutput:
+		reads = list(reads)
 		return programio.FastQCOutput(
+			utilities.get_name_from_reads(reads[0]),
 			output_folder,
-			[output_folder / (i.name.split('.')[0] + '_fastqc.html') for i in reads]
+			# fastqc removes the fastq and compression suffixes from the report names.
+			[output_folder / (fastqio.get_read_stem(i) + '_fastqc.html') for i in reads]
 		)
+
+
+@dataclass
+class FastQCModule:
+	"""
+		A single module (`>>Module name	status` ... `>>END_MODULE`) of a `fastqc_data.txt` file.
+	Attributes
+	----------
+	values: Dict[str, str]
+		Extra `#Key	value` lines, such as the total deduplicated percentage.
+	"""
+	name: str
+	status: str
+	columns: List[str] = field(default_factory = list)
+	rows: List[List[str]] = field(default_factory = list)
+	values: Dict[str, str] = field(default_factory = dict)
+
+
+@dataclass
+class FastQCReport:
+	filename: str
+	version: Optional[str]
+	modules: Dict[str, FastQCModule]
+
+	@property
+	def basic_statistics(self) -> Dict[str, str]:
+		module = self.modules.get("Basic Statistics")
+		return {row[0]: row[1] for row in module.rows if len(row) > 1} if module else {}
+
+	@property
+	def statuses(self) -> Dict[str, str]:
+		return {name: module.status for name, module in self.modules.items()}
+
+	def to_row(self) -> Dict[str, str]:
+		basic = self.basic_statistics
+		row = {'filename': basic.get('Filename', self.filename)}
+		row.update({key: basic.get(key, '') for key in BASIC_STATISTICS})
+		row.update(self.statuses)
+		return row
+
+
+def _is_number(value: str) -> bool:
+	try:
+		float(value)
+	except ValueError:
+		return False
+	return True
+
+
+def parse_fastqc_data(lines: Iterable[str], filename: str = "") -> FastQCReport:
+	""" Parses the contents of a `fastqc_data.txt` file."""
+	version = None
+	modules = dict()
+	module: Optional[FastQCModule] = None
+	for line in lines:
+		line = line.rstrip('\r\n')
+		if line.startswith('##FastQC'):
+			version = line.split('\t')[-1]
+		elif line.startswith('>>END_MODULE'):
+			module = None
+		elif line.startswith('>>'):
+			name, _, status = line[2:].partition('\t')
+			module = modules[name] = FastQCModule(name, status)
+		elif module is None or not line:
+			continue
+		elif line.startswith('#'):
+			key, _, value = line[1:].partition('\t')
+			if _is_number(value):
+				module.values[key] = value
+			elif not module.columns:
+				# Otherwise the first comment of a module names its columns.
+				module.columns = line[1:].split('\t')
+		else:
+			module.rows.append(line.split('\t'))
+	return FastQCReport(filename, version, modules)
+
+
+def load_report(filename: Path) -> FastQCReport:
+	""" Reads a `*_fastqc.zip` archive, or an extracted `fastqc_data.txt` file."""
+	filename = Path(filename)
+	if filename.suffix == '.zip':
+		with zipfile.ZipFile(filename) as archive:
+			name = next(i for i in archive.namelist() if i.endswith('/fastqc_data.txt') or i == 'fastqc_data.txt')
+			lines = archive.read(name).decode().splitlines()
+	else:
+		lines = filename.read_text().splitlines()
+	return parse_fastqc_data(lines, str(filename))
+
+
+def load_reports(filenames: List[Path], processes: Optional[int] = None) -> List[FastQCReport]:
+	""" Reads many fastqc archives in a process pool."""
+	with ProcessPoolExecutor(max_workers = processes) as executor:
+		return list(executor.map(load_report, filenames))
+
+
+def summarize(outputs: Iterable[programio.FastQCOutput], filename: Optional[Path] = None, processes: Optional[int] = None,
+		sep: str = "\t") -> List[Dict[str, str]]:
+	"""
+		Collects the basic statistics and the status of every module of each read file into a single table, similar to
+		the general statistics table of MultiQC.
+	Parameters
+	----------
+	outputs: Iterable[programio.FastQCOutput]
+	filename: Optional[Path]
+		If given, the table is saved here.
+	processes: Optional[int]
+		The number of processes used to read the archives.
+	"""
+	samples, archives = list(), list()
+	for output in outputs:
+		for archive in output.archives:
+			if archive.exists():
+				samples.append(output.name)
+				archives.append(archive)
+			else:
+				logger.warning(f"FastQC: Could not find {archive}")
+
+	rows = list()
+	for sample, report in zip(samples, load_reports(archives, processes)):
+		rows.append({'sample': sample, **report.to_row()})
+
+	if filename is not None and rows:
+		# Not every version of fastqc has the same modules.
+		columns = list(dict.fromkeys(column for row in rows for column in row))
+		lines = [sep.join(columns)] + [sep.join(str(row.get(column, '')) for column in columns) for row in rows]
+		filename.write_text("\n".join(lines) + "\n")
+	return rows
@@ -0,0 +1,263 @@
+"""
+	A built-in MinHash sketcher in the style of mash. Each sample's reads and each assembly are reduced to a small
+	sketch of k-mer hashes, which is cached (next to each assembly, and in a cache folder for the reads), so comparing
+	every sample in a cohort only needs the cached sketches. The distances are used to pick the closest reference and to
+	flag swapped, contaminated, and duplicated samples.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest, sampleio, utilities
+# `BASE_CODES` converts each base to its 2-bit code. Anything else (N, newlines, etc.) is 4, which ends a k-mer.
+# `LETTERS` picks out the sequence in the ORIGIN section of a genbank file, which also has positions and spaces.
+from pipelines.qc import BASE_CODES, LETTERS
+
+VERSION = "1"
+
+
+@dataclass
+class Sketch:
+	name: str
+	hashes: numpy.ndarray
+	kmer_size: int
+	sketch_size: int
+
+	def jaccard(self, other: 'Sketch') -> float:
+		""" Estimates the Jaccard index from the smallest hashes of the union of both sketches."""
+		if self.kmer_size != other.kmer_size:
+			message = f"Cannot compare sketches with different k-mer sizes ({self.kmer_size} and {other.kmer_size})"
+			raise ValueError(message)
+		size = min(self.sketch_size, other.sketch_size)
+		union = numpy.union1d(self.hashes, other.hashes)[:size]
+		if len(union) == 0:
+			return 0.0
+		shared = numpy.isin(union, self.hashes, assume_unique = True) & numpy.isin(union, other.hashes, assume_unique = True)
+		return shared.sum() / len(union)
+
+	def distance(self, other: 'Sketch') -> float:
+		""" The mash distance, which approximates the fraction of bases which differ between the two genomes."""
+		jaccard = self.jaccard(other)
+		if jaccard == 0:
+			return 1.0
+		return float(max(0.0, -numpy.log(2 * jaccard / (1 + jaccard)) / self.kmer_size))
+
+
+def get_kmer_hashes(codes: numpy.ndarray, kmer_size: int, seed: int) -> numpy.ndarray:
+	"""
+		Hashes every canonical k-mer in a sequence of 2-bit base codes. K-mers which overlap an invalid base (code 4)
+		are skipped.
+	"""
+	count = len(codes) - kmer_size + 1
+	if count <= 0:
+		return numpy.zeros(0, dtype = numpy.uint64)
+	invalid = numpy.concatenate([[0], numpy.cumsum(codes > 3)])
+	valid = (invalid[kmer_size:] - invalid[:-kmer_size]) == 0
+	bases = numpy.minimum(codes, 3).astype(numpy.uint64)
+
+	forward = numpy.zeros(count, dtype = numpy.uint64)
+	reverse = numpy.zeros(count, dtype = numpy.uint64)
+	for offset in range(kmer_size):
+		window = bases[offset:offset + count]
+		forward = (forward << numpy.uint64(2)) | window
+		reverse |= (numpy.uint64(3) - window) << numpy.uint64(2 * offset)
+	canonical = numpy.minimum(forward, reverse)[valid]
+	return utilities.splitmix64(canonical, seed)
+
+
+class _BottomSketch:
+	"""
+		Keeps the smallest hashes seen at least `min_copies` times. Only hashes below the current cutoff are counted, so
+		the memory used stays close to the sketch size.
+	"""
+
+	def __init__(self, sketch_size: int, min_copies: int):
+		self.sketch_size = sketch_size
+		self.min_copies = min_copies
+		self.hashes = numpy.zeros(0, dtype = numpy.uint64)
+		self.counts = numpy.zeros(0, dtype = numpy.int64)
+		self.cutoff: Optional[numpy.uint64] = None
+
+	def add(self, hashes: numpy.ndarray):
+		if self.cutoff is not None:
+			hashes = hashes[hashes <= self.cutoff]
+		values, counts = numpy.unique(numpy.concatenate([self.hashes, hashes]), return_counts = True)
+		# `self.hashes` already appear once in the concatenated array.
+		previous = numpy.zeros(len(values), dtype = numpy.int64)
+		previous[numpy.searchsorted(values, self.hashes)] = self.counts - 1
+		counts = counts + previous
+
+		solid = values[counts >= self.min_copies]
+		if len(solid) >= self.sketch_size:
+			self.cutoff = solid[self.sketch_size - 1]
+			keep = values <= self.cutoff
+		else:
+			# Until the sketch is full, only keep a bounded number of the smallest candidates.
+			keep = numpy.arange(len(values)) < self.sketch_size * 100
+		self.hashes, self.counts = values[keep], counts[keep]
+
+	def finish(self) -> numpy.ndarray:
+		return self.hashes[self.counts >= self.min_copies][:self.sketch_size]
+
+
+def iter_read_codes(path: Path, chunk_size: int = 2 ** 22) -> Iterator[numpy.ndarray]:
+	""" Yields the 2-bit codes of the sequences in a fastq file. Each sequence ends with an invalid code."""
+	for buffer, newlines, _ in fastqio.iter_record_chunks(path, chunk_size):
+		# Include the newline after each sequence, which separates the reads.
+		starts = newlines[:, 0] + 1
+		lengths = newlines[:, 1] - newlines[:, 0]
+		position = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+		yield BASE_CODES[buffer[numpy.repeat(starts, lengths) + position]]
+
+
+def iter_assembly_codes(path: Path) -> Iterator[numpy.ndarray]:
+	""" Yields the 2-bit codes of each sequence in a fasta or genbank file."""
+	with fastqio.open_reads(path) as file1:
+		contents = file1.read()
+	if contents.startswith(b"LOCUS"):
+		for record in contents.split(b"\nORIGIN")[1:]:
+			sequence = numpy.frombuffer(record.split(b"\n//")[0], dtype = numpy.uint8)
+			yield BASE_CODES[sequence[LETTERS[sequence]]]
+	else:
+		for record in contents.split(b">")[1:]:
+			_, _, sequence = record.partition(b"\n")
+			yield BASE_CODES[numpy.frombuffer(sequence.replace(b"\n", b"").replace(b"\r", b""), dtype = numpy.uint8)]
+
+
+class Sketcher:
+	"""
+	Parameters
+	----------
+	kmer_size: int; default 21
+	sketch_size: int; default 1000
+		The number of hashes kept for each sketch.
+	seed: int; default 42
+	read_min_copies: int; default 2
+		Read sketches only keep k-mers seen at least this many times, so sequencing errors don't fill the sketch.
+	processes: Optional[int]
+		The number of worker processes used by `sketch_samples()`.
+	cache_folder: Optional[Path]
+		Where to save the sketches of the reads, which are never saved next to the reads. Defaults to the `sketches`
+		folder in `utilities.get_cache_folder()`.
+	"""
+
+	def __init__(self, kmer_size: int = 21, sketch_size: int = 1000, seed: int = 42, read_min_copies: int = 2,
+			processes: Optional[int] = None, cache_folder: Optional[Path] = None):
+		if not 0 < kmer_size <= 32:
+			message = f"The k-mer size must be between 1 and 32, not {kmer_size}"
+			raise ValueError(message)
+		self.kmer_size = kmer_size
+		self.sketch_size = sketch_size
+		self.seed = seed
+		self.read_min_copies = read_min_copies
+		self.processes = processes
+		self.cache_folder = Path(cache_folder) if cache_folder else utilities.get_cache_folder() / "sketches"
+
+	def _parameters(self, min_copies: int) -> Dict:
+		return {'kmer_size': self.kmer_size, 'sketch_size': self.sketch_size, 'seed': self.seed, 'min_copies': min_copies}
+
+	def _load(self, cache: Path, name: str, sources: List[Path], min_copies: int) -> Optional[Sketch]:
+		contents = manifest.load_sidecar(cache, VERSION, sources, self._parameters(min_copies))
+		if contents is None:
+			return None
+		return Sketch(name, contents['hashes'], self.kmer_size, self.sketch_size)
+
+	def _save(self, cache: Path, sketch: Sketch, sources: List[Path], min_copies: int):
+		manifest.save_sidecar(cache, VERSION, sources, {'hashes': sketch.hashes}, self._parameters(min_copies))
+
+	def _sketch(self, name: str, chunks: Iterable[numpy.ndarray], min_copies: int) -> Sketch:
+		bottom = _BottomSketch(self.sketch_size, min_copies)
+		for codes in chunks:
+			bottom.add(get_kmer_hashes(codes, self.kmer_size, self.seed))
+		return Sketch(name, bottom.finish(), self.kmer_size, self.sketch_size)
+
+	def sketch_reads(self, sample: sampleio.SampleReads, cache: Optional[Path] = None) -> Sketch:
+		""" Sketches both read files of a sample. Cached as `{sample}.sketch.npz` in `cache_folder` by default."""
+		cache = cache or self.cache_folder / f"{sample.name}.sketch.npz"
+		sources = [Path(sample.forward), Path(sample.reverse)]
+		sketch = self._load(cache, sample.name, sources, self.read_min_copies)
+		if sketch is None:
+			chunks = (codes for source in sources for codes in iter_read_codes(source))
+			sketch = self._sketch(sample.name, chunks, self.read_min_copies)
+			self._save(cache, sketch, sources, self.read_min_copies)
+		return sketch
+
+	def sketch_assembly(self, path: Path, name: Optional[str] = None, cache: Optional[Path] = None) -> Sketch:
+		""" Sketches a fasta or genbank file. Cached as `{filename}.sketch.npz` by default."""
+		path = Path(path)
+		name = name or path.stem
+		cache = cache or path.with_name(path.name + ".sketch.npz")
+		sketch = self._load(cache, name, [path], 1)
+		if sketch is None:
+			sketch = self._sketch(name, iter_assembly_codes(path), 1)
+			self._save(cache, sketch, [path], 1)
+		return sketch
+
+	def sketch_samples(self, samples: List[sampleio.SampleReads]) -> Dict[str, Sketch]:
+		""" Sketches every sample in a process pool."""
+		with ProcessPoolExecutor(max_workers = self.processes) as executor:
+			sketches = list(executor.map(self.sketch_reads, samples))
+		return {sketch.name: sketch for sketch in sketches}
+
+	def sketch_assemblies(self, assemblies: Dict[str, Path]) -> Dict[str, Sketch]:
+		with ProcessPoolExecutor(max_workers = self.processes) as executor:
+			sketches = list(executor.map(self.sketch_assembly, assemblies.values(), assemblies.keys()))
+		return {sketch.name: sketch for sketch in sketches}
+
+
+def distance_matrix(sketches: List[Sketch]) -> numpy.ndarray:
+	""" The pairwise distances between every sketch, in the same order as `sketches`."""
+	matrix = numpy.zeros((len(sketches), len(sketches)))
+	for left, right in combinations(range(len(sketches)), 2):
+		matrix[left, right] = matrix[right, left] = sketches[left].distance(sketches[right])
+	return matrix
+
+
+def closest_reference(sketch: Sketch, references: Dict[str, Sketch]) -> Tuple[str, float]:
+	""" Returns the name of the reference closest to `sketch` and its distance."""
+	distances = {name: sketch.distance(reference) for name, reference in references.items()}
+	name = min(distances, key = distances.get)
+	return name, distances[name]
+
+
+def find_duplicates(sketches: List[Sketch], threshold: float = 0.0005) -> List[Tuple[str, str, float]]:
+	""" Pairs of samples which are so similar they are almost certainly the same isolate."""
+	matrix = distance_matrix(sketches)
+	return [
+		(sketches[left].name, sketches[right].name, float(matrix[left, right]))
+		for left, right in combinations(range(len(sketches)), 2) if matrix[left, right] <= threshold
+	]
+
+
+@dataclass
+class IdentityCheck:
+	name: str
+	closest: str
+	distance: float  # To the sample's own assembly.
+	swapped: bool
+	contaminated: bool
+
+
+def check_identity(reads: Dict[str, Sketch], assemblies: Dict[str, Sketch], threshold: float = 0.01) -> List[IdentityCheck]:
+	"""
+		Compares each sample's reads to every assembly.
+		- `swapped`: The reads are closer to another sample's assembly than to their own.
+		- `contaminated`: The reads are further than `threshold` from their own assembly, which happens when they
+			contain k-mers from another organism.
+	"""
+	results = list()
+	for name, sketch in reads.items():
+		closest, _ = closest_reference(sketch, assemblies)
+		distance = sketch.distance(assemblies[name]) if name in assemblies else 1.0
+		result = IdentityCheck(name, closest, distance, swapped = closest != name, contaminated = distance > threshold)
+		if result.swapped:
+			logger.warning(f"Sketch: The reads for {name} are closest to the assembly of {closest}")
+		elif result.contaminated:
+			logger.warning(f"Sketch: The reads for {name} are {distance:.4f} from their own assembly")
+		results.append(result)
+	return results
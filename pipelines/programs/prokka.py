@@ -2,7 +2,8 @@ import argparse
 from pathlib import Path
 from typing import List, Optional
 
-from pipelines import systemio, programio
+from pipelines import manifest, systemio, programio
+from pipelines.programs.registry import registry
 
 
 class Prokka:
@@ -15,33 +16,28 @@ class Prokka:
 
 	@staticmethod
 	def get_install() -> Optional[Path]:
-		# Try to locate the file using `which`
-		command = ["which", "prokka"]
-		result = systemio.check_output(command)
+		# The registry checks the PATH first, then assumes prokka is part of anaconda.
+		return registry.path("prokka")
 
-		if result is None:
-			# Assume prokka is part of anaconda
-			result = systemio.get_anaconda_install() / "prokka"
-			result = result if result.exists() else None
-
-		return result
-
-	def version(self):
-		command = [self.get_install(), "--version"]
-		result = systemio.check_output(command)
-		return result
+	@staticmethod
+	def version() -> Optional[str]:
+		return registry.version("prokka")
 
 	def run(self, assembly: Path, output_folder: Path) -> programio.ProkkaOutput:
 		output = programio.ProkkaOutput.expected(output_folder, assembly.stem)
 		command = self.get_command(assembly, output_folder)
+		step = manifest.Step(output_folder, "prokka", command, [assembly], [output.gff], self.version())
 
-		if not output.exists():
-			systemio.command_runner.run("prokka", command, output_folder)
+		if not step.is_current():
+			systemio.command_runner.run(command, output_folder, step = step)
 		return output
 
 	def get_command(self, assembly: Path, output_folder: Path) -> List[str]:
+		# The command runner creates the (staging) output folder before prokka runs, and prokka refuses to write into
+		# an existing folder without `--force`.
 		prokka_command = [
 			"prokka",
+			"--force",
 			"--outdir", output_folder,
 			"--prefix", assembly.stem,
 			"--genus", self.genus,
@@ -1,6 +1,239 @@
-
+"""
+	Native assembly statistics in place of running QUAST for every sample. Each fasta file is streamed in chunks, and the
+	length, GC, and N count of every contig is tallied with numpy. The statistics are saved next to each assembly as
+	`{filename}.stats.json` and reused until the assembly changes, so sweeping a whole project is cheap after the first
+	run.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest
+from pipelines.qc import LETTERS
+
+VERSION = "1"
+
+# The lower bound of each bin in the contig length histogram. These match the thresholds QUAST reports.
+LENGTH_BINS = [0, 500, 1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000]
+
+GC = numpy.zeros(256, dtype = bool)
+GC[[ord(i) for i in "GCgc"]] = True
+NS = numpy.zeros(256, dtype = bool)
+NS[[ord(i) for i in "Nn"]] = True
+
+
+@dataclass
+class AssemblyStats:
+	"""
+	Attributes
+	----------
+	gc: float
+		The fraction of called bases (not N) which are G or C.
+	length_histogram: List[int]
+		The number of contigs in each bin of `LENGTH_BINS`.
+	"""
+	name: str
+	filename: str
+	contigs: int = 0
+	total_length: int = 0
+	largest_contig: int = 0
+	gc: float = 0.0
+	n_count: int = 0
+	n50: int = 0
+	l50: int = 0
+	n90: int = 0
+	l90: int = 0
+	length_histogram: List[int] = field(default_factory = list)
+
+	def to_row(self) -> Dict:
+		""" The statistics as a single row of a table."""
+		row = {key: value for key, value in asdict(self).items() if key != 'length_histogram'}
+		for lower, count in zip(LENGTH_BINS, self.length_histogram):
+			row[f"contigs >= {lower} bp"] = count
+		return row
+
+
+class _ContigCounter:
+	""" Tallies the bases of each contig in a fasta file, one chunk at a time."""
 
-class Quast:
 	def __init__(self):
-		pass
\ No newline at end of file
+		self.lengths = numpy.zeros(0, dtype = numpy.int64)
+		self.gc = numpy.zeros(0, dtype = numpy.int64)
+		self.ns = numpy.zeros(0, dtype = numpy.int64)
+		self.in_header = False
+		self.at_line_start = True
+
+	def add(self, chunk: numpy.ndarray):
+		newlines = numpy.flatnonzero(chunk == ord("\n"))
+		line_starts = newlines + 1
+		line_starts = line_starts[line_starts < len(chunk)]
+		if self.at_line_start:
+			line_starts = numpy.concatenate([[0], line_starts])
+		headers = line_starts[chunk[line_starts] == ord(">")]
+
+		# Mark every byte that is part of a header line, including headers which continue from the previous chunk.
+		# A header without a newline continues into the next chunk, so treat the end of the chunk as its end.
+		line_ends = numpy.append(newlines, len(chunk) - 1)
+		ends = line_ends[numpy.searchsorted(newlines, headers)] + 1
+		change = numpy.zeros(len(chunk) + 1, dtype = numpy.int64)
+		numpy.add.at(change, headers, 1)
+		numpy.add.at(change, ends, -1)
+		if self.in_header:
+			change[0] += 1
+			change[line_ends[0] + 1] -= 1
+		in_header = numpy.cumsum(change[:-1]) > 0
+
+		# Which contig each byte belongs to, relative to the contig that was open at the start of the chunk.
+		starts = numpy.zeros(len(chunk), dtype = numpy.int64)
+		starts[headers] = 1
+		contig = numpy.cumsum(starts)
+		offset = len(self.lengths) - 1
+		bases = LETTERS[chunk] & ~in_header
+		if offset < 0:
+			# Ignore anything before the first header.
+			bases &= contig > 0
+		indices = contig[bases]
+		size = len(headers) + 1
+		self.lengths = self._add(self.lengths, offset, numpy.bincount(indices, minlength = size))
+		self.gc = self._add(self.gc, offset, numpy.bincount(indices[GC[chunk[bases]]], minlength = size))
+		self.ns = self._add(self.ns, offset, numpy.bincount(indices[NS[chunk[bases]]], minlength = size))
+
+		self.in_header = bool(in_header[-1]) and chunk[-1] != ord("\n")
+		self.at_line_start = chunk[-1] == ord("\n")
+
+	@staticmethod
+	def _add(totals: numpy.ndarray, offset: int, counts: numpy.ndarray) -> numpy.ndarray:
+		""" Adds `counts`, where `counts[0]` belongs to contig `offset`, the contig that was open before the chunk."""
+		if offset < 0:
+			return numpy.concatenate([totals, counts[1:]])
+		totals = numpy.concatenate([totals, numpy.zeros(len(counts) - 1, dtype = numpy.int64)])
+		totals[offset:] += counts
+		return totals
+
+
+def get_contig_counts(filename: Path, chunk_size: int = 2 ** 22) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+	""" The length, number of G or C bases, and number of N bases of each contig in a fasta file."""
+	counter = _ContigCounter()
+	with fastqio.open_reads(filename) as file1:
+		while True:
+			chunk = file1.read(chunk_size)
+			if not chunk:
+				break
+			counter.add(numpy.frombuffer(chunk, dtype = numpy.uint8))
+	return counter.lengths, counter.gc, counter.ns
+
+
+def get_nx(lengths: numpy.ndarray, fraction: float) -> Tuple[int, int]:
+	""" The Nx and Lx of a set of contig lengths, e.g. `fraction = 0.5` gives the N50 and L50."""
+	if not len(lengths):
+		return 0, 0
+	lengths = numpy.sort(lengths)[::-1]
+	index = int(numpy.searchsorted(numpy.cumsum(lengths), fraction * lengths.sum()))
+	return int(lengths[index]), index + 1
+
+
+def calculate_stats(filename: Path, name: Optional[str] = None, min_length: int = 0) -> AssemblyStats:
+	"""
+		Calculates the statistics of an assembly. Contigs shorter than `min_length` are ignored.
+	"""
+	filename = Path(filename)
+	stats = AssemblyStats(name or get_assembly_name(filename), str(filename))
+	lengths, gc, ns = get_contig_counts(filename)
+	keep = lengths >= min_length
+	lengths, gc, ns = lengths[keep], gc[keep], ns[keep]
+
+	stats.contigs = len(lengths)
+	stats.total_length = int(lengths.sum())
+	stats.largest_contig = int(lengths.max()) if len(lengths) else 0
+	stats.n_count = int(ns.sum())
+	called = stats.total_length - stats.n_count
+	stats.gc = float(gc.sum() / called) if called else 0.0
+	stats.n50, stats.l50 = get_nx(lengths, 0.5)
+	stats.n90, stats.l90 = get_nx(lengths, 0.9)
+	stats.length_histogram = numpy.histogram(lengths, bins = LENGTH_BINS + [numpy.inf])[0].tolist()
+	return stats
+
+
+def get_stats_filename(filename: Path) -> Path:
+	return filename.with_name(filename.name + ".stats.json")
+
+
+def get_assembly_name(filename: Path) -> str:
+	""" The sample name of an assembly. Shovill always names its output `contigs.fa`, so use the sample folder instead."""
+	if filename.name == "contigs.fa":
+		folder = filename.parent
+		return folder.parent.name if folder.name == "shovill" else folder.name
+	return fastqio.get_read_stem(filename).rsplit('.', 1)[0]
+
+
+def load_stats(filename: Path, min_length: int = 0) -> Optional[AssemblyStats]:
+	""" Loads the saved statistics of an assembly. Returns None if there are none or the assembly changed since."""
+	contents = manifest.load_sidecar(get_stats_filename(filename), VERSION, [filename], {'min_length': min_length})
+	return AssemblyStats(**contents) if contents is not None else None
+
+
+def get_stats(filename: Path, name: Optional[str] = None, min_length: int = 0) -> AssemblyStats:
+	""" Loads the statistics of an assembly, calculating and saving them first if needed."""
+	filename = Path(filename)
+	stats = load_stats(filename, min_length)
+	if stats is not None:
+		if name:
+			stats.name = name
+		return stats
+	stats = calculate_stats(filename, name, min_length)
+	manifest.save_sidecar(get_stats_filename(filename), VERSION, [filename], asdict(stats), {'min_length': min_length})
+	return stats
+
+
+def save_table(stats: Iterable[AssemblyStats], filename: Path, sep: str = "\t"):
+	""" Saves the statistics of each assembly as a row of a table."""
+	rows = [i.to_row() for i in stats]
+	if not rows:
+		return
+	columns = list(rows[0])
+	lines = [sep.join(columns)] + [sep.join(str(row[column]) for column in columns) for row in rows]
+	filename.write_text("\n".join(lines) + "\n")
+
+
+class Quast:
+	"""
+		Calculates the basic statistics QUAST reports for each assembly, without running QUAST.
+	Parameters
+	----------
+	min_length: int; default 0
+		Ignore contigs shorter than this. QUAST uses 500.
+	processes: Optional[int]
+		The number of worker processes used by `run_project()`. Defaults to the number of cpus.
+	"""
+	program = "quast"
+
+	def __init__(self, min_length: int = 0, processes: Optional[int] = None):
+		self.min_length = min_length
+		self.processes = processes
+
+	def run(self, contigs: Path, name: Optional[str] = None) -> AssemblyStats:
+		return get_stats(contigs, name, self.min_length)
+
+	def run_assemblies(self, assemblies: List[Path]) -> List[AssemblyStats]:
+		""" Calculates the statistics of every assembly in a process pool."""
+		with ProcessPoolExecutor(max_workers = self.processes) as executor:
+			return list(executor.map(get_stats, assemblies, [None] * len(assemblies), [self.min_length] * len(assemblies)))
+
+	def run_project(self, project_folder: Path, table: Optional[Path] = None) -> List[AssemblyStats]:
+		"""
+			Finds every shovill assembly (`contigs.fa`) in a project and calculates its statistics.
+			The statistics are also saved as a table if `table` is given.
+		"""
+		assemblies = sorted(project_folder.rglob("contigs.fa"))
+		logger.info(f"Quast: Found {len(assemblies)} assemblies in {project_folder}")
+		results = self.run_assemblies(assemblies)
+		for stats in results:
+			if stats.contigs == 0:
+				logger.warning(f"Quast: The assembly for {stats.name} has no contigs")
+		if table is not None:
+			save_table(results, table)
+		return results
@@ -0,0 +1,153 @@
+"""
+	Locates the external programs used by the pipelines and probes their versions. Results are cached on disk, keyed
+	by the PATH and the modification time of each program, so repeated launches don't need to start every program
+	just to ask for its version.
+"""
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+
+from pipelines import systemio, utilities
+
+# The argument each program uses to report its version.
+VERSION_ARGUMENTS: Dict[str, str] = {
+	'breseq': '--version',
+	'fastqc': '--version',
+	'prokka': '--version',
+	'shovill': '--version',
+	'trimmomatic': '-version'
+}
+
+
+def get_default_cache() -> Path:
+	return utilities.get_cache_folder() / "tools.json"
+
+
+@dataclass
+class ToolInfo:
+	name: str
+	path: Optional[str]
+	mtime: Optional[float] = None
+	version: Optional[str] = None
+
+	def exists(self) -> bool:
+		return self.path is not None
+
+
+class ToolRegistry:
+	"""
+		Resolves the location and version of each program once.
+	Parameters
+	----------
+	cache_filename: Optional[Path]
+		Where to save the probed versions. Defaults to `~/.cache/pipelines/tools.json`.
+	"""
+
+	def __init__(self, cache_filename: Optional[Path] = None):
+		self.cache_filename = Path(cache_filename) if cache_filename else get_default_cache()
+		self.tools: Dict[str, ToolInfo] = dict()
+		self._lock = threading.Lock()
+		self._cache = self._read_cache()
+
+	def _read_cache(self) -> Dict[str, Dict]:
+		try:
+			contents = json.loads(self.cache_filename.read_text())
+		except (OSError, ValueError):
+			return dict()
+		# Programs can resolve to different binaries under a different PATH.
+		if contents.get('PATH') != os.environ.get('PATH'):
+			return dict()
+		return contents.get('tools', dict())
+
+	def _write_cache(self):
+		# Keep the programs other runs resolved, which may have written to the cache since it was read.
+		tools = {**self._cache, **self._read_cache()}
+		for name, info in self.tools.items():
+			if info.exists() and info.version is not None:
+				tools[name] = asdict(info)
+			else:
+				# Failed probes aren't saved, so the program is probed again next time.
+				tools.pop(name, None)
+		self._cache = tools
+		contents = {'PATH': os.environ.get('PATH'), 'tools': tools}
+		try:
+			self.cache_filename.parent.mkdir(parents = True, exist_ok = True)
+			self.cache_filename.write_text(json.dumps(contents, indent = 4))
+		except OSError:
+			logger.warning(f"Could not write the tool cache to {self.cache_filename}")
+
+	@staticmethod
+	def locate(name: str) -> Optional[Path]:
+		""" Finds a program on the PATH. Falls back to the anaconda install folder, which is where prokka is usually installed."""
+		location = shutil.which(name)
+		if location:
+			return Path(location)
+		anaconda = systemio.get_anaconda_install()
+		if anaconda and (anaconda / name).exists():
+			return anaconda / name
+		return None
+
+	def _probe(self, name: str) -> ToolInfo:
+		path = self.locate(name)
+		if path is None:
+			return ToolInfo(name, None)
+		mtime = path.stat().st_mtime
+
+		cached = self._cache.get(name)
+		if cached and cached['path'] == str(path) and cached['mtime'] == mtime:
+			return ToolInfo(**cached)
+
+		argument = VERSION_ARGUMENTS.get(name, '--version')
+		try:
+			# Some programs (ex. prokka) report their version on stderr.
+			result = subprocess.run(
+				[str(path), argument], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True
+			)
+			version = result.stdout if result.returncode == 0 else None
+		except OSError:
+			version = None
+		return ToolInfo(name, str(path), mtime, version)
+
+	def resolve(self, names: Iterable[str]) -> Dict[str, ToolInfo]:
+		""" Resolves several programs at once. Programs that are not cached are probed in parallel."""
+		names = [i for i in names if i not in self.tools]
+		if names:
+			with ThreadPoolExecutor(max_workers = len(names)) as executor:
+				results = list(executor.map(self._probe, names))
+			with self._lock:
+				for info in results:
+					self.tools[info.name] = info
+				self._write_cache()
+		return {name: self.tools[name] for name in self.tools}
+
+	def get(self, name: str) -> ToolInfo:
+		if name not in self.tools:
+			self.resolve([name])
+		return self.tools[name]
+
+	def path(self, name: str) -> Optional[Path]:
+		info = self.get(name)
+		return Path(info.path) if info.path else None
+
+	def version(self, name: str) -> Optional[str]:
+		return self.get(name).version
+
+	def clear(self):
+		""" Forgets every program, including the ones saved in the cache file."""
+		self.tools = dict()
+		self._cache = dict()
+		try:
+			self.cache_filename.unlink()
+		except FileNotFoundError:
+			pass
+
+
+registry = ToolRegistry()  # Should use this object to find programs.
@@ -3,11 +3,15 @@ from typing import List, Optional
 
 from loguru import logger
 
-from pipelines import systemio, programio, utilities
+from pipelines import fastqio, manifest, systemio, programio, utilities
+from pipelines.programs.registry import registry
 
 
 class Shovill:
 	program = "shovill"
+	# The compression formats shovill can read. shovill reads its input several times, so other formats are decompressed
+	# to disk before it starts.
+	compressions = {None, 'gzip'}
 
 	def __init__(self, minlen = 500, assembler = 'spades', threads: int = 8):
 		self.minlen = minlen
@@ -19,10 +23,13 @@ class Shovill:
 			sample_name = utilities.get_name_from_reads(forward)
 		output = programio.ShovillOutput.expected(output_folder, sample_name)
 		command = self.get_command(forward, reverse, output_folder)
+		folder = fastqio.get_decompression_folder(output_folder, self.program)
+		command = fastqio.decompress_command(command, [forward, reverse], self.compressions, folder, single_pass = False)
+		step = manifest.Step(output_folder, self.program, command, [forward, reverse], [output.contigs], registry.version(self.program))
 
-		if not output.exists():
+		if not step.is_current():
 			logger.info(f"Assembly: Generating assembly...")
-			systemio.command_runner.run(command, output_folder)
+			systemio.command_runner.run(command, output_folder, threads = self.threads, step = step)
 		else:
 			logger.info(f"Assembly: The output files already exist in {output_folder}")
 
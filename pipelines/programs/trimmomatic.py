@@ -1,13 +1,43 @@
+import shlex
+import sys
 from pathlib import Path
 from typing import List, Optional
 
 from loguru import logger
 
-from pipelines import systemio, programio
+from pipelines import fastqio, manifest, systemio, programio
+from pipelines.programs.registry import registry
 from pipelines.resources import illumina_filename
 
 ADAPTERS_FILENAME = illumina_filename
 
+# The suffix of the trimmed reads for each compression format.
+COMPRESSION_SUFFIXES = {
+	None: ".fastq",
+	'gzip': ".fastq.gz",
+	'zstd': ".fastq.zst"
+}
+
+# Trimmomatic writes each output to a named pipe which is read by a compressor. Called as
+# `bash -c COMPRESS_SCRIPT bash pipe1 output1 ... pipe4 output4 -- trimmomatic ...`
+COMPRESS_SCRIPT = """
+pipes=(); pids=()
+while [ "$1" != "--" ]; do
+	mkfifo "$1"
+	{compressor} < "$1" > "$2" &
+	pipes+=("$1"); pids+=($!)
+	shift 2
+done
+shift
+"$@"
+status=$?
+# If trimmomatic failed before opening every pipe, some compressors are still waiting for it.
+[ $status -eq 0 ] || kill "${{pids[@]}}" 2> /dev/null
+for pid in "${{pids[@]}}"; do wait "$pid" || status=1; done
+rm -f "${{pipes[@]}}"
+exit $status
+"""
+
 
 class Trimmomatic:
 	"""
@@ -22,15 +52,33 @@ class Trimmomatic:
 			trimmomatic_stdout.txt
 	"""
 	program = "trimmomatic"
+	# The compression formats trimmomatic can read. Other formats are decompressed while it runs.
+	compressions = {None, 'gzip', 'bzip2'}
 
 	def __init__(self, leading: int = 3, trailing: int = 3, window: str = "4:15", minimum: int = 36, clip = ADAPTERS_FILENAME, threads: int = 8,
-			stringent: bool = False):
+			stringent: bool = False, compression: Optional[str] = None, level: Optional[int] = None):
+		"""
+		Parameters
+		----------
+		compression: Optional[str]; default None
+			How to compress the trimmed reads. One of `gzip` or `zstd`. The reads are left uncompressed if not given.
+			Programs which can't read zstd (breseq, shovill, fastqc) are given the reads through
+			`fastqio.decompress_command()`.
+		level: Optional[int]
+			The compression level. Trimmomatic compresses gzip files itself with the default level, so the reads are only
+			piped through a separate compressor when a level is given or `zstd` is used.
+		"""
 		self.leading: int = leading
 		self.trailing: int = trailing
 		self.window: str = window
 		self.minimum: int = minimum
 		self.clip: Path = clip
 		self.threads: int = threads
+		if compression not in COMPRESSION_SUFFIXES:
+			message = f"Unsupported compression: '{compression}'. Expected one of {[i for i in COMPRESSION_SUFFIXES if i]}"
+			raise ValueError(message)
+		self.compression: Optional[str] = compression
+		self.level: Optional[int] = level
 
 		if stringent:
 			self.leading = 20
@@ -43,7 +91,7 @@ class Trimmomatic:
 
 	@staticmethod
 	def version() -> Optional[str]:
-		return systemio.check_output(["trimmomatic", "-version"])
+		return registry.version("trimmomatic")
 
 	def test(self):
 		result = self.version()
@@ -69,15 +117,19 @@ class Trimmomatic:
 		if not output_folder.exists():
 			output_folder.mkdir()
 
-		output = programio.TrimmomaticOutput.expected(output_folder, sample_name)
+		output = programio.TrimmomaticOutput.expected(output_folder, sample_name, COMPRESSION_SUFFIXES[self.compression])
 		command = self.get_command(forward, reverse, output)
+		folder = fastqio.get_decompression_folder(output_folder, self.program)
+		command = fastqio.decompress_command(command, [forward, reverse], self.compressions, folder)
+		step = manifest.Step(output_folder, self.program, command, [forward, reverse, self.clip], output.reads(), self.version())
 
-		if not output.exists():
-			systemio.command_runner.run(command, output_folder, threads = self.threads)
+		if not step.is_current():
+			systemio.command_runner.run(command, output_folder, threads = self.threads, step = step)
 
 		return output
 
-	def get_command(self, forward: Path, reverse: Path, output: programio.TrimmomaticOutput) -> List[str]:
+	def get_command(self, forward: Path, reverse: Path, output: programio.TrimmomaticOutput, compress: bool = True) -> List[str]:
+		""" `compress = False` gives the bare trimmomatic command, without the compressors used for the zstd or leveled gzip modes."""
 		command = [
 			self.program, "PE",
 			# "-threads", str(self.options.threads),
@@ -94,4 +146,198 @@ class Trimmomatic:
 			f"SLIDINGWINDOW:{self.window}",
 			f"MINLEN:{self.minimum}"
 		]
-		return systemio.format_command(command)
+		command = systemio.format_command(command)
+		compressor = self.get_compressor()
+		if compressor and compress:
+			command = self._compress_through_pipes(command, output, compressor)
+		return command
+
+	def get_compressor(self, native: bool = True) -> Optional[str]:
+		"""
+			The command which compresses stdin to stdout. Returns None when trimmomatic can write the reads itself, unless
+			`native` is False. gzip is used when no compression was chosen.
+		"""
+		if self.compression == 'zstd':
+			return f"zstd -q -{self.level or 3} -c"
+		if (self.compression == 'gzip' and self.level is not None) or not native:
+			return f"gzip -{self.level or 6} -c"
+		return None
+
+	@staticmethod
+	def _compress_through_pipes(command: List[str], output: programio.TrimmomaticOutput, compressor: str) -> List[str]:
+		outputs = [str(i) for i in output.reads()]
+		pipes = [f"{i}.pipe" for i in outputs]
+		command = [pipes[outputs.index(i)] if i in outputs else i for i in command]
+		arguments = list()
+		for pipe, filename in zip(pipes, outputs):
+			arguments += [pipe, filename]
+		return ["bash", "-c", COMPRESS_SCRIPT.format(compressor = compressor), "bash"] + arguments + ["--"] + command
+
+
+# Runs each background command, then the consumer given as the remaining arguments. Called as
+# `bash -c STREAM_SCRIPT bash consumer ...`
+STREAM_SCRIPT = """
+mkdir -p {folder}
+mkfifo {pipes}
+pids=()
+{background}
+"$@"
+status=$?
+# If the consumer failed, the other programs may be waiting on a pipe which will never be opened.
+[ $status -eq 0 ] || kill "${{pids[@]}}" 2> /dev/null
+for pid in "${{pids[@]}}"; do wait "$pid" || status=1; done
+rm -rf {folder}
+exit $status
+"""
+
+# Merges two fastq files into one, alternating between the forward and reverse read of each pair. Called as
+# `python -c INTERLEAVE_SCRIPT forward reverse`. Trimmomatic writes each file in buffered blocks, so one file can get far
+# ahead of the other. Each file is read by its own thread and the reads which are ahead are held in memory, since
+# waiting on one file while the other pipe is full would stall trimmomatic.
+INTERLEAVE_SCRIPT = """
+import os, queue, sys, threading
+
+def read(path, chunks):
+	file = os.open(path, os.O_RDONLY)
+	while True:
+		data = os.read(file, 1 << 20)
+		chunks.put(data)
+		if not data:
+			break
+	os.close(file)
+
+queues = [queue.Queue(), queue.Queue()]
+for path, chunks in zip(sys.argv[1:3], queues):
+	threading.Thread(target = read, args = (path, chunks), daemon = True).start()
+lines, partial, finished = [[], []], [b"", b""], [False, False]
+output = sys.stdout.buffer
+while not all(finished):
+	# Wait on the file which is behind. The other file keeps being read by its own thread.
+	side = 0 if len(lines[0]) <= len(lines[1]) else 1
+	if finished[side]:
+		side = 1 - side
+	data = queues[side].get()
+	if not data:
+		finished[side] = True
+		if partial[side]:
+			lines[side].append(partial[side])
+	else:
+		lines[side] += (partial[side] + data).split(b"\\n")
+		partial[side] = lines[side].pop()
+	count = min(len(lines[0]), len(lines[1])) // 4 * 4
+	if count:
+		merged = list()
+		for start in range(0, count, 4):
+			merged += lines[0][start:start + 4] + lines[1][start:start + 4]
+		output.write(b"\\n".join(merged) + b"\\n")
+		del lines[0][:count], lines[1][:count]
+output.flush()
+# Every forward read should have a reverse read.
+sys.exit(1 if lines[0] or lines[1] else 0)
+"""
+
+
+class TrimmedStream:
+	"""
+		Streams the trimmed reads of a sample straight into another program through a named pipe, so the trimmed reads
+		never have to be written to disk and read back. Trimmomatic runs in the background of the consumer's command.
+
+		Trimmomatic writes the forward and reverse reads of each pair at the same time, so a program reading one file
+		after the other would stall once the other pipe fills. The paired reads are interleaved into a single pipe
+		instead. The pipe can only be read once, so the consumer must read its input in a single pass and not care about
+		pairing (ex. breseq). Programs which read their input several times, such as shovill, should read compressed
+		trimmed reads instead.
+	Parameters
+	----------
+	workflow: Trimmomatic
+	forward, reverse: Path
+		The untrimmed reads.
+	folder: Path
+		Where the pipes are created and where the copy of the trimmed reads is saved.
+	sample_name: str
+	keep: bool; default False
+		Whether to also save a copy of the trimmed reads, compressed with the workflow's compression (gzip by default).
+	"""
+
+	def __init__(self, workflow: Trimmomatic, forward: Path, reverse: Path, folder: Path, sample_name: str, keep: bool = False):
+		self.workflow = workflow
+		self.source_forward = forward
+		self.source_reverse = reverse
+		self.folder = folder
+		self.sample_name = sample_name
+		self.keep = keep
+
+		self.pipe_folder = folder / f".{sample_name}.pipes"
+		# The pipe the consumer reads from.
+		self.reads = self.pipe_folder / f"{sample_name}.trimmed.interleaved.fastq"
+		self.output = programio.TrimmomaticOutput.expected(folder, sample_name, COMPRESSION_SUFFIXES[workflow.compression or 'gzip'])
+
+	@property
+	def inputs(self) -> List[Path]:
+		""" The files the trimmed reads are generated from. Should be used as the consumer's inputs in its manifest."""
+		return [self.source_forward, self.source_reverse, self.workflow.clip]
+
+	def wrap(self, command: List[str]) -> List[str]:
+		""" Runs `command` while trimmomatic feeds it through `self.reads`."""
+		trimmed = programio.TrimmomaticOutput(
+			self.sample_name, self.pipe_folder,
+			*(self.pipe_folder / f"trimmed.{i}.fastq" for i in ['1P', '2P', '1U', '2U'])
+		)
+		pipes = [self.reads, trimmed.forward, trimmed.reverse]
+		background = list()
+		if self.keep:
+			compressor = self.workflow.get_compressor(native = False)
+			paired = list()
+			for source, target in [(trimmed.forward, self.output.forward), (trimmed.reverse, self.output.reverse)]:
+				# Split each read file between the interleaved pipe and the compressor.
+				interleaved, copy = source.with_suffix(".interleave"), source.with_suffix(".copy")
+				background.append(f"tee {_quote(interleaved)} < {_quote(source)} > {_quote(copy)}")
+				background.append(f"{compressor} < {_quote(copy)} > {_quote(target)}")
+				pipes += [interleaved, copy]
+				paired.append(interleaved)
+			for source, target in [(trimmed.unpaired_forward, self.output.unpaired_forward), (trimmed.unpaired_reverse, self.output.unpaired_reverse)]:
+				background.append(f"{compressor} < {_quote(source)} > {_quote(target)}")
+				pipes.append(source)
+		else:
+			paired = [trimmed.forward, trimmed.reverse]
+			trimmed.unpaired_forward = trimmed.unpaired_reverse = Path("/dev/null")
+
+		trimming = self.workflow.get_command(self.source_forward, self.source_reverse, trimmed, compress = False)
+		trimming = fastqio.decompress_command(
+			trimming, [self.source_forward, self.source_reverse], self.workflow.compressions, self.pipe_folder / "reads"
+		)
+		background.insert(0, shlex.join(trimming))
+		background.append(
+			f"{_quote(sys.executable)} -c {shlex.quote(INTERLEAVE_SCRIPT)} {_quote(paired[0])} {_quote(paired[1])} > {_quote(self.reads)}"
+		)
+		script = STREAM_SCRIPT.format(
+			folder = _quote(self.pipe_folder),
+			pipes = " ".join(_quote(i) for i in pipes),
+			background = "\n".join(f"{i} &\npids+=($!)" for i in background)
+		)
+		return ["bash", "-c", script, "bash"] + systemio.format_command(command)
+
+	def finish(self, succeeded: bool = True):
+		"""
+			Records the saved copy of the trimmed reads, so trimming the sample again can be skipped.
+		Parameters
+		----------
+		succeeded: bool; default True
+			Whether the wrapped command exited successfully. Its exit status includes the status of trimmomatic and of
+			each compressor. The saved copy is deleted if the command failed or if any of the four read files is missing,
+			since a partial copy would otherwise be mistaken for finished trimmed reads.
+		"""
+		if not self.keep:
+			return
+		reads = self.output.reads()
+		if not succeeded or not all(i.exists() for i in reads):
+			for filename in reads:
+				filename.unlink(missing_ok = True)
+			return
+		command = self.workflow.get_command(self.source_forward, self.source_reverse, self.output)
+		step = manifest.Step(self.folder, self.workflow.program, command, self.inputs, self.output.reads(), self.workflow.version())
+		step.record()
+
+
+def _quote(path: Path) -> str:
+	return shlex.quote(str(path))
@@ -0,0 +1,269 @@
+"""
+	A native replacement for the parts of FastQC the pipelines actually use. Reads are parsed in large chunks with numpy,
+	so memory use depends on the chunk size rather than the size of the read file. The per-position quality, base
+	composition, GC, length, and duplication statistics of each sample are saved as a single `.npz` file which
+	`programio.FastQCOutput` can load.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest, programio, utilities
+
+VERSION = "1"
+
+# Phred+33 quality scores range from 0 ('!') to 93 ('~').
+MAX_QUALITY = 93
+BASES = "ACGTN"
+
+# Converts each byte of a sequence to its index in `BASES`. Anything other than A, C, G, or T counts as N.
+BASE_CODES = numpy.full(256, 4, dtype = numpy.uint8)
+for _index, _base in enumerate("ACGT"):
+	BASE_CODES[ord(_base)] = _index
+	BASE_CODES[ord(_base.lower())] = _index
+
+# The bytes which are letters, so sequences can be separated from the newlines, spaces, and positions around them.
+LETTERS = numpy.zeros(256, dtype = bool)
+LETTERS[[ord(i) for i in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"]] = True
+
+
+@dataclass
+class ReadProfile:
+	"""
+		The summary statistics of a single read file.
+	Attributes
+	----------
+	quality_counts: numpy.ndarray
+		The number of bases with each quality score at each position, with shape `(positions, MAX_QUALITY + 1)`.
+	base_counts: numpy.ndarray
+		The number of each base (in the order of `BASES`) at each position, with shape `(positions, 5)`.
+	length_histogram: numpy.ndarray
+		The number of reads with each length.
+	gc_histogram: numpy.ndarray
+		The number of reads with each GC percentage, from 0 to 100.
+	duplicate_fraction: float
+		The fraction of the sampled reads which are exact copies of another sampled read.
+	"""
+	reads: int
+	bases: int
+	quality_counts: numpy.ndarray
+	base_counts: numpy.ndarray
+	length_histogram: numpy.ndarray
+	gc_histogram: numpy.ndarray
+	duplicate_fraction: float
+
+	@classmethod
+	def empty(cls) -> 'ReadProfile':
+		return cls(
+			reads = 0,
+			bases = 0,
+			quality_counts = numpy.zeros((0, MAX_QUALITY + 1), dtype = numpy.int64),
+			base_counts = numpy.zeros((0, len(BASES)), dtype = numpy.int64),
+			length_histogram = numpy.zeros(0, dtype = numpy.int64),
+			gc_histogram = numpy.zeros(101, dtype = numpy.int64),
+			duplicate_fraction = 0.0
+		)
+
+	def mean_quality(self) -> numpy.ndarray:
+		""" The mean quality score at each position."""
+		totals = self.quality_counts.sum(axis = 1)
+		scores = self.quality_counts @ numpy.arange(MAX_QUALITY + 1)
+		return numpy.divide(scores, totals, out = numpy.zeros(len(totals)), where = totals > 0)
+
+	def n_content(self) -> numpy.ndarray:
+		""" The fraction of bases at each position which are N."""
+		totals = self.base_counts.sum(axis = 1)
+		return numpy.divide(self.base_counts[:, 4], totals, out = numpy.zeros(len(totals)), where = totals > 0)
+
+	def gc_content(self) -> float:
+		""" The fraction of all called bases which are G or C."""
+		called = self.base_counts[:, :4].sum()
+		return float(self.base_counts[:, 1:3].sum() / called) if called else 0.0
+
+	def mean_length(self) -> float:
+		return self.bases / self.reads if self.reads else 0.0
+
+	def to_arrays(self, prefix: str) -> Dict[str, numpy.ndarray]:
+		return {f"{prefix}.{field.name}": numpy.asarray(getattr(self, field.name)) for field in fields(self)}
+
+	@classmethod
+	def from_arrays(cls, arrays, prefix: str) -> 'ReadProfile':
+		values = {field.name: arrays[f"{prefix}.{field.name}"] for field in fields(cls)}
+		values['reads'] = int(values['reads'])
+		values['bases'] = int(values['bases'])
+		values['duplicate_fraction'] = float(values['duplicate_fraction'])
+		return cls(**values)
+
+
+def _grow(array: numpy.ndarray, length: int) -> numpy.ndarray:
+	""" Pads the first axis of `array` with zeros so it is at least `length` long."""
+	if len(array) >= length:
+		return array
+	padding = [(0, length - len(array))] + [(0, 0)] * (array.ndim - 1)
+	return numpy.pad(array, padding)
+
+
+class _ProfileBuilder:
+	""" Accumulates the statistics of a read file one chunk at a time."""
+
+	def __init__(self, duplicate_sample: int):
+		self.profile = ReadProfile.empty()
+		self.duplicate_sample = duplicate_sample
+		self.sequences = Counter()
+		self.sampled = 0
+
+	def add(self, buffer: numpy.ndarray, newlines: numpy.ndarray):
+		""" Adds the records in `buffer`, given the positions of the four newlines of each record."""
+		count = len(newlines)
+		sequence_start = newlines[:, 0] + 1
+		quality_start = newlines[:, 2] + 1
+		lengths = newlines[:, 1] - sequence_start
+		# Ignore any bases without a quality score, in case the file is malformed.
+		lengths = numpy.minimum(lengths, newlines[:, 3] - quality_start)
+		lengths = numpy.maximum(lengths, 0)
+
+		total = int(lengths.sum())
+		maximum = int(lengths.max())
+		read_index = numpy.repeat(numpy.arange(count), lengths)
+		position = numpy.arange(total) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+		bases = BASE_CODES[buffer[numpy.repeat(sequence_start, lengths) + position]]
+		quality = buffer[numpy.repeat(quality_start, lengths) + position].astype(numpy.int64) - 33
+		numpy.clip(quality, 0, MAX_QUALITY, out = quality)
+
+		profile = self.profile
+		width = MAX_QUALITY + 1
+		profile.quality_counts = _grow(profile.quality_counts, maximum)
+		profile.quality_counts[:maximum] += numpy.bincount(position * width + quality, minlength = maximum * width).reshape(maximum, width)
+		profile.base_counts = _grow(profile.base_counts, maximum)
+		profile.base_counts[:maximum] += numpy.bincount(position * len(BASES) + bases, minlength = maximum * len(BASES)).reshape(maximum, len(BASES))
+
+		length_counts = numpy.bincount(lengths)
+		profile.length_histogram = _grow(profile.length_histogram, len(length_counts))
+		profile.length_histogram[:len(length_counts)] += length_counts
+
+		gc = numpy.bincount(read_index, weights = (bases == 1) | (bases == 2), minlength = count)
+		has_bases = lengths > 0
+		percent = numpy.rint(100 * gc[has_bases] / lengths[has_bases]).astype(numpy.int64)
+		profile.gc_histogram += numpy.bincount(percent, minlength = 101)
+
+		profile.reads += count
+		profile.bases += total
+
+		# Duplication is estimated from the first reads of the file, which keeps the memory use bounded.
+		remaining = min(self.duplicate_sample - self.sampled, count)
+		for start, length in zip(sequence_start[:remaining], lengths[:remaining]):
+			self.sequences[buffer[start:start + length].tobytes()] += 1
+		self.sampled += max(remaining, 0)
+
+	def finish(self) -> ReadProfile:
+		if self.sampled:
+			self.profile.duplicate_fraction = 1 - len(self.sequences) / self.sampled
+		return self.profile
+
+
+def profile_reads(filename: Path, chunk_size: int = 2 ** 22, duplicate_sample: int = 100000) -> ReadProfile:
+	"""
+		Calculates the summary statistics of a fastq file, which may be compressed.
+	Parameters
+	----------
+	filename: Path
+	chunk_size: int; default 4 MiB
+		How many bytes to read at once. The memory used is roughly 40 times this.
+	duplicate_sample: int; default 100000
+		The number of reads used to estimate the duplication level.
+	"""
+	builder = _ProfileBuilder(duplicate_sample)
+	for buffer, newlines, _ in fastqio.iter_record_chunks(filename, chunk_size):
+		builder.add(buffer, newlines)
+	return builder.finish()
+
+
+def save_profiles(filename: Path, profiles: Dict[str, ReadProfile]):
+	""" Saves the profiles of each read file of a sample, keyed by the name of the read file."""
+	arrays = {'names': numpy.array(list(profiles))}
+	for index, profile in enumerate(profiles.values()):
+		arrays.update(profile.to_arrays(str(index)))
+	with filename.open('wb') as file1:
+		numpy.savez_compressed(file1, **arrays)
+
+
+def load_profiles(filename: Path) -> Dict[str, ReadProfile]:
+	with numpy.load(filename) as arrays:
+		return {str(name): ReadProfile.from_arrays(arrays, str(index)) for index, name in enumerate(arrays['names'])}
+
+
+class QualityProfiler:
+	"""
+		Used in place of `FastQC`. Profiles each read file in a separate process.
+	Parameters
+	----------
+	processes: Optional[int]
+		The number of worker processes. Defaults to the number of cpus.
+	chunk_size, duplicate_sample
+		Passed to `profile_reads()`.
+	"""
+	program = "qc"
+
+	def __init__(self, processes: Optional[int] = None, chunk_size: int = 2 ** 22, duplicate_sample: int = 100000):
+		self.processes = processes
+		self.chunk_size = chunk_size
+		self.duplicate_sample = duplicate_sample
+		self._executor: Optional[ProcessPoolExecutor] = None
+
+	@property
+	def executor(self) -> ProcessPoolExecutor:
+		if self._executor is None:
+			self._executor = ProcessPoolExecutor(max_workers = self.processes)
+		return self._executor
+
+	def close(self):
+		if self._executor is not None:
+			self._executor.shutdown()
+			self._executor = None
+
+	@staticmethod
+	def version() -> str:
+		return VERSION
+
+	def get_step(self, output_folder: Path, reads: List[Path], output: programio.FastQCOutput) -> manifest.Step:
+		command = [self.program, f"chunk_size={self.chunk_size}", f"duplicate_sample={self.duplicate_sample}"] + [str(i) for i in reads]
+		return manifest.Step(output_folder, self.program, command, reads, [output.profile], self.version())
+
+	def run(self, output_folder: Path, *reads) -> programio.FastQCOutput:
+		""" Same as `FastQC.run()`. The reads are profiled in parallel."""
+		return self.run_samples([(output_folder, list(reads))])[0]
+
+	def run_samples(self, samples: Iterable) -> List[programio.FastQCOutput]:
+		"""
+			Profiles several samples at once. Every read file of every sample is handed to the process pool together.
+		Parameters
+		----------
+		samples: Iterable[Tuple[Path, List[Path]]]
+			The output folder and read files of each sample.
+		"""
+		pending = list()
+		for output_folder, reads in samples:
+			reads = [Path(i) for i in reads]
+			utilities.checkdir(output_folder)
+			output = programio.FastQCOutput.expected(output_folder, utilities.get_name_from_reads(reads[0]) or output_folder.name)
+			step = self.get_step(output_folder, reads, output)
+			if step.is_current():
+				pending.append((output, step, None, reads))
+				continue
+			futures = [self.executor.submit(profile_reads, i, self.chunk_size, self.duplicate_sample) for i in reads]
+			pending.append((output, step, futures, reads))
+
+		results = list()
+		for output, step, futures, reads in pending:
+			if futures is not None:
+				profiles = {read.name: future.result() for read, future in zip(reads, futures)}
+				save_profiles(output.profile, profiles)
+				step.record()
+				logger.info(f"QC: Profiled {sum(i.reads for i in profiles.values())} reads for {output.name}")
+			results.append(output)
+		return results
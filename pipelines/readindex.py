@@ -0,0 +1,120 @@
+"""
+	A small sidecar index for each read file, built in a single pass. The index records the number of reads and bases
+	and the position of every Nth record, so coverage can be estimated without reading the file again and parallel
+	readers can split a file at record boundaries. An index is rebuilt whenever the size or modification time of its
+	read file changes. The indexes are saved in the `reads` folder of `utilities.get_cache_folder()` rather than next to
+	the reads.
+"""
+import hashlib
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy
+
+from pipelines import fastqio, manifest, utilities
+
+VERSION = "1"
+
+# Record the position of every `INTERVAL`th record.
+INTERVAL = 100000
+
+
+@dataclass
+class ReadIndex:
+	"""
+	Attributes
+	----------
+	stream_size: int
+		The size of the uncompressed reads.
+	offsets: List[int]
+		The position of records `0, interval, 2 * interval, ...` in the uncompressed reads.
+	"""
+	filename: str
+	reads: int = 0
+	bases: int = 0
+	min_length: int = 0
+	max_length: int = 0
+	stream_size: int = 0
+	interval: int = INTERVAL
+	offsets: List[int] = field(default_factory = list)
+
+	@property
+	def mean_length(self) -> float:
+		return self.bases / self.reads if self.reads else 0.0
+
+	def coverage(self, genome_size: int) -> float:
+		return self.bases / genome_size
+
+	def chunks(self, count: int) -> List[Tuple[int, int]]:
+		"""
+			Splits the reads into at most `count` byte ranges which each start at a record. The ranges are positions in
+			the uncompressed reads and can be passed to `fastqio.iter_record_chunks()`.
+		"""
+		if not self.offsets:
+			return []
+		count = max(1, min(count, len(self.offsets)))
+		starts = [self.offsets[(index * len(self.offsets)) // count] for index in range(count)]
+		ends = starts[1:] + [self.stream_size]
+		return list(zip(starts, ends))
+
+
+def get_index_filename(path: Union[str, Path], cache_folder: Optional[Path] = None) -> Path:
+	"""
+		Where the index of a read file is saved. Read files in different folders often share a name, so the name is
+		prefixed with a hash of the file's absolute path.
+	Parameters
+	----------
+	path: Union[str, Path]
+	cache_folder: Optional[Path]
+		Defaults to the `reads` folder in `utilities.get_cache_folder()`.
+	"""
+	path = Path(path).absolute()
+	cache_folder = Path(cache_folder) if cache_folder else utilities.get_cache_folder() / "reads"
+	key = hashlib.sha256(str(path).encode()).hexdigest()[:16]
+	return cache_folder / f"{key}.{path.name}.fqi"
+
+
+def build_index(path: Union[str, Path], interval: int = INTERVAL, chunk_size: int = 2 ** 22) -> ReadIndex:
+	""" Indexes a read file in a single pass. The index is not saved."""
+	path = Path(path)
+	index = ReadIndex(str(path), interval = interval)
+	minimum, maximum = None, 0
+	for buffer, newlines, offset in fastqio.iter_record_chunks(path, chunk_size):
+		count = len(newlines)
+		starts = numpy.concatenate([[0], newlines[:-1, 3] + 1])
+		lengths = newlines[:, 1] - newlines[:, 0] - 1
+		record_numbers = numpy.arange(index.reads, index.reads + count)
+		index.offsets += (offset + starts[record_numbers % interval == 0]).tolist()
+
+		index.reads += count
+		index.bases += int(lengths.sum())
+		minimum = int(lengths.min()) if minimum is None else min(minimum, int(lengths.min()))
+		maximum = max(maximum, int(lengths.max()))
+		index.stream_size = offset + int(newlines[-1, -1]) + 1
+	index.min_length = minimum or 0
+	index.max_length = maximum
+	return index
+
+
+def load_index(path: Union[str, Path], interval: int = INTERVAL) -> Optional[ReadIndex]:
+	""" Loads the saved index of a read file. Returns None if there is no index or the read file changed since."""
+	path = Path(path)
+	contents = manifest.load_sidecar(get_index_filename(path), VERSION, [path], {'interval': interval})
+	return ReadIndex(**contents) if contents is not None else None
+
+
+def get_index(path: Union[str, Path], interval: int = INTERVAL) -> ReadIndex:
+	""" Loads the index of a read file, building and saving it first if needed."""
+	path = Path(path)
+	index = load_index(path, interval)
+	if index is None:
+		index = build_index(path, interval)
+		# The cache folder may not be writable. The index still works, it just won't be reused.
+		manifest.save_sidecar(get_index_filename(path), VERSION, [path], asdict(index), {'interval': interval})
+	return index
+
+
+def estimate_coverage(reads: Iterable[Path], genome_size: int) -> float:
+	""" The mean depth of coverage that all of `reads` would give a genome of `genome_size` bases."""
+	return sum(get_index(i).bases for i in reads) / genome_size
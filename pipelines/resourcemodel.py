@@ -0,0 +1,111 @@
+"""
+	Predicts the memory a program will need from the size of its input and the runs recorded in the project's ledger.
+	Used to size srun/sbatch requests and to schedule local commands. The cpus requested always match the program's
+	thread argument.
+"""
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from pipelines import ledger
+
+# Memory requested per cpu for programs without a default or any history, in MB. This was the original request for every program.
+FALLBACK_MEM_PER_CPU = 27000
+
+
+@dataclass
+class ResourceRequest:
+	cpus: int
+	# Total memory in MB. None if nothing is known about the program.
+	memory: Optional[int] = None
+
+	@property
+	def mem_per_cpu(self) -> int:
+		if self.memory is None:
+			return FALLBACK_MEM_PER_CPU
+		return int(math.ceil(self.memory / self.cpus))
+
+
+# Conservative requests used until a program has enough history. Memory is the total for the job, in MB.
+DEFAULT_MEMORY: Dict[str, int] = {
+	'trimmomatic': 8000,
+	'shovill': 64000,
+	'breseq': 32000,
+	'prokka': 16000
+}
+
+
+class ResourceModel:
+	"""
+		Predicts resource requests for each program from the ledger.
+	Parameters
+	----------
+	run_ledger: Optional[ledger.RunLedger]
+		The ledger with previous runs. If None, only the defaults are used.
+	min_history: int; default 3
+		The number of successful runs of a program needed before its history is used.
+	headroom: float; default 1.25
+		Multiplier applied to the predicted memory.
+	"""
+
+	def __init__(self, run_ledger: Optional[ledger.RunLedger] = None, min_history: int = 3, headroom: float = 1.25):
+		self.ledger = run_ledger
+		self.min_history = min_history
+		self.headroom = headroom
+		self._history: Dict[str, List[ledger.LedgerRecord]] = dict()
+		self._ledger_mtime: Optional[float] = None
+
+	def history(self, tool: str) -> List[ledger.LedgerRecord]:
+		""" Returns the successful runs of a program which were measured locally or inside their srun allocation or job."""
+		if self.ledger is None or not self.ledger.filename.exists():
+			return []
+		mtime = self.ledger.filename.stat().st_mtime
+		if mtime != self._ledger_mtime:
+			self._history = dict()
+			self._ledger_mtime = mtime
+		if tool not in self._history:
+			self._history[tool] = [
+				i for i in self.ledger.records(tool)
+				if i.exit_code == 0 and (i.in_job or not i.srun) and i.wall_seconds > 0
+			]
+		return self._history[tool]
+
+	def predict(self, tool: str, input_bytes: int, threads: int) -> ResourceRequest:
+		"""
+			Predicts the resources needed to run `tool` on `input_bytes` of input.
+		Parameters
+		----------
+		tool: str
+			The name of the program (ex. 'breseq').
+		input_bytes: int
+			The combined size of the input files.
+		threads: int
+			The number of threads the program was told to use. This is always the number of cpus requested, since the
+			program starts that many threads no matter how many cpus it is given.
+		"""
+		threads = max(1, int(threads))
+		history = self.history(tool)
+		if len(history) < self.min_history:
+			return ResourceRequest(threads, DEFAULT_MEMORY.get(tool))
+		return ResourceRequest(threads, self._predict_memory(history, input_bytes))
+
+	def _predict_memory(self, history: List[ledger.LedgerRecord], input_bytes: int) -> int:
+		points = [(i.input_bytes, i.max_rss_kb / 1024) for i in history]
+		slope, intercept = _fit_line(points)
+		# Shift the line up so that it covers every observed run.
+		offset = max(memory - (slope * size + intercept) for size, memory in points)
+		predicted = (slope * input_bytes + intercept + offset) * self.headroom
+		return max(1024, int(math.ceil(predicted)))
+
+
+def _fit_line(points: List[Tuple[float, float]]) -> Tuple[float, float]:
+	""" Least-squares fit of memory against input size. The slope is never negative, since more input should never need less memory."""
+	count = len(points)
+	mean_x = sum(x for x, _ in points) / count
+	mean_y = sum(y for _, y in points) / count
+	variance = sum((x - mean_x) ** 2 for x, _ in points)
+	if variance == 0:
+		return 0.0, mean_y
+	slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+	slope = max(0.0, slope)
+	return slope, mean_y - slope * mean_x
@@ -24,14 +24,24 @@ class SampleReads:
 			# This will raise a FileNotFoundError if the reads cannot be found. Don't try to ignore the error.
 			sample_id = utilities.get_name_from_reads(forward)
 
-		return SampleReads(name = sample_id, forward = forward, reverse = reverse)
+		return SampleReads(name = sample_id, forward = forward, reverse = reverse, folder = folder)
 
 	def reads(self) -> List[Path]:
 		return [self.forward, self.reverse]
 
 
-def get_samples_from_folder(folder: Path) -> List[SampleReads]:
-	"""Loads all sample folders in a given folder."""
+def get_samples_from_folder(folder: Path, catalog = None) -> List[SampleReads]:
+	"""
+		Loads all sample folders in a given folder.
+	Parameters
+	----------
+	folder: Path
+	catalog: Optional[catalog.ProjectCatalog]
+		If given, the samples are looked up in the catalog, which is only updated for folders that changed.
+	"""
+	if catalog is not None:
+		catalog.update(folder, max_depth = 1)
+		return catalog.samples(parent = folder, trimmed = False)
 	samples = list()
 	for subfolder in folder.iterdir():
 		try:
@@ -65,13 +75,17 @@ def get_samples_from_table(filename:Path)->List[SampleReads]:
 
 
 
-def verify_samples(samples: List[SampleReads]) -> bool:
+def verify_samples(samples: List[SampleReads], deep: bool = False, cache_folder: Optional[Path] = None) -> bool:
 	"""
 		Verifies that all samples exist.
 	Parameters
 	----------
 	samples: List[SampleReads]
 		A list of samples to test.
+	deep: bool; default False
+		Whether to also read every file to check that the reads are intact and paired. See `validation.validate_samples()`.
+	cache_folder: Optional[Path]
+		Where to save the validation verdicts when `deep` is set.
 	"""
 	all_exist = True
 	for sample in samples:
@@ -80,4 +94,8 @@ def verify_samples(samples: List[SampleReads]) -> bool:
 			logger.warning(f"\tForward Read: {sample.forward}")
 			logger.warning(f"\tReverse Read: {sample.reverse}")
 			all_exist = False
+	if deep and all_exist:
+		from pipelines import validation
+		verdicts = validation.validate_samples(samples, cache_folder)
+		return all(i.valid for i in verdicts.values())
 	return all_exist
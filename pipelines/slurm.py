@@ -0,0 +1,198 @@
+"""
+	Submits a stage's commands to slurm as a single job array. This lets the driver submit an entire cohort at once
+	and chain stages with dependencies instead of holding an allocation open with one blocking `srun` per sample.
+"""
+import shlex
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+from pipelines import resourcemodel, utilities
+
+SCRIPT_TEMPLATE = """#!/bin/bash
+#SBATCH --job-name={name}
+#SBATCH --array=1-{count}
+#SBATCH --cpus-per-task={threads}
+#SBATCH --mem-per-cpu={memory}
+#SBATCH --output={logs}/%a.stdout.txt
+#SBATCH --error={logs}/%a.stderr.txt
+
+bash {tasks}/${{SLURM_ARRAY_TASK_ID}}.sh
+status=$?
+echo $status > {statuses}/${{SLURM_ARRAY_TASK_ID}}
+exit $status
+"""
+
+
+@dataclass
+class ArrayTask:
+	command: List[str]
+	output_folder: Optional[Path] = None
+	# Called with the task's exit code once the job array is finished.
+	on_exit: Optional[Callable[[Optional[int]], None]] = None
+
+
+@dataclass
+class SlurmJob:
+	job_id: str
+	name: str
+	folder: Path
+	tasks: List[ArrayTask] = field(default_factory = list)
+
+	@property
+	def status_folder(self) -> Path:
+		return self.folder / "status"
+
+	@property
+	def log_folder(self) -> Path:
+		return self.folder / "logs"
+
+	@property
+	def task_folder(self) -> Path:
+		return self.folder / "tasks"
+
+	def exit_codes(self) -> List[Optional[int]]:
+		""" The exit code of each task. Tasks that never finished (ex. were cancelled or timed out) are `None`."""
+		codes = list()
+		for index in range(1, len(self.tasks) + 1):
+			filename = self.status_folder / str(index)
+			codes.append(int(filename.read_text().strip()) if filename.exists() else None)
+		return codes
+
+
+class SlurmBackend:
+	"""
+		Runs batches of commands as slurm job arrays.
+	Parameters
+	----------
+	folder: Path
+		Where the job scripts, task lists, logs, and exit codes are saved. Each submitted stage gets its own subfolder.
+	sbatch, squeue: str
+		The programs used to submit and monitor jobs. These can point to stand-in scripts for testing.
+	poll_interval: float; default 30
+		How many seconds to wait between checks of the job queue.
+	"""
+
+	def __init__(self, folder: Path, sbatch: str = "sbatch", squeue: str = "squeue", poll_interval: float = 30):
+		self.folder = utilities.checkdir(folder)
+		self.sbatch = sbatch
+		self.squeue = squeue
+		self.poll_interval = poll_interval
+
+	def submit(self, tasks: List[ArrayTask], name: str, threads: int = 8, memory: int = resourcemodel.FALLBACK_MEM_PER_CPU,
+			dependency: Optional[SlurmJob] = None) -> Optional[SlurmJob]:
+		"""
+			Submits `tasks` as a single job array.
+		Parameters
+		----------
+		tasks: List[ArrayTask]
+		name: str
+			The name of the stage. Used as the job name and the name of the subfolder with the job files.
+		threads: int; default 8
+			The number of cpus to request for each task.
+		memory: int; default 27000
+			The memory to request per cpu, in MB.
+		dependency: Optional[SlurmJob]
+			The array will only start once every task in this job finishes successfully.
+		Returns
+		-------
+		Optional[SlurmJob]
+			None if there was nothing to submit.
+		"""
+		if not tasks:
+			logger.info(f"Slurm: No commands to submit for '{name}'")
+			return None
+		job_folder = utilities.checkdir(self.folder / name)
+		job = SlurmJob("", name, job_folder, list(tasks))
+		utilities.checkdir(job.log_folder)
+		utilities.checkdir(job.status_folder)
+		utilities.checkdir(job.task_folder)
+		# Clear the exit codes and commands of a previous submission of the same stage.
+		for filename in list(job.status_folder.iterdir()) + list(job.task_folder.iterdir()):
+			filename.unlink()
+
+		# Each command gets its own script, since commands such as `bash -c` scripts can span several lines.
+		for index, task in enumerate(tasks, start = 1):
+			(job.task_folder / f"{index}.sh").write_text(shlex.join(task.command) + "\n")
+		script = SCRIPT_TEMPLATE.format(
+			name = name,
+			count = len(tasks),
+			threads = threads,
+			memory = memory,
+			logs = job.log_folder,
+			tasks = job.task_folder,
+			statuses = job.status_folder
+		)
+		script_filename = job_folder / "job.sh"
+		script_filename.write_text(script)
+
+		command = [self.sbatch, "--parsable"]
+		if dependency:
+			command += [f"--dependency=afterok:{dependency.job_id}", "--kill-on-invalid-dep=yes"]
+		command.append(script_filename)
+		result = subprocess.run([str(i) for i in command], stdout = subprocess.PIPE, stderr = subprocess.PIPE, encoding = "UTF-8")
+		if result.returncode != 0:
+			message = f"Could not submit the '{name}' job array: {result.stderr}"
+			raise RuntimeError(message)
+
+		# `--parsable` prints either `jobid` or `jobid;cluster`
+		job.job_id = result.stdout.strip().split(';')[0]
+		logger.info(f"Slurm: Submitted {len(tasks)} '{name}' tasks as job {job.job_id}")
+		return job
+
+	def is_running(self, job: SlurmJob) -> bool:
+		result = subprocess.run(
+			[self.squeue, "--noheader", "--jobs", job.job_id, "--format", "%i"],
+			stdout = subprocess.PIPE, stderr = subprocess.PIPE, encoding = "UTF-8"
+		)
+		# squeue exits with an error once the job is no longer known to the scheduler.
+		return result.returncode == 0 and bool(result.stdout.strip())
+
+	def wait(self, job: Optional[SlurmJob]) -> List[Optional[int]]:
+		"""
+			Blocks until every task in the job has left the queue, then moves each task's logs into its output folder.
+		Returns
+		-------
+		List[Optional[int]]
+			The exit code of each task, in the order the tasks were given.
+		"""
+		if job is None:
+			return []
+		while self.is_running(job):
+			time.sleep(self.poll_interval)
+
+		exit_codes = job.exit_codes()
+		for index, (task, exit_code) in enumerate(zip(job.tasks, exit_codes), start = 1):
+			if exit_code != 0:
+				logger.error(f"Slurm: Task {index} of '{job.name}' failed (exit code {exit_code}): {' '.join(task.command)}")
+			if task.output_folder and task.output_folder.exists():
+				for stream in ["stdout.txt", "stderr.txt"]:
+					log = job.log_folder / f"{index}.{stream}"
+					if log.exists():
+						log.replace(task.output_folder / stream)
+				(task.output_folder / "command.txt").write_text(" ".join(task.command))
+			if task.on_exit:
+				task.on_exit(exit_code)
+		return exit_codes
+
+
+@dataclass
+class StageBatch:
+	""" Collects the commands of a single stage while `CommandRunner.batch()` is active."""
+	name: str
+	tasks: List[ArrayTask] = field(default_factory = list)
+	threads: int = 1
+	mem_per_cpu: int = 0
+	job: Optional[SlurmJob] = None
+	exit_codes: List[Optional[int]] = field(default_factory = list)
+
+	def add(self, command: List[str], output_folder: Optional[Path], request: resourcemodel.ResourceRequest,
+			on_exit: Optional[Callable[[Optional[int]], None]] = None):
+		# Every task in an array gets the same allocation, so request enough for the largest one.
+		self.tasks.append(ArrayTask(command, output_folder, on_exit))
+		self.threads = max(self.threads, request.cpus)
+		self.mem_per_cpu = max(self.mem_per_cpu, request.mem_per_cpu)
@@ -1,29 +1,180 @@
+import gzip
+import os
+import shlex
+import shutil
 import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Any, Iterable, List, Optional, Union
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from loguru import logger
 
+from pipelines import journal, ledger, manifest, resourcemodel, slurm
 
-def get_srun_command(threads: Optional = None) -> List[Any]:
+
+def get_srun_command(threads: Optional = None, mem_per_cpu: Optional[int] = None) -> List[Any]:
 	srun_command = ["srun"]
 	if threads:
 		srun_command += ["--cpus", threads]
-	srun_command += ["--mem-per-cpu", "27000"]
+	srun_command += ["--mem-per-cpu", str(mem_per_cpu or resourcemodel.FALLBACK_MEM_PER_CPU)]
 	return srun_command
 
 
+def get_total_memory() -> int:
+	""" The physical memory of this machine, in MB."""
+	try:
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 ** 2)
+	except (ValueError, OSError, AttributeError):
+		return 0
+
+
+class ResourceBudget:
+	"""
+		Tracks how many CPUs and how much memory are currently reserved by running commands. Commands block in
+		`reserve()` until enough is free, so concurrent programs never use more than `total` CPUs or `memory` MB.
+	"""
+
+	def __init__(self, total: Optional[int] = None, memory: Optional[int] = None):
+		self.total: int = total if total else (os.cpu_count() or 1)
+		self.available: int = self.total
+		# A memory budget of 0 means memory is not tracked.
+		self.memory: int = memory if memory is not None else get_total_memory()
+		self.available_memory: int = self.memory
+		self._condition = threading.Condition()
+
+	@contextmanager
+	def reserve(self, cpus: int, memory: Optional[int] = None) -> Iterator[int]:
+		# A command asking for more than the full budget would otherwise wait forever.
+		cpus = max(1, min(int(cpus), self.total))
+		memory = min(int(memory), self.memory) if (memory and self.memory) else 0
+		with self._condition:
+			self._condition.wait_for(lambda: self.available >= cpus and self.available_memory >= memory)
+			self.available -= cpus
+			self.available_memory -= memory
+		try:
+			yield cpus
+		finally:
+			with self._condition:
+				self.available += cpus
+				self.available_memory += memory
+				self._condition.notify_all()
+
+
+class OutputStream:
+	"""
+		Writes a program's stdout or stderr to disk as it is produced.
+	Parameters
+	----------
+	filename: Path
+		Where the finished log should be saved. '.gz' is appended when `compression` is 'gzip'.
+	compression: Optional[str]; default None
+		Either None or 'gzip'.
+	limit: Optional[int]; default None
+		The maximum number of bytes to keep. Once the output grows past `limit`, only the most recent output is kept.
+		The output is written in two alternating segments of `limit / 2` bytes, so between `limit / 2` and `limit`
+		bytes of the tail are retained while the program is running.
+	"""
+	chunk_size = 2 ** 16
+
+	def __init__(self, filename: Path, compression: Optional[str] = None, limit: Optional[int] = None):
+		if compression not in (None, 'gzip'):
+			message = f"Unsupported log compression: '{compression}'"
+			raise ValueError(message)
+		self.compression = compression
+		self.filename = Path(str(filename) + ".gz") if compression else Path(filename)
+		self.limit = limit
+		self.truncated: int = 0
+
+		self.segment = self.filename.with_name(self.filename.name + ".part")
+		self.previous_segment = self.filename.with_name(self.filename.name + ".prev")
+		self._written: int = 0
+		self._previous_size: int = 0
+		self._handle = self._open(self.segment)
+
+	def _open(self, filename: Path) -> IO[bytes]:
+		if self.compression:
+			return gzip.open(filename, 'wb', compresslevel = 6)
+		return filename.open('wb')
+
+	def direct_handle(self) -> Optional[IO[bytes]]:
+		""" Returns a handle the program can write to directly when no processing is needed."""
+		if self.compression is None and self.limit is None:
+			return self._handle
+		return None
+
+	def write(self, data: bytes):
+		if self.limit and self._written and self._written + len(data) > self.limit // 2:
+			self._rotate()
+		self._handle.write(data)
+		self._written += len(data)
+
+	def _rotate(self):
+		self._handle.close()
+		if self.previous_segment.exists():
+			self.truncated += self._previous_size
+		self._previous_size = self._written
+		self.segment.replace(self.previous_segment)
+		self._handle = self._open(self.segment)
+		self._written = 0
+
+	def pump(self, pipe: IO[bytes]):
+		""" Copies everything from `pipe` into the stream. Meant to be run in a separate thread."""
+		for chunk in iter(lambda: pipe.read1(self.chunk_size), b""):
+			self.write(chunk)
+		pipe.close()
+
+	def close(self) -> Path:
+		""" Finishes writing the log and moves it to `filename`."""
+		self._handle.close()
+		if not self.previous_segment.exists():
+			self.segment.replace(self.filename)
+			return self.filename
+
+		# Gzip files can be concatenated, so the header and segments can be joined as-is whether or not they are compressed.
+		header = f"[... {self.truncated} bytes truncated ...]\n".encode()
+		with self.filename.open('wb') as output:
+			output.write(gzip.compress(header) if self.compression else header)
+			for segment in [self.previous_segment, self.segment]:
+				with segment.open('rb') as file1:
+					shutil.copyfileobj(file1, output)
+				segment.unlink()
+		return self.filename
+
+
 class CommandRunner:
-	def __init__(self, logfile: Optional[Path] = None, srun:bool = True):
+	def __init__(self, logfile: Optional[Path] = None, srun: bool = True, cpus: Optional[int] = None,
+			log_compression: Optional[str] = None, log_limit: Optional[int] = None):
 		self.use_srun = srun
 		if logfile:
 			logfile = Path(logfile)
 			if logfile.is_dir():
 				logfile = logfile / "commands.sh"
 		self.command_log = logfile
+		self.ledger: Optional[ledger.RunLedger] = None
+		self.resource_model = resourcemodel.ResourceModel()
+		self.journal: Optional[journal.RunJournal] = None
+		if logfile:
+			self.set_ledger(logfile.parent / "ledger.jsonl")
+			self.journal = journal.RunJournal(logfile.parent / "journal.jsonl")
+
+		# Local commands share a CPU and memory budget. Commands sent through srun are limited by slurm instead.
+		self.budget = ResourceBudget(cpus)
+		self._executor: Optional[ThreadPoolExecutor] = None
+		self._lock = threading.Lock()
+
+		# How the stdout and stderr files in each output folder are written.
+		self.log_compression = log_compression
+		self.log_limit = log_limit
 
-	def run(self, command: List[Any], output_folder: Optional[Path] = None, srun: bool = None, threads: int = 8, logonly: bool = False):
+		# Set while `batch()` is active. Commands are collected for a slurm job array instead of being run.
+		self._batch: Optional[slurm.StageBatch] = None
+
+	def run(self, command: List[Any], output_folder: Optional[Path] = None, srun: bool = None, threads: int = 8, logonly: bool = False,
+			step: Optional[manifest.Step] = None):
 		"""
 			Runs a program's command. Arguments are used to generate additional files containing the stdout, stderr,and
 			command used to run the program.
@@ -32,73 +183,295 @@ class CommandRunner:
 		command: List[Any]
 			The command to run. Each argument will be converted to a string.
 		output_folder: Optional[Path]
-			If given, the command, stdout, and stderr will be written to files in the output folder.
+			If given, the command, stdout, and stderr will be written to files in the output folder. stdout and stderr are
+			streamed to disk while the command runs, so they are never held in memory.
 		threads: int; default 8
 			Used to indicate the number of threads srun should use.
 			This assumes that the given command includes the relevant parameter for the program being run.
+			The cpus and memory actually requested are predicted by `resource_model` from the program's previous runs.
 		srun: bool; default None (default to CommandRunner.use_srun)
 			Whether to run the command with srun.
 		logonly: bool; default = False
 			If True, the given command will not be run. it will only be written to the command log. This is useful for programs that don't
 			work if miniconda3 is being used, such as prokka.
+		step: Optional[manifest.Step]
+			If given, the program writes into a staging folder which is moved into `output_folder` only once the command
+			finishes successfully. The step's manifest is then saved and the step is marked as finished in the journal.
 		Returns
 		-------
 		subprocess.CompletedProcess
+			`stdout` and `stderr` are only captured when `output_folder` is not given.
 		"""
 		# TODO: Maybe replace the output_folder argument with the expected output of the command, which can be used to find the destination of the log files.
-		if srun or (srun is None and self.use_srun):
-			command = get_srun_command(threads) + command
+		# Some steps wrap the program in a shell script, so the step knows the program's name better than the command does.
+		tool = step.tool if step else Path(str(command[0])).name
 		command = format_command(command)
+		inputs = ledger.get_input_sizes(command, output_folder)
+		request = self.resource_model.predict(tool, sum(inputs.values()), threads)
+
+		staged = None
+		if step and output_folder and not logonly:
+			staged = journal.StagedOutput(Path(output_folder), step.tool)
+			command = staged.rewrite(command, step.inputs)
+		program_command = command
+
+		use_srun = srun or (srun is None and self.use_srun)
+		# Commands which run through srun or a job array are measured where they run rather than by the driver.
+		usage_file = None
+		if output_folder and not logonly and (self._batch is not None or use_srun):
+			usage_file = ledger.get_usage_filename(Path(output_folder), tool)
+			command = ledger.measure_command(command, usage_file)
+
+		if self._batch is not None and not logonly:
+			self.write_command_to_commandlog(command)
+
+			def on_exit(exit_code: Optional[int]):
+				measured = ledger.read_usage(usage_file) if usage_file else None
+				if measured:
+					self._append_record(tool, program_command, inputs, threads, False, measured, in_job = True)
+				self._finish_step(step, staged, exit_code)
+
+			if staged:
+				# The task runs on another node, so the staging folder is moved into place by the job itself.
+				staged.prepare()
+				self._start_step(staged)
+				command = ["bash", "-c", f"{shlex.join(command)} && {staged.commit_command()}"]
+			with self._lock:
+				self._batch.add(command, Path(output_folder) if output_folder else None, request, on_exit)
+			return None
+
+		if use_srun:
+			command = format_command(get_srun_command(request.cpus, request.mem_per_cpu) + command)
 
-		start_datetime = datetime.now()
 		self.write_command_to_commandlog(command)
 
 		if logonly:
 			return None
-		process = subprocess.run(command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, encoding = "UTF-8")
 
-		end_datetime = datetime.now()
+		# srun requests its own allocation, so only local commands draw from the budget.
+		if use_srun:
+			cpus, memory = 1, None
+		else:
+			cpus, memory = request.cpus, request.memory
+		if staged:
+			staged.prepare()
+			self._start_step(staged)
+			log_folder = staged.staging
+		else:
+			log_folder = Path(output_folder) if output_folder else None
+		with self.budget.reserve(cpus, memory):
+			start_datetime = datetime.now()
+			process, usage = self._execute(command, log_folder)
+			end_datetime = datetime.now()
 		duration = (end_datetime - start_datetime).total_seconds()
 
 		self.write_comment_to_commandlog(f"Duration: {duration:.2f} seconds.")
 		self.write_line_to_commandlog("\n")
+		if self.ledger:
+			# The usage measured inside the srun allocation, if there is one, describes the program rather than srun.
+			measured = ledger.read_usage(usage_file) if usage_file else None
+			if measured is None:
+				measured = {
+					'start': start_datetime.isoformat(),
+					'wall_seconds': duration,
+					'user_seconds': usage.ru_utime,
+					'system_seconds': usage.ru_stime,
+					'max_rss_kb': usage.ru_maxrss,  # Reported in kilobytes on linux.
+					'exit_code': process.returncode
+				}
+			self._append_record(tool, program_command, inputs, threads, bool(use_srun), measured, in_job = usage_file is not None)
 
+		if staged and process.returncode == 0:
+			staged.commit()
 		if output_folder:
-			self.write_command(output_folder, command, process)
+			self.write_command(output_folder, command)
 		else:
 			logger.warning(f"Cannot detect the output folder...")
 			logger.warning(f"{process.stderr}")
 
+		self._finish_step(step, staged, process.returncode)
+		return process
+
+	def _append_record(self, tool: str, command: List[str], inputs: Dict[str, int], threads: int, srun: bool, usage: Dict,
+			in_job: bool):
+		if not self.ledger:
+			return
+		record = ledger.LedgerRecord(tool = tool, command = command, threads = threads, inputs = inputs, srun = srun, in_job = in_job, **usage)
+		self.ledger.append(record)
+
+	def _start_step(self, staged: journal.StagedOutput):
+		if self.journal:
+			self.journal.start(staged)
+
+	def _finish_step(self, step: Optional[manifest.Step], staged: Optional[journal.StagedOutput], exit_code: Optional[int]):
+		if exit_code == 0:
+			if step:
+				step.record()
+			if staged and self.journal:
+				self.journal.finish(staged)
+		elif staged and self.journal:
+			self.journal.fail(staged, exit_code)
+
+	def _execute(self, command: List[str], output_folder: Optional[Path]) -> Tuple[subprocess.CompletedProcess, Any]:
+		"""
+			Runs the command and collects the resource usage of the finished process with `os.wait4`.
+			If an output folder is given, stdout and stderr are streamed to files. Otherwise they are captured.
+		"""
+		if output_folder:
+			# Some programs (ex. shovill with `--force`) delete the output folder when they start, so the logs are written
+			# next to the folder and only moved inside once the program finishes. If the job dies, the partial logs are left
+			# next to the output folder.
+			prefix = output_folder.parent / f"{output_folder.name}."
+			prefix.parent.mkdir(parents = True, exist_ok = True)
+			streams = [
+				OutputStream(Path(f"{prefix}stdout.txt"), self.log_compression, self.log_limit),
+				OutputStream(Path(f"{prefix}stderr.txt"), self.log_compression, self.log_limit)
+			]
+			sinks = [stream.direct_handle() or subprocess.PIPE for stream in streams]
+			readers = [stream.pump for stream in streams]
+		else:
+			streams = []
+			sinks = [subprocess.PIPE, subprocess.PIPE]
+			captured = [list(), list()]
+			readers = [partial(_read_into, chunks) for chunks in captured]
+
+		process = subprocess.Popen(command, stdout = sinks[0], stderr = sinks[1])
+		pumps = list()
+		for reader, pipe in zip(readers, [process.stdout, process.stderr]):
+			if pipe is not None:
+				pump = threading.Thread(target = reader, args = (pipe,), daemon = True)
+				pump.start()
+				pumps.append(pump)
+		for pump in pumps:
+			pump.join()
+		# `Popen.wait()` would discard the resource usage of the child, so reap it directly.
+		_, status, usage = os.wait4(process.pid, 0)
+		process.returncode = os.waitstatus_to_exitcode(status)
+
+		for stream in streams:
+			filename = stream.close()
+			if output_folder.exists():
+				filename.replace(output_folder / filename.name[len(prefix.name):])
+			else:
+				logger.error(f"Could not write the output files to {output_folder}")
+		if output_folder:
+			return subprocess.CompletedProcess(command, process.returncode), usage
+
+		stdout, stderr = [b"".join(chunks).decode("UTF-8") for chunks in captured]
+		return subprocess.CompletedProcess(command, process.returncode, stdout, stderr), usage
+
+	def submit(self, command: List[Any], output_folder: Optional[Path] = None, srun: bool = None, threads: int = 8,
+			logonly: bool = False, step: Optional[manifest.Step] = None) -> Future:
+		"""
+			Same as `run()`, but returns immediately with a `Future` for the `subprocess.CompletedProcess`.
+			The command is started once `threads` CPUs are available in the budget.
+		"""
+		return self.submit_task(self.run, command, output_folder, srun = srun, threads = threads, logonly = logonly, step = step)
+
+	def submit_task(self, function: Callable[..., Any], *args, **kwargs) -> Future:
+		"""
+			Runs `function(*args, **kwargs)` in the worker pool. Meant for program wrappers (ex. `Trimmomatic.run`),
+			which call `run()` internally and so are limited by the same budget.
+		Returns
+		-------
+		Future
+			Resolves to the value returned by `function`.
+		"""
+		return self.executor.submit(function, *args, **kwargs)
+
+	def map(self, function: Callable[..., Any], *iterables) -> List[Any]:
+		""" Calls `function` on each set of arguments concurrently and returns the results in the order they were given."""
+		futures = [self.submit_task(function, *args) for args in zip(*iterables)]
+		return [future.result() for future in futures]
+
+	@contextmanager
+	def batch(self, backend: slurm.SlurmBackend, name: str, dependency: Optional[slurm.SlurmJob] = None,
+			wait: bool = True) -> Iterator[slurm.StageBatch]:
+		"""
+			Collects every command passed to `run()` inside the `with` block and submits them as one slurm job array
+			when the block exits. `run()` returns None for these commands.
+		Parameters
+		----------
+		backend: slurm.SlurmBackend
+		name: str
+			The name of the stage (ex. 'trimmomatic').
+		dependency: Optional[slurm.SlurmJob]
+			The job of a previous stage that must finish before this one starts.
+		wait: bool; default True
+			Whether to block until the job array is finished. Use `False` to submit several dependent stages at once.
+		"""
+		stage = slurm.StageBatch(name)
+		self._batch = stage
+		try:
+			yield stage
+		finally:
+			self._batch = None
+		stage.job = backend.submit(stage.tasks, name, stage.threads, stage.mem_per_cpu, dependency = dependency)
+		if wait:
+			stage.exit_codes = backend.wait(stage.job)
+
+	@property
+	def batching(self) -> bool:
+		""" Whether `batch()` is active, so commands are collected for a slurm job array instead of being run."""
+		return self._batch is not None
+
+	@property
+	def executor(self) -> ThreadPoolExecutor:
+		# Each running command reserves at least one CPU, so more workers than CPUs would only sit waiting on the budget.
+		with self._lock:
+			if self._executor is None:
+				self._executor = ThreadPoolExecutor(max_workers = self.budget.total, thread_name_prefix = "command")
+		return self._executor
+
+	def set_cpus(self, cpus: int, memory: Optional[int] = None):
+		"""
+			Changes the number of CPUs and MB of memory that local commands may use at once.
+			Should be called before any commands are submitted.
+		"""
+		self.budget = ResourceBudget(cpus, memory)
+
 	@staticmethod
-	def write_command(folder: Path, command: List[str], process: subprocess.CompletedProcess):
-		stdout_path = folder / "stdout.txt"
-		stderr_path = folder / "stderr.txt"
+	def write_command(folder: Path, command: List[str]):
 		command_path = folder / "command.txt"
 		try:
 			command_path.write_text(" ".join(command))
-			stdout_path.write_text(process.stdout)
-			stderr_path.write_text(process.stderr)
 		except FileNotFoundError:
 			logger.error(f"Could not write the output files to {folder}")
 
 	def write_command_to_commandlog(self, command: List[str]):
 		if self.command_log:
 			line = " ".join(command)
-			with self.command_log.open('a') as file1:
+			with self._lock, self.command_log.open('a') as file1:
 				file1.write(line + "\n")
 
 	def write_comment_to_commandlog(self, comment: str):
 		if self.command_log:
-			with self.command_log.open('a') as file1:
+			with self._lock, self.command_log.open('a') as file1:
 				file1.write(f"# {comment}\n")
 
 	def write_line_to_commandlog(self, line: str):
 		if self.command_log:
-			with self.command_log.open('a') as file1:
+			with self._lock, self.command_log.open('a') as file1:
 				file1.write(f"{line}\n")
 
 	def set_command_log(self, path: Union[str, Path]):
+		"""
+			Sets the command log. The resource ledger and step journal for the project are saved next to it as
+			`ledger.jsonl` and `journal.jsonl`.
+		"""
 		self.command_log = Path(path)
+		self.set_ledger(self.command_log.parent / "ledger.jsonl")
+		self.journal = journal.RunJournal(self.command_log.parent / "journal.jsonl")
+
+	def set_ledger(self, path: Optional[Union[str, Path]]):
+		""" Sets the ledger used to record resource usage. The resource model is trained on the same ledger."""
+		self.ledger = ledger.RunLedger(path) if path else None
+		self.resource_model = resourcemodel.ResourceModel(self.ledger)
+
+
+def _read_into(chunks: List[bytes], pipe: IO[bytes]):
+	chunks.extend(iter(pipe.read1, b""))
+	pipe.close()
 
 
 command_runner = CommandRunner()  # Should use this object to make system calls.
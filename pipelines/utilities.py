@@ -1,8 +1,15 @@
+import fnmatch
+import os
+import threading
+import time
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy
 from loguru import logger
 
+from pipelines import fastqio
+
 
 def checkdir(path: Union[str, Path]) -> Path:
 	path = Path(path)
@@ -15,9 +22,95 @@ def checkdir(path: Union[str, Path]) -> Path:
 	return path
 
 
+def get_cache_folder(project_folder: Optional[Path] = None) -> Path:
+	"""
+		Where to save results computed from the reads, such as read indexes, validation verdicts, and sketches. These
+		can't be saved next to the reads, since the raw reads folders may be read-only and any new file changes the
+		folder's modification time, which invalidates the `FolderSnapshot` and the catalog entries for the folder.
+	Parameters
+	----------
+	project_folder: Optional[Path]
+		Results are saved in `project_folder/.cache` if given. Otherwise, falls back to `~/.cache/pipelines`.
+	"""
+	if project_folder is not None:
+		return Path(project_folder) / ".cache"
+	return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / ".cache")) / "pipelines"
+
+
+class FolderSnapshot:
+	"""
+		A single listing of a folder. Use `FolderSnapshot.of()` rather than creating these directly, so that each folder
+		is only listed once. The cached listing is reused until the folder's modification time changes, which happens
+		whenever a file is added, removed, or renamed. Listings of folders modified less than `MTIME_RESOLUTION` ago
+		are not cached, since a file added within the same timestamp tick wouldn't change the modification time.
+	"""
+
+	def __init__(self, folder: Path, entries: List[os.DirEntry], mtime: int):
+		self.folder = folder
+		self.mtime = mtime
+		entries = sorted(entries, key = lambda i: i.name)
+		self.paths: List[Path] = [folder / i.name for i in entries]
+		self.names: List[str] = [i.name for i in entries]
+		self.files: List[Path] = [folder / i.name for i in entries if i.is_file()]
+		self.folders: List[Path] = [folder / i.name for i in entries if i.is_dir()]
+		self._names = set(self.names)
+
+	@classmethod
+	def of(cls, folder: Union[str, Path]) -> 'FolderSnapshot':
+		"""
+			Returns the listing of `folder`, reusing the cached listing if the folder hasn't changed.
+		Raises
+		------
+		FileNotFoundError: The folder does not exist.
+		NotADirectoryError: `folder` is a file.
+		"""
+		folder = Path(folder)
+		mtime = os.stat(folder).st_mtime_ns
+		key = str(folder)
+		with _snapshot_lock:
+			snapshot = _snapshots.get(key)
+		if snapshot is not None and snapshot.mtime == mtime:
+			return snapshot
+		# Read the clock before listing, so a file added while the folder is being listed is also covered.
+		now = time.time_ns()
+		with os.scandir(folder) as iterator:
+			snapshot = cls(folder, list(iterator), mtime)
+		with _snapshot_lock:
+			if abs(now - mtime) >= MTIME_RESOLUTION:
+				_snapshots[key] = snapshot
+			else:
+				_snapshots.pop(key, None)
+		return snapshot
+
+	def __contains__(self, name: str) -> bool:
+		return name in self._names
+
+	def __iter__(self):
+		return iter(self.paths)
+
+	def with_suffix(self, suffix: str, files_only: bool = True) -> List[Path]:
+		candidates = self.files if files_only else self.paths
+		return [i for i in candidates if i.suffix == suffix]
+
+	def match(self, pattern: str) -> List[Path]:
+		""" Returns the paths whose name matches the glob-style `pattern`."""
+		return [path for path, name in zip(self.paths, self.names) if fnmatch.fnmatchcase(name, pattern)]
+
+
+# Some filesystems (ex. ext3, NFS) only store modification times to the second.
+MTIME_RESOLUTION = 10 ** 9
+_snapshots: Dict[str, FolderSnapshot] = dict()
+_snapshot_lock = threading.Lock()
+
+
+def clear_snapshot_cache():
+	with _snapshot_lock:
+		_snapshots.clear()
+
+
 def is_forward_read(filename: Union[str, Path]) -> bool:
 	if isinstance(filename, Path):
-		stem = filename.stem
+		stem = fastqio.get_read_stem(filename)
 	else:
 		stem = filename
 	if 'R1' in stem or ('forward' in stem and 'unpaired' not in stem):
@@ -29,12 +122,12 @@ def is_forward_read(filename: Union[str, Path]) -> bool:
 
 def is_reverse_read(filename: Union[str, Path]) -> bool:
 	if isinstance(filename, Path):
-		stem = filename.stem
+		stem = fastqio.get_read_stem(filename)
 	else:
 		stem = filename
 	if 'R2' in stem or ('reverse' in stem and 'unpaired' not in stem):
 		return True
-	if '2P' in filename.stem:
+	if '2P' in stem:
 		return True
 	return False
 
@@ -43,7 +136,7 @@ def get_name_from_reads(path: Union[str, Path]) -> Optional[str]:
 	""" Gets the name of a sample from the filename of one of the fastq files."""
 	if isinstance(path, str):
 		path = Path(path)
-	name = path.stem
+	name = fastqio.get_read_stem(path)
 	# If the path refers to a read file, only the first part is useful.
 	if 'R1' in name or 'R2' in name:
 		name = name.split('_')[:-3]
@@ -69,11 +162,10 @@ def get_reads_from_folder(folder: Path) -> Tuple[Path, Path]:
 	------
 	FileNotFoundError: Cannot locate either the forward or reverse files.
 	"""
-	candidates = list(i for i in folder.iterdir() if (i.suffix == '.fastq' or i.suffix == ''))
-	if not candidates:
-		logger.warning(
-			f"The files might be gzipped. While *most* programs can still use the compressed files, not all can, so uncompress just in case.")
-		logger.warning(f"This will have to be done manually for now.")
+	snapshot = FolderSnapshot.of(folder)
+	# Compressed reads are used as-is. Each program wrapper decompresses the formats its program can't read with
+	# `fastqio.decompress_command()`.
+	candidates = [i for i in snapshot.paths if fastqio.is_read_file(i)]
 
 	try:
 		forward = [i for i in candidates if is_forward_read(i)][0]
@@ -82,12 +174,21 @@ def get_reads_from_folder(folder: Path) -> Tuple[Path, Path]:
 		message = f"Could not locate the reads in folder (exists = {folder.exists()}): '{folder}'"
 		if folder.exists():
 			logger.debug(f"Folder contents:")
-			for i in folder.iterdir():
+			for i in FolderSnapshot.of(folder):
 				logger.debug(f"\t{i}")
 		raise FileNotFoundError(message)
 	return forward, reverse
 
 
+def splitmix64(values: numpy.ndarray, seed: int = 0) -> numpy.ndarray:
+	""" Hashes each value to a well-mixed 64-bit integer. The same values and seed always give the same hashes."""
+	mask = 2 ** 64 - 1
+	state = numpy.asarray(values, dtype = numpy.uint64) + numpy.uint64((seed * 0x9E3779B97F4A7C15) & mask)
+	state = (state ^ (state >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+	state = (state ^ (state >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+	return state ^ (state >> numpy.uint64(31))
+
+
 def verify_file_exists(filename: Path) -> bool:
 	if not filename.exists():
 		logger.critical(f"The file does not exist: {filename}")
@@ -125,9 +226,12 @@ def get_folder_type(folder: Path, silent: bool = False) -> Optional[str]:
 		- `genbank`: A folder with assembly files from genbank.
 	"""
 
+	# List the folder once and run every test against the same listing.
+	snapshot = FolderSnapshot.of(folder)
+
 	# Test if it is a folder with only the raw reads from the sequencer.
 	try:
-		[i for i in folder.iterdir() if 'R1' in i.name][0]
+		[i for i in snapshot.names if 'R1' in i][0]
 		return 'reads'
 	except IndexError:
 		# The sequencer generally uses 'R1' and 'R2' to distinguish between forward and reverse reads.
@@ -138,12 +242,13 @@ def get_folder_type(folder: Path, silent: bool = False) -> Optional[str]:
 
 	# The filenames can be automatically generated or manually generated. Make sure this can handle both cases.
 	# Test if the filenames were automatically generated.
-	default_result = sum(i.match("*[12][PU][.]*") for i in folder.iterdir()) == 4
+	# Only count the reads themselves, not any index files next to them.
+	default_result = len([i for i in snapshot.match("*[12][PU][.]*") if fastqio.is_read_file(i)]) == 4
 
 	# Test if the filenames were manually generated, but still from Trimmomatic
 	# For now, just test if the files were generated from the trimmomatic setup used in the workflows.
 	try:
-		[i for i in folder.iterdir() if 'forward.trimmed.paired' in i.name][0]
+		[i for i in snapshot.names if 'forward.trimmed.paired' in i][0]
 		manual_result = True
 	except IndexError:
 		manual_result = False
@@ -154,33 +259,30 @@ def get_folder_type(folder: Path, silent: bool = False) -> Optional[str]:
 	# Test if the folder contains the output from shovill
 	# Need to test before 'spades' since both contain a `contigs.fa` file.
 	# TODO: make sure this can identify incomplete shovill folders as well.
-	expected_shovill = folder / "contigs.fa"
-	expected_shovill_spades = folder / "spades.fasta"
-	if expected_shovill.exists() and expected_shovill_spades.exists():
+	if "contigs.fa" in snapshot and "spades.fasta" in snapshot:
 		return 'shovill'
 
 	# Test if the folder contains the output from spades.
-	expected_spades = folder / "contigs.fa"
-	if expected_spades.exists():
+	if "contigs.fa" in snapshot:
 		return 'spades'
 
 	# Test if it is a breseq folder
 	expected_index = folder / "output" / "index.html"
-	if expected_index.exists():
+	if "output" in snapshot and expected_index.exists():
 		return 'breseq'
 
 	# Test if the folder contains the output from prokka.
 	# Use the suffixes since the prefixes are user-defined and can be almost anything.
 	# The prefixes should all be the same value, so could add that as an additional check later.
-	suffixes = [i.suffix for i in folder.iterdir() if i.is_file()]
+	suffixes = [i.suffix for i in snapshot.files]
 	# Don't need to test for all the files, just the most important ones.
 	expected_suffixes = ['.fna', '.ffn', '.gff', '.gbk']
 	if all(i in suffixes for i in expected_suffixes):
 		return 'prokka'
 
-	if any(i.name.startswith('GCA_') for i in folder.iterdir()):
+	if any(i.startswith('GCA_') for i in snapshot.names):
 		return 'genbank'
-	if any(i.name.startswith('GCF_') for i in folder.iterdir()):
+	if any(i.startswith('GCF_') for i in snapshot.names):
 		return 'refseq'
 
 	if not silent:
@@ -193,7 +295,7 @@ def get_file_by_type(folder: Path, suffix: str) -> Optional[Path]:
 	""" Extracts a file by the suffix. If no files with the suffix are found or more than one file is found returns `None`"""
 	if not suffix.startswith('.'):
 		suffix = '.' + suffix
-	candidates = [i for i in folder.iterdir() if i.suffix == suffix]
+	candidates = FolderSnapshot.of(folder).with_suffix(suffix, files_only = False)
 	if len(candidates) == 1:
 		filename = candidates[0]
 	else:
@@ -0,0 +1,190 @@
+"""
+	Checks that the forward and reverse reads of each sample are intact and still paired before any expensive step uses
+	them. Both files are streamed together, so a truncated or out-of-order pair is caught within seconds rather than
+	after hours of variant calling. The verdict for each sample is saved and reused until either read file changes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy
+from loguru import logger
+
+from pipelines import fastqio, manifest, sampleio, utilities
+
+VERSION = "1"
+
+# Stop reporting problems after this many, since a desynchronized pair would report every remaining read.
+MAX_ERRORS = 10
+
+WHITESPACE = numpy.zeros(256, dtype = bool)
+WHITESPACE[[ord(" "), ord("\t"), ord("\r")]] = True
+
+
+@dataclass
+class PairVerdict:
+	name: str
+	forward: str
+	reverse: str
+	valid: bool = True
+	forward_reads: int = 0
+	reverse_reads: int = 0
+	errors: List[str] = field(default_factory = list)
+
+	def add_error(self, message: str):
+		self.valid = False
+		if len(self.errors) < MAX_ERRORS:
+			self.errors.append(message)
+
+
+def get_verdict_filename(folder: Path, sample_name: str) -> Path:
+	return folder / f"{sample_name}.validation.json"
+
+
+def _hash_read_ids(buffer: numpy.ndarray, newlines: numpy.ndarray) -> numpy.ndarray:
+	"""
+		Hashes the read id of each record. The id is the header up to the first whitespace, without the `/1` or `/2`
+		suffix used by older Illumina pipelines, so it is the same for both reads of a pair.
+	"""
+	count = len(newlines)
+	starts = numpy.concatenate([[0], newlines[:-1, 3] + 1]) + 1  # Skip the '@'
+	line_ends = newlines[:, 0]
+	lengths = numpy.maximum(line_ends - starts, 0)
+	if not lengths.sum():
+		return numpy.zeros(count, dtype = numpy.uint64)
+
+	read_index = numpy.repeat(numpy.arange(count), lengths)
+	position = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+	characters = buffer[numpy.repeat(starts, lengths) + position]
+
+	# The id ends at the first whitespace.
+	id_lengths = lengths.copy()
+	spaces = WHITESPACE[characters]
+	first_space = numpy.full(count, numpy.iinfo(numpy.int64).max)
+	numpy.minimum.at(first_space, read_index[spaces], position[spaces])
+	id_lengths = numpy.minimum(id_lengths, first_space)
+	# Remove the mate suffix.
+	has_suffix = (id_lengths >= 2) & (buffer[numpy.minimum(starts + id_lengths - 2, len(buffer) - 1)] == ord("/"))
+	id_lengths[has_suffix] -= 2
+
+	in_id = position < id_lengths[read_index]
+	values = utilities.splitmix64(characters[in_id].astype(numpy.uint64) | (position[in_id].astype(numpy.uint64) << numpy.uint64(8)))
+	hashes = numpy.zeros(count, dtype = numpy.uint64)
+	numpy.add.at(hashes, read_index[in_id], values)
+	return hashes
+
+
+def _check_records(buffer: numpy.ndarray, newlines: numpy.ndarray, first_record: int, label: str, verdict: PairVerdict):
+	""" Checks that each record has a header, a separator, and a quality score for every base."""
+	starts = numpy.concatenate([[0], newlines[:-1, 3] + 1])
+	problems = [
+		(buffer[starts] != ord("@"), "does not start with '@'"),
+		(buffer[newlines[:, 1] + 1] != ord("+"), "is missing the '+' separator"),
+		(newlines[:, 1] - newlines[:, 0] != newlines[:, 3] - newlines[:, 2], "has a different number of bases and quality scores")
+	]
+	for mask, description in problems:
+		for index in numpy.flatnonzero(mask)[:MAX_ERRORS]:
+			verdict.add_error(f"{label} record {first_record + index + 1} {description}")
+
+
+def _iter_records(path: Path, label: str, verdict: PairVerdict, chunk_size: int) -> Iterator[numpy.ndarray]:
+	""" Yields the read id hashes of each chunk of a read file, checking each record along the way."""
+	record = 0
+	for buffer, newlines, _ in fastqio.iter_record_chunks(path, chunk_size, strict = True):
+		_check_records(buffer, newlines, record, label, verdict)
+		record += len(newlines)
+		yield _hash_read_ids(buffer, newlines)
+
+
+def validate_pair(name: str, forward: Path, reverse: Path, chunk_size: int = 2 ** 22) -> PairVerdict:
+	""" Streams both read files together and checks the record format, the number of reads, and the read pairing."""
+	verdict = PairVerdict(name, str(forward), str(reverse))
+	streams = {
+		'forward': _iter_records(forward, "forward", verdict, chunk_size),
+		'reverse': _iter_records(reverse, "reverse", verdict, chunk_size)
+	}
+	pending = {'forward': numpy.zeros(0, dtype = numpy.uint64), 'reverse': numpy.zeros(0, dtype = numpy.uint64)}
+	finished = {'forward': False, 'reverse': False}
+	counts = {'forward': 0, 'reverse': 0}
+	compared = 0
+	try:
+		while not all(finished.values()):
+			# Read from whichever file is behind, so both are streamed at the same pace.
+			label = min((i for i in streams if not finished[i]), key = lambda i: len(pending[i]))
+			other = 'reverse' if label == 'forward' else 'forward'
+			hashes = next(streams[label], None)
+			if hashes is None:
+				finished[label] = True
+				continue
+			counts[label] += len(hashes)
+			if finished[other] and len(pending[other]) == 0:
+				# The other file ran out of reads. Only count the rest, since there is nothing left to pair them with.
+				continue
+			pending[label] = numpy.concatenate([pending[label], hashes])
+
+			count = min(len(pending['forward']), len(pending['reverse']))
+			mismatched = numpy.flatnonzero(pending['forward'][:count] != pending['reverse'][:count])
+			if len(mismatched):
+				verdict.add_error(f"The reads are not paired starting at record {compared + mismatched[0] + 1}")
+				break
+			compared += count
+			pending = {key: value[count:] for key, value in pending.items()}
+	except (OSError, EOFError, ValueError) as exception:
+		# Corrupt or truncated compressed files, or a read file which ends partway through a record.
+		verdict.add_error(str(exception))
+	finally:
+		for stream in streams.values():
+			stream.close()
+
+	verdict.forward_reads, verdict.reverse_reads = counts['forward'], counts['reverse']
+	if verdict.valid and verdict.forward_reads != verdict.reverse_reads:
+		verdict.add_error(f"The forward file has {verdict.forward_reads} reads but the reverse file has {verdict.reverse_reads}")
+	return verdict
+
+
+def load_verdict(filename: Path, forward: Path, reverse: Path) -> Optional[PairVerdict]:
+	"""
+		Loads the saved verdict for a pair of read files. Returns None if it doesn't exist, was saved for other read
+		files (samples in different projects can share a name), or either read file changed since.
+	"""
+	contents = manifest.load_sidecar(filename, VERSION, [forward, reverse])
+	return PairVerdict(**contents) if contents is not None else None
+
+
+def validate_samples(samples: List[sampleio.SampleReads], cache_folder: Optional[Path] = None,
+		processes: Optional[int] = None) -> Dict[str, PairVerdict]:
+	"""
+		Validates the reads of every sample in a process pool and saves a verdict for each.
+	Parameters
+	----------
+	samples: List[sampleio.SampleReads]
+	cache_folder: Optional[Path]
+		Where to save the verdicts. Defaults to the `validation` folder in `utilities.get_cache_folder()`. The verdicts
+		are never saved next to the reads.
+	processes: Optional[int]
+		The number of worker processes. Defaults to the number of cpus.
+	"""
+	cache_folder = cache_folder or utilities.get_cache_folder() / "validation"
+	verdicts = dict()
+	futures = dict()
+	with ProcessPoolExecutor(max_workers = processes) as executor:
+		for sample in samples:
+			filename = get_verdict_filename(cache_folder, sample.name)
+			verdict = load_verdict(filename, sample.forward, sample.reverse)
+			if verdict is not None:
+				verdicts[sample.name] = verdict
+			else:
+				futures[sample.name] = (filename, sample, executor.submit(validate_pair, sample.name, sample.forward, sample.reverse))
+
+		for name, (filename, sample, future) in futures.items():
+			verdict = future.result()
+			verdicts[name] = verdict
+			manifest.save_sidecar(filename, VERSION, [sample.forward, sample.reverse], asdict(verdict))
+
+	for verdict in verdicts.values():
+		if not verdict.valid:
+			logger.error(f"The reads for sample {verdict.name} failed validation:")
+			for error in verdict.errors:
+				logger.error(f"\t{error}")
+	return verdicts
@@ -1,12 +1,21 @@
 from pathlib import Path
+from typing import Dict, Optional
 
 import pytest
 
-from pipelines import sampleio, systemio
+from pipelines import sampleio, slurm, systemio
 
 DATA_FOLDER = Path(__file__).parent / "data"
 
 
+@pytest.fixture(autouse = True)
+def cache_folder(tmp_path, monkeypatch) -> Path:
+	""" Keeps the results cached by each test out of the user's cache folder."""
+	folder = tmp_path / "cache"
+	monkeypatch.setenv("XDG_CACHE_HOME", str(folder))
+	return folder / "pipelines"
+
+
 @pytest.fixture
 def sample_reads(tmp_path) -> sampleio.SampleReads:
 	name = "AU1234"
@@ -28,11 +37,60 @@ def trimmed_reads() -> Path:
 	pass
 
 
+def write_fasta(filename: Path, sequences: Dict[str, str], width: int = 60, newline: str = "\n", description: str = "") -> Path:
+	""" Writes each sequence wrapped to `width` characters. `description` is added after each name."""
+	with filename.open('w', newline = '') as file1:
+		for name, sequence in sequences.items():
+			file1.write(f">{name} {description}".rstrip() + newline)
+			for index in range(0, len(sequence), width):
+				file1.write(sequence[index:index + width] + newline)
+	return filename
+
+
+def write_gd(filename: Path, *records: str, reads: Optional[str] = None) -> Path:
+	""" Writes a GenomeDiff file with the given records. `reads` is listed in the header, as breseq does."""
+	header = ["#=GENOME_DIFF\t1.0"] + ([f"#=READSEQ\t{reads}"] if reads else [])
+	filename.parent.mkdir(parents = True, exist_ok = True)
+	filename.write_text("\n".join(header + list(records)) + "\n")
+	return filename
+
+
 @pytest.fixture
 def assembly() -> Path:
 	return DATA_FOLDER / "assembly.fna"
 
 
+# Stand-in for `sbatch` that runs each task of the array immediately.
+SBATCH_SHIM = """#!/bin/bash
+script="${@: -1}"
+echo "$@" >> "$(dirname "$0")/sbatch_calls.txt"
+count=$(sed -n 's/^#SBATCH --array=1-//p' "$script")
+stdout=$(sed -n 's/^#SBATCH --output=//p' "$script")
+stderr=$(sed -n 's/^#SBATCH --error=//p' "$script")
+for index in $(seq 1 "$count"); do
+	SLURM_ARRAY_TASK_ID=$index bash "$script" > "${stdout//%a/$index}" 2> "${stderr//%a/$index}"
+done
+echo "1234;cluster"
+"""
+# Stand-in for `squeue` where every job has already finished.
+SQUEUE_SHIM = """#!/bin/bash
+exit 0
+"""
+
+
+@pytest.fixture
+def backend(tmp_path) -> slurm.SlurmBackend:
+	shim_folder = tmp_path / "shims"
+	shim_folder.mkdir()
+	sbatch = shim_folder / "sbatch"
+	squeue = shim_folder / "squeue"
+	sbatch.write_text(SBATCH_SHIM)
+	squeue.write_text(SQUEUE_SHIM)
+	sbatch.chmod(0o755)
+	squeue.chmod(0o755)
+	return slurm.SlurmBackend(tmp_path / "slurm", sbatch = str(sbatch), squeue = str(squeue), poll_interval = 0)
+
+
 @pytest.fixture
 def command_runner() -> systemio.CommandRunner:
 	return systemio.CommandRunner(srun = False)
@@ -0,0 +1,98 @@
+import time
+from pathlib import Path
+
+import numpy
+import pytest
+
+from pipelines import annotations, programio
+
+DATA_FOLDER = Path(__file__).parent / "data"
+NCBI_GFF = DATA_FOLDER / "inputs" / "AU1054 GENBANK" / "GCA_000014085.1_ASM1408v1_genomic.gff"
+
+PROKKA_GFF = """##gff-version 3
+##sequence-region contig1 1 5000
+##sequence-region contig2 1 1000
+contig1	Prodigal:2.6	CDS	100	400	.	+	0	ID=ABCD_00001;gene=dnaA;locus_tag=ABCD_00001;product=Chromosomal replication initiator protein DnaA
+contig1	Prodigal:2.6	CDS	350	1200	.	-	0	ID=ABCD_00002;locus_tag=ABCD_00002;product=hypothetical protein
+contig1	Aragorn:1.2	tRNA	3000	3075	.	+	.	ID=ABCD_00003;locus_tag=ABCD_00003;product=tRNA-Ala(tgc)
+contig1	Prodigal:2.6	CDS	2000	4500	.	+	0	ID=ABCD_00004;locus_tag=ABCD_00004;product=Large protein%2C putative
+contig2	Prodigal:2.6	CDS	10	900	.	+	0	ID=ABCD_00005;locus_tag=ABCD_00005;product=Other protein
+##FASTA
+>contig1
+ACGT
+"""
+
+
+@pytest.fixture
+def gff(tmp_path) -> Path:
+	filename = tmp_path / "ABCD.gff"
+	filename.write_text(PROKKA_GFF)
+	return filename
+
+
+def test_parse_gff(gff):
+	table = annotations.parse_gff(gff)
+	assert len(table) == 5
+	assert table.locus_tags.tolist() == ["ABCD_00001", "ABCD_00002", "ABCD_00004", "ABCD_00003", "ABCD_00005"]
+	feature = table.feature(0)
+	assert feature == annotations.Feature(
+		"contig1", 100, 400, 1, "CDS", "ABCD_00001", "dnaA", "Chromosomal replication initiator protein DnaA"
+	)
+	assert table.by_locus_tag("ABCD_00004").product == "Large protein, putative"
+	assert table.by_locus_tag("ABCD_00002").strand == -1
+	assert table.by_locus_tag("missing") is None
+
+
+def test_query(gff):
+	table = annotations.parse_gff(gff)
+	positions = [50, 100, 375, 1500, 3050, 4600, 500, 20]
+	seq_ids = ["contig1"] * 6 + ["contig2", "contig3"]
+	query_index, feature_index = table.query(seq_ids, positions)
+	hits = sorted((int(i), str(table.locus_tags[j])) for i, j in zip(query_index, feature_index))
+	assert hits == [
+		(1, "ABCD_00001"), (2, "ABCD_00001"), (2, "ABCD_00002"), (4, "ABCD_00003"), (4, "ABCD_00004"), (6, "ABCD_00005")
+	]
+	assert table.locus_tags[table.annotate(seq_ids, positions, "CDS")].tolist()[4] == "ABCD_00004"
+	assert table.annotate(seq_ids, positions).tolist()[:4] == [-1, 0, 0, -1]
+
+
+def test_overlapping(gff):
+	table = annotations.parse_gff(gff)
+	assert [i.locus_tag for i in table.overlapping("contig1", 1100, 2100)] == ["ABCD_00002", "ABCD_00004"]
+	assert [i.locus_tag for i in table.overlapping("contig1", 1, 5000, "tRNA")] == ["ABCD_00003"]
+	assert table.overlapping("contig3", 1, 100) == []
+
+
+def test_load_features_is_cached(gff):
+	table = annotations.load_features(gff)
+	cache = annotations.get_cache_filename(gff)
+	assert cache.exists()
+	modified = cache.stat().st_mtime_ns
+	assert annotations.load_features(gff).locus_tags.tolist() == table.locus_tags.tolist()
+	assert cache.stat().st_mtime_ns == modified
+
+	gff.write_text(PROKKA_GFF.replace("contig2\tProdigal:2.6\tCDS\t10\t900", "contig2\tProdigal:2.6\tCDS\t10\t800"))
+	assert annotations.load_features(gff).by_locus_tag("ABCD_00005").end == 800
+
+
+def test_prokka_output_features(gff):
+	output = programio.ProkkaOutput.expected(gff.parent, "ABCD")
+	assert len(output.features()) == 5
+
+
+def test_annotate_many_positions(tmp_path):
+	gff = tmp_path / "reference.gff"
+	gff.write_bytes(NCBI_GFF.read_bytes())
+	table = annotations.load_features(gff)
+	assert table.by_locus_tag("Bcen_0001").start == 278
+
+	positions = numpy.random.default_rng(1).integers(1, 3294563, 10000)
+	start = time.perf_counter()
+	result = table.annotate("CP000378.1", positions, "CDS")
+	assert time.perf_counter() - start < 1
+
+	# Compare against a simple search.
+	is_cds = table.types == "CDS"
+	for position, index in zip(positions[:200], result[:200]):
+		matches = numpy.flatnonzero(is_cds & (table.seq_ids == "CP000378.1") & (table.starts <= position) & (table.ends >= position))
+		assert index == (matches[0] if len(matches) else -1)
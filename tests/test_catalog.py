@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+
+from pipelines import catalog, sampleio, utilities
+
+
+@pytest.fixture
+def project_folder(tmp_path) -> Path:
+	folder = utilities.checkdir(tmp_path / "project")
+	for name in ["AB1234", "CD5678"]:
+		sample_folder = utilities.checkdir(folder / name)
+		(sample_folder / f"{name}_R1_001.fastq").touch()
+		(sample_folder / f"{name}_R2_001.fastq").touch()
+	utilities.checkdir(folder / "other_folder")
+	return folder
+
+
+@pytest.fixture
+def project_catalog(tmp_path) -> catalog.ProjectCatalog:
+	return catalog.ProjectCatalog(tmp_path / "catalog.sqlite")
+
+
+def test_catalog_finds_samples(project_folder, project_catalog):
+	project_catalog.update(project_folder)
+	samples = project_catalog.samples(parent = project_folder)
+
+	assert [i.name for i in samples] == ["AB1234", "CD5678"]
+	assert samples[0].forward == project_folder / "AB1234" / "AB1234_R1_001.fastq"
+
+
+def test_catalog_is_incremental(project_folder, project_catalog):
+	assert project_catalog.update(project_folder) == 4
+	assert project_catalog.update(project_folder) == 0
+
+	# Adding a breseq folder should only require listing the sample folder and the new folder.
+	breseq_folder = utilities.checkdir(project_folder / "AB1234" / "breseq")
+	utilities.checkdir(breseq_folder / "output")
+	(breseq_folder / "output" / "index.html").touch()
+	assert project_catalog.update(project_folder) == 2
+	assert project_catalog.outputs(output_type = 'breseq') == [("AB1234", "breseq", breseq_folder)]
+	assert project_catalog.status() == {"AB1234": {"breseq"}}
+
+
+def test_catalog_forgets_removed_folders(project_folder, project_catalog):
+	import shutil
+	project_catalog.update(project_folder)
+	shutil.rmtree(project_folder / "CD5678")
+	project_catalog.update(project_folder)
+	assert [i.name for i in project_catalog.samples()] == ["AB1234"]
+
+
+def test_get_samples_from_folder_with_catalog(project_folder, project_catalog):
+	result = sampleio.get_samples_from_folder(project_folder, catalog = project_catalog)
+	assert [i.name for i in result] == ["AB1234", "CD5678"]
+	# The catalog is persistent.
+	reopened = catalog.ProjectCatalog(project_catalog.filename)
+	assert len(reopened.samples()) == 2
+
+
+def test_get_reads_from_folders_with_catalog(project_folder, project_catalog):
+	from pipelines import programio
+	from pipelines.processes import generic
+	trimmed = programio.TrimmomaticOutput.expected(utilities.checkdir(project_folder / "EF9012"), "EF9012")
+	for filename in trimmed.reads():
+		filename.touch()
+
+	expected = generic.get_reads_from_folders(project_folder)
+	result = generic.get_reads_from_folders(project_folder, catalog = project_catalog)
+	assert [type(i) for i in result] == [sampleio.SampleReads, sampleio.SampleReads, programio.TrimmomaticOutput]
+	assert result == expected
@@ -0,0 +1,79 @@
+import gzip
+
+import numpy
+import pytest
+
+from pipelines import fastqio
+from pipelines.processes import downsampling
+
+
+def write_pair(folder, count: int, length: int = 50):
+	forward = folder / "AU1234_S0_R1_001.fastq.gz"
+	reverse = folder / "AU1234_S0_R2_001.fastq.gz"
+	for filename, direction in [(forward, 1), (reverse, 2)]:
+		contents = "".join(f"@read{i}/{direction}\n{'A' * length}\n+\n{'I' * length}\n" for i in range(count))
+		filename.write_bytes(gzip.compress(contents.encode()))
+	return forward, reverse
+
+
+def read_names(filename):
+	with fastqio.open_reads(filename, text = True) as file1:
+		return [line.strip()[1:].split('/')[0] for index, line in enumerate(file1) if index % 4 == 0]
+
+
+def test_get_genome_size_fasta(tmp_path):
+	filename = tmp_path / "reference.fasta"
+	filename.write_text(">contig1\nACGTACGT\nACG\n>contig2\nAAAA\n")
+	assert downsampling.get_genome_size(filename) == 15
+
+
+def test_get_genome_size_genbank(tmp_path):
+	filename = tmp_path / "reference.gbk"
+	filename.write_text(
+		"LOCUS       contig1                 1200 bp    DNA     linear   BCT 01-JAN-2020\n"
+		"ORIGIN\n        1 acgtacgtac\n//\n"
+		"LOCUS       contig2                  300 bp    DNA     linear   BCT 01-JAN-2020\n//\n"
+	)
+	assert downsampling.get_genome_size(filename) == 1500
+
+
+def test_get_selection_is_seeded():
+	records = numpy.arange(100000)
+	selected = downsampling.get_selection(records, 0.25, seed = 3)
+	assert numpy.array_equal(selected, downsampling.get_selection(records, 0.25, seed = 3))
+	assert not numpy.array_equal(selected, downsampling.get_selection(records, 0.25, seed = 4))
+	assert selected.mean() == pytest.approx(0.25, abs = 0.01)
+
+
+def test_downsampler(tmp_path):
+	forward, reverse = write_pair(tmp_path, 400)
+	# 400 pairs * 100 bases over a 1000 base genome is 40x.
+	workflow = downsampling.Downsampler(depth = 10, genome_size = 1000, seed = 1)
+	output = workflow.run(forward, reverse, tmp_path / "downsampled", "AU1234")
+
+	forward_names = read_names(output.forward)
+	assert forward_names == read_names(output.reverse)
+	assert 50 < len(forward_names) < 150
+	assert output.name == "AU1234"
+
+	modified = output.forward.stat().st_mtime_ns
+	assert workflow.run(forward, reverse, tmp_path / "downsampled", "AU1234") == output
+	assert output.forward.stat().st_mtime_ns == modified
+
+
+def test_downsampler_below_target(tmp_path):
+	forward, reverse = write_pair(tmp_path, 10)
+	workflow = downsampling.Downsampler(depth = 100, genome_size = 1000)
+	output = workflow.run(forward, reverse, tmp_path / "downsampled", "AU1234")
+	assert output.forward == forward
+	assert not (tmp_path / "downsampled").exists()
+
+
+def test_downsampler_requires_genome_size():
+	with pytest.raises(ValueError):
+		downsampling.Downsampler(depth = 10)
+
+
+def test_downsampler_unsupported_compression():
+	with pytest.raises(ValueError):
+		downsampling.Downsampler(depth = 10, genome_size = 1000, compression = 'bzip2')
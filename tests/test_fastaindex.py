@@ -0,0 +1,108 @@
+import gzip
+import os
+import shutil
+import subprocess
+
+import numpy
+import pytest
+
+from pipelines import fastaindex, programio
+from tests.conftest import write_fasta
+
+SEQUENCES = {
+	"contig1": "".join(numpy.random.default_rng(1).choice(list("ACGT"), 1000)),
+	"contig2": "ACGTN" * 7,
+	"contig3": "GATTACA"
+}
+
+
+def test_build_index(tmp_path):
+	records = fastaindex.build_index(write_fasta(tmp_path / "contigs.fa", SEQUENCES, description = "description"))
+	assert [i.name for i in records] == ["contig1", "contig2", "contig3"]
+	assert [i.length for i in records] == [1000, 35, 7]
+	assert records[0] == fastaindex.FastaRecord("contig1", 1000, 21, 60, 61)
+
+
+@pytest.mark.skipif(shutil.which("samtools") is None, reason = "samtools is not installed")
+def test_index_matches_samtools(tmp_path):
+	filename = write_fasta(tmp_path / "contigs.fa", SEQUENCES, width = 70, description = "description")
+	subprocess.run(["samtools", "faidx", str(filename)], check = True)
+	expected = (tmp_path / "contigs.fa.fai").read_text()
+	assert "".join(i.to_line() for i in fastaindex.build_index(filename)) == expected
+
+
+def test_build_index_rejects_uneven_lines(tmp_path):
+	filename = tmp_path / "contigs.fa"
+	filename.write_text(">contig1\nACGT\nAC\nACGT\n")
+	with pytest.raises(ValueError):
+		fastaindex.build_index(filename)
+
+
+def test_get_index_is_saved(tmp_path):
+	filename = write_fasta(tmp_path / "contigs.fa", SEQUENCES, description = "description")
+	records = fastaindex.get_index(filename)
+	index = fastaindex.get_index_filename(filename)
+	assert index.read_text().splitlines()[1] == "contig2\t35\t1059\t35\t36"
+	assert fastaindex.get_index(filename) == records
+
+	# A fasta file newer than its index is indexed again.
+	write_fasta(filename, {"other": "ACGT"}, description = "description")
+	os.utime(index, ns = (0, 0))
+	assert [i.name for i in fastaindex.get_index(filename)] == ["other"]
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_fetch(tmp_path, newline):
+	with fastaindex.FastaFile(write_fasta(tmp_path / "contigs.fa", SEQUENCES, newline = newline, description = "description")) as fasta:
+		assert fasta.names == ["contig1", "contig2", "contig3"]
+		assert fasta.lengths["contig2"] == 35
+		assert fasta["contig1"] == SEQUENCES["contig1"]
+		for start, end in [(0, 1), (59, 61), (100, 500), (990, 2000), (5, 5)]:
+			assert fasta.fetch("contig1", start, end) == SEQUENCES["contig1"][start:end]
+		assert fasta.fetch("contig3", 2) == "TTACA"
+		with pytest.raises(KeyError):
+			fasta.fetch("missing")
+
+
+def test_fasta_file_rejects_compressed_files(tmp_path):
+	filename = tmp_path / "contigs.fa.gz"
+	filename.write_bytes(gzip.compress(b">contig1\nACGT\n"))
+	with pytest.raises(ValueError):
+		fastaindex.FastaFile(filename)
+
+
+def test_genbank_to_fasta(tmp_path):
+	sequence = SEQUENCES["contig1"].lower()
+	origin = "\n".join(
+		f"{i + 1:>9} " + " ".join(sequence[j:j + 10] for j in range(i, min(i + 60, len(sequence)), 10)) for i in range(0, len(sequence), 60)
+	)
+	genbank = tmp_path / "T4.gbff.gz"
+	contents = (
+		f"LOCUS       NC_000866             1000 bp    DNA     linear   PHG 30-MAR-2018\n"
+		f"VERSION     NC_000866.4\nFEATURES             Location/Qualifiers\nORIGIN\n{origin}\n//\n"
+		f"LOCUS       plasmid1                 4 bp    DNA     circular PHG 30-MAR-2018\nORIGIN\n        1 acgt\n//\n"
+	)
+	genbank.write_bytes(gzip.compress(contents.encode()))
+	assert fastaindex.is_genbank(genbank)
+
+	fasta = fastaindex.get_fasta(genbank)
+	assert fasta == tmp_path / "T4.gbff.gz.fasta"
+	with fastaindex.FastaFile(fasta) as reference:
+		assert reference.lengths == {"NC_000866.4": 1000, "plasmid1": 4}
+		assert reference["NC_000866.4"] == sequence
+		assert reference.fetch("plasmid1", 1, 3) == "cg"
+
+	# The converted file is reused.
+	modified = fasta.stat().st_mtime_ns
+	assert fastaindex.get_fasta(genbank) == fasta
+	assert fasta.stat().st_mtime_ns == modified
+
+	plain = write_fasta(tmp_path / "reference.fasta", SEQUENCES, description = "description")
+	assert not fastaindex.is_genbank(plain)
+	assert fastaindex.get_fasta(plain) == plain
+
+
+def test_shovill_output_sequences(tmp_path):
+	write_fasta(tmp_path / "contigs.fa", SEQUENCES, description = "description")
+	with programio.ShovillOutput.expected(tmp_path, "AU1234").sequences() as contigs:
+		assert contigs.fetch("contig2", 0, 5) == "ACGTN"
@@ -0,0 +1,131 @@
+import bz2
+import gzip
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from pipelines import fastqio, slurm, utilities
+
+READS = b"@read1\nACGT\n+\nIIII\n@read2\nGGCC\n+\nIIII\n"
+
+
+@pytest.mark.parametrize(
+	"filename, expected",
+	[
+		("AU1234_S0_R1_001.fastq", "AU1234_S0_R1_001"),
+		("AU1234_S0_R1_001.fastq.gz", "AU1234_S0_R1_001"),
+		("PA01.forward.trimmed.paired.fq.bz2", "PA01.forward.trimmed.paired"),
+		("sample_1.fastq.zst", "sample_1"),
+		("reads", "reads")
+	]
+)
+def test_get_read_stem(filename, expected):
+	assert fastqio.get_read_stem(filename) == expected
+
+
+@pytest.mark.parametrize(
+	"filename, expected",
+	[
+		("AU1234_S0_R1_001.fastq", True),
+		("AU1234_S0_R1_001.fastq.gz", True),
+		("sample.fq.zst", True),
+		("reads", True),
+		("contigs.fa.gz", False),
+		("report.html", False),
+		("archive.gz", False)
+	]
+)
+def test_is_read_file(filename, expected):
+	assert fastqio.is_read_file(filename) == expected
+
+
+@pytest.fixture
+def compressed_reads(tmp_path) -> Path:
+	filename = tmp_path / "sample_R1_001.fastq.gz"
+	filename.write_bytes(gzip.compress(READS))
+	return filename
+
+
+def test_open_reads_gzip(compressed_reads):
+	with fastqio.open_reads(compressed_reads) as file1:
+		assert file1.read() == READS
+
+
+def test_open_reads_text(compressed_reads):
+	with fastqio.open_reads(compressed_reads, text = True) as file1:
+		assert file1.readline() == "@read1\n"
+
+
+def test_open_reads_bzip2(tmp_path):
+	filename = tmp_path / "sample_R1_001.fastq.bz2"
+	filename.write_bytes(bz2.compress(READS))
+	with fastqio.open_reads(filename) as file1:
+		assert file1.read() == READS
+
+
+def test_open_reads_python_fallback(compressed_reads, monkeypatch):
+	monkeypatch.setattr(fastqio.shutil, 'which', lambda name: None)
+	with fastqio.open_reads(compressed_reads) as file1:
+		assert file1.read() == READS
+
+
+def test_open_reads_uncompressed(tmp_path):
+	filename = tmp_path / "sample_R1_001.fastq"
+	filename.write_bytes(READS)
+	with fastqio.open_reads(filename) as file1:
+		assert file1.read() == READS
+
+
+def test_decompress_command_streams_through_a_pipe(tmp_path, compressed_reads):
+	folder = tmp_path / ".reads"
+	command = fastqio.decompress_command(["cat", compressed_reads], [compressed_reads], [None], folder)
+	assert command[0] == "bash"
+	assert str(folder / "sample_R1_001.fastq") in command
+	result = subprocess.run(command, stdout = subprocess.PIPE, timeout = 30)
+	assert result.returncode == 0
+	assert result.stdout == READS
+	assert not folder.exists()
+
+
+def test_decompress_command_for_programs_reading_twice(tmp_path, compressed_reads):
+	folder = tmp_path / ".reads"
+	program = ["sh", "-c", 'test -f "$1" && cat "$1" "$1"', "sh", compressed_reads]
+	command = fastqio.decompress_command(program, [compressed_reads], [None], folder, single_pass = False)
+	result = subprocess.run(command, stdout = subprocess.PIPE, timeout = 30)
+	assert result.returncode == 0
+	assert result.stdout == READS + READS
+	assert not folder.exists()
+
+
+def test_decompress_command_program_fails(tmp_path, compressed_reads):
+	# Should not hang when the program fails before reading its input.
+	command = fastqio.decompress_command(["false", compressed_reads], [compressed_reads], [None], tmp_path / ".reads")
+	assert subprocess.run(command, timeout = 30).returncode != 0
+	assert not (tmp_path / ".reads").exists()
+
+
+def test_decompress_command_in_a_job_array(tmp_path, compressed_reads, backend):
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	folder = tmp_path / ".reads"
+	command = fastqio.decompress_command(["cat", compressed_reads], [compressed_reads], [None], folder)
+	job = backend.submit([slurm.ArrayTask(command, output_folder), slurm.ArrayTask(["true"])], "decompress")
+	assert backend.wait(job) == [0, 0]
+	assert (output_folder / "stdout.txt").read_bytes() == READS
+	assert not folder.exists()
+
+
+def test_decompress_command_supported_format(tmp_path, compressed_reads):
+	command = ["cat", str(compressed_reads)]
+	assert fastqio.decompress_command(command, [compressed_reads], [None, 'gzip'], tmp_path) == command
+
+
+def test_get_reads_from_folder_compressed(tmp_path):
+	forward = tmp_path / "AU1234_S0_R1_001.fastq.gz"
+	reverse = tmp_path / "AU1234_S0_R2_001.fastq.gz"
+	forward.touch()
+	reverse.touch()
+	(tmp_path / "AU1234.summary.txt").touch()
+	assert utilities.get_reads_from_folder(tmp_path) == (forward, reverse)
+	assert utilities.get_name_from_reads(forward) == "AU1234"
@@ -0,0 +1,102 @@
+from pathlib import Path
+
+import numpy
+import pytest
+
+from pipelines import genomediff, programio
+from tests.conftest import write_gd
+
+DATA_FOLDER = Path(__file__).parent / "data"
+BRESEQ_FOLDER = DATA_FOLDER / "outputs" / "breseq"
+GD_FILENAME = BRESEQ_FOLDER / "output" / "output.gd"
+
+
+def test_record_from_line():
+	line = "RA\t18\t.\tcontig00001\t66824\t0\tA\tG\tconsensus_score=8.7\tfrequency=4.194e-01\tmajor_cov=14/4\tprediction=polymorphism"
+	record = genomediff.Record.from_line(line)
+	assert (record.type, record.id, record.parents) == ("RA", 18, [])
+	assert (record.seq_id, record.position) == ("contig00001", 66824)
+	assert record.values['ref_base'] == "A"
+	assert record.values['consensus_score'] == 8.7
+	assert record.values['major_cov'] == "14/4"
+	assert record.frequency == pytest.approx(0.4194)
+	assert record.allele == "G"
+
+
+def test_mutation_from_line():
+	record = genomediff.Record.from_line("DEL\t5\t12,13\tcontig00003\t100\t25\tmediated=IS5")
+	assert record.parents == [12, 13]
+	assert record.values == {'seq_id': "contig00003", 'position': 100, 'size': 25, 'mediated': "IS5"}
+	assert record.frequency == 1.0
+	assert record.allele == "25"
+
+
+def test_genomediff_from_file():
+	gd = genomediff.GenomeDiff.from_file(GD_FILENAME)
+	assert gd.metadata['PROGRAM'] == ["breseq 0.32.1"]
+	assert len(gd.metadata['READSEQ']) == 2
+	assert len(gd.mutations) == 17
+	assert len(gd.evidence) == 343 + 11 + 49 + 545
+	assert all(i.type == "SNP" for i in gd.mutations)
+
+	first = gd.mutations[0]
+	assert (first.seq_id, first.position, first.allele) == ("contig00002", 74, "C")
+	assert [i.id for i in gd.evidence_for(first)] == [32]
+	assert all(i.type == "RA" for i in gd.polymorphisms())
+
+
+def test_get_sample_name():
+	assert genomediff.get_sample_name(GD_FILENAME) == "AU1064"
+
+
+def test_breseq_output():
+	output = programio.BreseqOutput.from_folder(BRESEQ_FOLDER)
+	assert output.name == "AU1064"
+	assert output.gd == GD_FILENAME
+	assert len(output.load().mutations) == 17
+
+
+def test_cohort_matrix(tmp_path):
+	first = write_gd(
+		tmp_path / "first.gd",
+		"SNP\t1\t.\tcontig1\t100\tA",
+		"SNP\t2\t.\tcontig1\t200\tC\tfrequency=0.25"
+	)
+	second = write_gd(
+		tmp_path / "second.gd",
+		"SNP\t1\t.\tcontig1\t100\tA",
+		"SNP\t2\t.\tcontig1\t100\tG",
+		"DEL\t3\t.\tcontig2\t50\t10"
+	)
+	matrix = genomediff.CohortMatrix()
+	assert matrix.update({"first": first, "second": second}) == ["first", "second"]
+	assert matrix.samples == ["first", "second"]
+	assert len(matrix) == 4
+	assert matrix.frequencies.tolist() == [[1.0, 1.0], [0.25, 0.0], [0.0, 1.0], [0.0, 1.0]]
+	assert matrix.shared().tolist() == [2, 1, 1, 1]
+	assert matrix.sample("first") == {("contig1", 100, "SNP", "A"): 1.0, ("contig1", 200, "SNP", "C"): 0.25}
+
+	filename = tmp_path / "mutations.npz"
+	matrix.save(filename)
+	loaded = genomediff.CohortMatrix.load(filename)
+	assert loaded.samples == matrix.samples
+	assert numpy.array_equal(loaded.frequencies, matrix.frequencies)
+	assert loaded.positions.tolist() == [100, 200, 100, 50]
+	# Unchanged samples are not read again.
+	assert loaded.update({"first": first, "second": second}) == []
+
+	# A sample which was rerun replaces its previous column.
+	write_gd(first, "SNP\t1\t.\tcontig3\t10\tT")
+	assert loaded.update({"first": first}) == ["first"]
+	assert loaded.frequencies[:, 0].tolist() == [0, 0, 0, 0, 1]
+
+
+def test_update_cohort_matrix(tmp_path):
+	filename = tmp_path / "mutations.npz"
+	genomediff.update_cohort_matrix(filename, {"sample": GD_FILENAME})
+	genomediff.update_cohort_matrix(filename, {"other": write_gd(tmp_path / "other.gd", "SNP\t1\t.\tcontig00002\t74\tC")})
+	matrix = genomediff.CohortMatrix.load(filename)
+	assert matrix.samples == ["sample", "other"]
+	assert matrix.frequencies.shape == (17, 2)
+	assert matrix.shared().max() == 2
+	assert genomediff.CohortMatrix.load(tmp_path / "missing.npz").samples == []
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pytest
+
+from pipelines import journal, manifest, systemio
+
+
+@pytest.fixture
+def command_runner(tmp_path) -> systemio.CommandRunner:
+	runner = systemio.CommandRunner(srun = False)
+	runner.set_command_log(tmp_path / "commandlog.sh")
+	return runner
+
+
+def make_step(output_folder: Path, command) -> manifest.Step:
+	return manifest.Step(output_folder, "sh", command, [], [output_folder / "result.txt"])
+
+
+def test_rewrite_command():
+	staged = journal.StagedOutput(Path("/project/sample/breseq"), "breseq")
+	command = ["breseq", "-o", "/project/sample/breseq", "/project/sample/breseq/input.fastq", "/project/sample/breseqx"]
+	result = staged.rewrite(command, inputs = [Path("/project/sample/breseq/input.fastq")])
+	assert result == [
+		"breseq", "-o", "/project/sample/.breseq.breseq.staging", "/project/sample/breseq/input.fastq", "/project/sample/breseqx"
+	]
+
+
+def test_successful_step_is_moved_into_place(tmp_path, command_runner):
+	output_folder = tmp_path / "output"
+	(output_folder / "other").mkdir(parents = True)
+	# The output folder is given as its own argument so it can be pointed at the staging folder. The final folder is
+	# given through its parent, which isn't rewritten, to check that nothing is written there while the command runs.
+	script = 'echo done > "$1"/result.txt && test ! -e "$2"/output/result.txt'
+	command = ["sh", "-c", script, "sh", output_folder, tmp_path]
+	step = make_step(output_folder, command)
+
+	process = command_runner.run(command, output_folder, threads = 1, step = step)
+
+	assert process.returncode == 0
+	assert (output_folder / "result.txt").read_text() == "done\n"
+	# Existing files in the output folder are kept.
+	assert (output_folder / "other").exists()
+	assert (output_folder / "stdout.txt").exists()
+	assert not journal.StagedOutput(output_folder, "sh").staging.exists()
+	assert step.is_current()
+	assert command_runner.journal.completed() == [f"sh:{output_folder}"]
+
+
+def test_failed_step_leaves_output_untouched(tmp_path, command_runner):
+	output_folder = tmp_path / "output"
+	command = ["sh", "-c", 'echo partial > "$1"/result.txt; exit 1', "sh", output_folder]
+	step = make_step(output_folder, command)
+
+	process = command_runner.run(command, output_folder, threads = 1, step = step)
+
+	assert process.returncode == 1
+	# The partial output was written to the staging folder, which was never moved into place.
+	assert (journal.StagedOutput(output_folder, "sh").staging / "result.txt").exists()
+	assert not output_folder.exists()
+	assert command_runner.journal.events()[f"sh:{output_folder}"]['event'] == 'fail'
+
+
+def test_recover_interrupted_step(tmp_path):
+	run_journal = journal.RunJournal(tmp_path / "journal.jsonl")
+	staged = journal.StagedOutput(tmp_path / "output", "sh")
+	staged.prepare()
+	run_journal.start(staged)
+	assert len(run_journal.interrupted()) == 1
+
+	run_journal.recover()
+	assert not staged.staging.exists()
+	assert run_journal.interrupted() == []
+
+
+def test_commit_command(tmp_path):
+	import subprocess
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	(output_folder / "result.txt").write_text("old")
+	staged = journal.StagedOutput(output_folder, "sh")
+	staged.prepare()
+	(staged.staging / "result.txt").write_text("new")
+	(staged.staging / ".hidden").write_text("hidden")
+
+	subprocess.run(["bash", "-c", staged.commit_command()], check = True)
+
+	assert (output_folder / "result.txt").read_text() == "new"
+	assert (output_folder / ".hidden").exists()
+	assert not staged.staging.exists()
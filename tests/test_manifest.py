@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from pipelines import manifest, systemio
+
+
+@pytest.fixture
+def step(tmp_path) -> manifest.Step:
+	source = tmp_path / "input.txt"
+	source.write_text("abcdefghIJKLM12345")
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	output = output_folder / "output.txt"
+	command = ["cp", source, output]
+	return manifest.Step(output_folder, "cp", command, [source], [output], version = "1.0")
+
+
+def test_step_is_stale_without_manifest(step):
+	step.outputs[0].write_text("partial")
+	assert not step.is_current()
+
+
+def test_step_is_current_after_successful_run(step):
+	command_runner = systemio.CommandRunner(srun = False)
+	command_runner.run(step.command, step.folder, threads = 1, step = step)
+	assert step.filename.exists()
+	assert step.is_current()
+
+
+def test_step_is_stale_after_input_changes(step):
+	systemio.CommandRunner(srun = False).run(step.command, step.folder, threads = 1, step = step)
+	step.inputs[0].write_text("something else")
+	assert not step.is_current()
+
+
+def test_step_is_stale_after_parameters_change(step):
+	systemio.CommandRunner(srun = False).run(step.command, step.folder, threads = 1, step = step)
+	changed = manifest.Step(step.folder, step.tool, step.command + ["--verbose"], step.inputs, step.outputs, step.version)
+	assert not changed.is_current()
+	changed = manifest.Step(step.folder, step.tool, step.command, step.inputs, step.outputs, "2.0")
+	assert not changed.is_current()
+
+
+def test_failed_run_does_not_write_manifest(step):
+	systemio.CommandRunner(srun = False).run(["false"], step.folder, threads = 1, step = step)
+	assert not step.filename.exists()
+
+
+def test_full_hash_ignores_touched_files(step, monkeypatch):
+	monkeypatch.setattr(manifest, "full_hash", True)
+	systemio.CommandRunner(srun = False).run(step.command, step.folder, threads = 1, step = step)
+	# Only the modification time changes.
+	os.utime(step.inputs[0], (0, 0))
+	assert step.is_current()
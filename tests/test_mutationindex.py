@@ -0,0 +1,120 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pipelines import catalog, genomediff, mutationindex, utilities
+from tests.conftest import write_gd
+
+DATA_FOLDER = Path(__file__).parent / "data"
+BRESEQ_FOLDER = DATA_FOLDER / "outputs" / "breseq"
+
+
+@pytest.fixture
+def index(tmp_path) -> mutationindex.MutationIndex:
+	return mutationindex.MutationIndex(tmp_path / "mutations.sqlite")
+
+
+@pytest.fixture
+def project_folder(tmp_path) -> Path:
+	folder = utilities.checkdir(tmp_path / "project")
+	write_gd(
+		folder / "AB1234" / "breseq" / "output" / "output.gd",
+		"SNP\t1\t.\tcontig1\t100\tA\tgene_name=geneA\tlocus_tag=LOCUS_0001",
+		"DEL\t2\t.\tcontig1\t500\t200\tgene_name=[geneB]–[geneC]\tfrequency=0.4"
+	)
+	write_gd(
+		folder / "CD5678" / "breseq" / "output" / "output.gd",
+		"SNP\t1\t.\tcontig1\t110\tT\tgene_name=geneA\tfrequency=0.75",
+		"INS\t2\t.\tcontig2\t100\tAT\tgene_name=geneD/–"
+	)
+	return folder
+
+
+def test_get_genes():
+	record = genomediff.Record.from_line("SNP\t1\t.\tcontig1\t100\tA\tgene_name=geneA/geneB\tlocus_tag=–/LOCUS_2\tgenes_overlapping=geneA")
+	assert mutationindex.get_genes(record) == ["geneA", "geneB", "LOCUS_2"]
+
+
+def test_get_span():
+	assert mutationindex.get_span(genomediff.Record.from_line("DEL\t1\t.\tcontig1\t100\t10")) == (100, 109)
+	assert mutationindex.get_span(genomediff.Record.from_line("INS\t1\t.\tcontig1\t100\tACGT")) == (100, 100)
+
+
+def test_region_and_gene_queries(index, project_folder):
+	assert index.update_project(project_folder) == ["AB1234", "CD5678"]
+	assert index.samples() == ["AB1234", "CD5678"]
+
+	hits = index.region("contig1", 90, 120)
+	assert [(i.sample, i.start, i.allele) for i in hits] == [("AB1234", 100, "A"), ("CD5678", 110, "T")]
+	assert hits[0].genes == ["geneA", "LOCUS_0001"]
+
+	# Mutations which start before the region but extend into it are found too.
+	assert [i.type for i in index.region("contig1", 650, 660)] == ["DEL"]
+	assert index.region("contig1", 700, 800) == []
+	assert index.region("contig2", 90, 120, min_frequency = 0.5)[0].sample == "CD5678"
+
+	assert index.carriers("geneA") == {"AB1234": 1.0, "CD5678": 0.75}
+	assert index.carriers("geneA", min_frequency = 0.9) == {"AB1234": 1.0}
+	assert [i.sample for i in index.gene("geneC")] == ["AB1234"]
+	assert [i.sample for i in index.gene("geneA", samples = ["CD5678"])] == ["CD5678"]
+	assert index.genes() == {"geneA", "LOCUS_0001", "geneB", "geneC", "geneD"}
+
+
+def test_region_after_the_index_changes(tmp_path, index, project_folder):
+	index.update_project(project_folder)
+	assert index.region("contig1", 950, 960) == []
+
+	# The longest span is cached, so adding a longer mutation has to reset it.
+	write_gd(project_folder / "EF9012" / "breseq" / "output" / "output.gd", "DEL\t1\t.\tcontig1\t100\t900")
+	index.update_project(project_folder)
+	assert [i.sample for i in index.region("contig1", 950, 960)] == ["EF9012"]
+
+	# Changes made through another connection to the same database are seen as well.
+	other = mutationindex.MutationIndex(index.filename)
+	write_gd(tmp_path / "GH3456.gd", "AMP\t1\t.\tcontig2\t10\t2000\t2")
+	other.add_sample("GH3456", tmp_path / "GH3456.gd")
+	other.close()
+	assert [i.sample for i in index.region("contig2", 1500, 1600)] == ["GH3456"]
+	index.remove_sample("EF9012")
+	assert index.region("contig1", 950, 960) == []
+
+
+def test_update_is_incremental(index, project_folder):
+	index.update_project(project_folder)
+	assert index.update_project(project_folder) == []
+
+	write_gd(project_folder / "CD5678" / "breseq" / "output" / "output.gd", "SNP\t1\t.\tcontig3\t5\tG\tgene_name=geneE")
+	write_gd(project_folder / "EF9012" / "breseq" / "output" / "output.gd", "SNP\t1\t.\tcontig1\t100\tA\tgene_name=geneA")
+	assert index.update_project(project_folder) == ["CD5678", "EF9012"]
+	assert index.carriers("geneA") == {"AB1234": 1.0, "EF9012": 1.0}
+	assert index.gene("geneD") == []
+
+	# Samples whose breseq folder was removed are dropped from the index.
+	shutil.rmtree(project_folder / "AB1234")
+	index.update_project(project_folder)
+	assert index.samples() == ["CD5678", "EF9012"]
+	assert index.gene("geneC") == []
+
+
+def test_update_with_catalog(tmp_path, index, project_folder):
+	for name in ["AB1234", "CD5678"]:
+		(project_folder / name / "breseq" / "output" / "index.html").touch()
+	write_gd(tmp_path / "other" / "EF9012" / "breseq" / "output" / "output.gd", "SNP\t1\t.\tcontig1\t100\tA")
+	(tmp_path / "other" / "EF9012" / "breseq" / "output" / "index.html").touch()
+	project_catalog = catalog.ProjectCatalog(tmp_path / "catalog.sqlite")
+	# The samples are named after their folder in the project even when the catalog first found them from a parent
+	# folder, and breseq folders outside the project are ignored.
+	project_catalog.update(tmp_path, max_depth = 4)
+	assert index.update_project(project_folder, project_catalog) == ["AB1234", "CD5678"]
+
+
+def test_annotated_genomediff(tmp_path, index):
+	breseq_folder = tmp_path / "AU1064" / "breseq"
+	shutil.copytree(BRESEQ_FOLDER, breseq_folder)
+	assert mutationindex.get_genomediff_filename(breseq_folder).name == "annotated.gd"
+	index.update_project(tmp_path)
+
+	assert len(index.region("contig00002", 1, 1000)) == 2
+	assert [i.start for i in index.gene("JFHDKIGG_00296")] == [74, 436]
+	assert index.carriers("JFHDKIGG_03815") == {"AU1064": 1.0}
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from pipelines import sampleio
+from pipelines.processes import pipeline
+
+
+@pytest.fixture
+def samples(tmp_path):
+	result = list()
+	for name in ["A", "B", "C"]:
+		forward = tmp_path / f"{name}_R1_001.fastq"
+		reverse = tmp_path / f"{name}_R2_001.fastq"
+		forward.touch()
+		reverse.touch()
+		result.append(sampleio.SampleReads(name, forward, reverse))
+	return result
+
+
+def test_pipeline_passes_outputs_between_stages(tmp_path, samples):
+	stages = [
+		pipeline.Stage("first", lambda sample, inputs, folder: f"{sample.name}-1"),
+		pipeline.Stage("second", lambda sample, inputs, folder: inputs["first"] + "-2", ["first"]),
+		pipeline.Stage("third", lambda sample, inputs, folder: (inputs["first"], inputs["second"], folder), ["first", "second"])
+	]
+	results = pipeline.Pipeline(tmp_path / "project", stages).run(samples)
+
+	assert results["B"]["second"] == "B-1-2"
+	assert results["C"]["third"] == ("C-1", "C-1-2", tmp_path / "project" / "C")
+
+
+def test_pipeline_skips_stages_after_failure(tmp_path, samples):
+	def fail_on_b(sample, inputs, folder):
+		if sample.name == "B":
+			raise ValueError("failed")
+		return sample.name
+
+	stages = [
+		pipeline.Stage("first", fail_on_b),
+		pipeline.Stage("second", lambda sample, inputs, folder: inputs["first"], ["first"])
+	]
+	results = pipeline.Pipeline(tmp_path / "project", stages).run(samples)
+	assert results["A"] == {"first": "A", "second": "A"}
+	assert results["B"] == {}
+
+
+def test_pipeline_overlaps_samples(tmp_path, samples):
+	# The second stage of sample A should not have to wait for sample C's first stage.
+	release_c = threading.Event()
+	order = list()
+
+	def first(sample, inputs, folder):
+		if sample.name == "C":
+			release_c.wait(timeout = 5)
+		return sample.name
+
+	def second(sample, inputs, folder):
+		order.append(sample.name)
+		if sample.name == "A":
+			release_c.set()
+		return sample.name
+
+	stages = [pipeline.Stage("first", first), pipeline.Stage("second", second, ["first"])]
+	pipeline.Pipeline(tmp_path / "project", stages).run(samples)
+	assert order[0] != "C"
+	assert "C" in order
+
+
+@pytest.mark.parametrize(
+	"stages",
+	[
+		[pipeline.Stage("a", print, ["b"]), pipeline.Stage("b", print, ["a"])],
+		[pipeline.Stage("a", print, ["missing"])],
+		[pipeline.Stage("a", print), pipeline.Stage("a", print)]
+	]
+)
+def test_pipeline_invalid_graph(tmp_path, stages):
+	with pytest.raises(ValueError):
+		pipeline.Pipeline(tmp_path, stages)
@@ -1,9 +1,11 @@
+import os
 import sys
 
 import pytest
 from loguru import logger
 
-from pipelines.programs import breseq
+from pipelines import fastqio, programio, systemio
+from pipelines.programs import breseq, trimmomatic
 
 
 @pytest.mark.skip()  # The workflow has been tested and works, but takes a while to run.
@@ -15,3 +17,37 @@ def test_breseq(assembly, sample_reads, tmp_path):
 	breseq_output = breseq_workflow.run(output_folder, sample_reads.forward, sample_reads.reverse)
 
 	assert breseq_output.exists()
+
+
+# Writes the reads it was given into the index.
+FAKE_BRESEQ = """#!/bin/bash
+while [ $# -gt 0 ]; do
+	case "$1" in
+		-o) outdir=$2; shift 2 ;;
+		-j|-r) shift 2 ;;
+		*) reads+=("$1"); shift ;;
+	esac
+done
+mkdir -p "$outdir/output"
+cat "${reads[@]}" > "$outdir/output/index.html"
+"""
+
+
+def test_breseq_reads_zstd_trimmed_reads(tmp_path, monkeypatch):
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "breseq"
+	program.write_text(FAKE_BRESEQ)
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}:{os.environ['PATH']}")
+	monkeypatch.setattr(systemio.command_runner, 'use_srun', False)
+
+	trimmed = programio.TrimmomaticOutput.expected(tmp_path, "AU1234", trimmomatic.COMPRESSION_SUFFIXES['zstd'])
+	assert trimmed.forward.name.endswith(".fastq.zst")
+	for filename in [trimmed.forward, trimmed.reverse]:
+		with fastqio.open_output(filename) as file1:
+			file1.write(b"@read\nACGT\n+\nIIII\n")
+
+	output = breseq.Breseq(tmp_path / "reference.gbk").run(tmp_path / "breseq", trimmed.forward, trimmed.reverse)
+	assert output.exists()
+	assert output.index.read_text() == "@read\nACGT\n+\nIIII\n" * 2
@@ -1,5 +1,72 @@
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from pipelines import fastqio, programio, systemio
 from pipelines.programs import fastqc
 
+FASTQC_DATA = """##FastQC	0.11.9
+>>Basic Statistics	pass
+#Measure	Value
+Filename	{filename}
+File type	Conventional base calls
+Total Sequences	1000
+Sequences flagged as poor quality	0
+Sequence length	35-151
+%GC	66
+>>END_MODULE
+>>Per base sequence quality	warn
+#Base	Mean	Median	Lower Quartile	Upper Quartile	10th Percentile	90th Percentile
+1	32.1	33.0	32.0	34.0	30.0	34.0
+2	32.4	33.0	32.0	34.0	31.0	34.0
+>>END_MODULE
+>>Sequence Duplication Levels	fail
+#Total Deduplicated Percentage	51.3
+#Duplication Level	Percentage of deduplicated	Percentage of total
+1	90.5	48.2
+>>END_MODULE
+"""
+
+# Writes the same files as fastqc, and logs the read files given to each call.
+FAKE_FASTQC = f"""#!{sys.executable}
+import sys, zipfile
+from pathlib import Path
+sys.path.insert(0, {str(Path(__file__).parents[2])!r})
+from pipelines import fastqio, systemio
+arguments = sys.argv[1:]
+folder = Path(arguments[arguments.index('--outdir') + 1])
+reads = [i for i in arguments if i.endswith('.fastq')]
+with (folder.parent / 'calls.log').open('a') as log:
+	log.write(' '.join(arguments) + '\\n')
+for read in reads:
+	stem = fastqio.get_read_stem(Path(read))
+	(folder / (stem + '_fastqc.html')).write_text('<html></html>')
+	with zipfile.ZipFile(folder / (stem + '_fastqc.zip'), 'w') as archive:
+		archive.writestr(stem + '_fastqc/fastqc_data.txt', {FASTQC_DATA!r}.format(filename = Path(read).name))
+"""
+
+
+@pytest.fixture
+def fake_fastqc(tmp_path, monkeypatch):
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "fastqc"
+	program.write_text(FAKE_FASTQC)
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}:{os.environ['PATH']}")
+	return program
+
+
+def write_archive(folder, stem):
+	filename = folder / f"{stem}_fastqc.zip"
+	with zipfile.ZipFile(filename, 'w') as archive:
+		archive.writestr(f"{stem}_fastqc/fastqc_data.txt", FASTQC_DATA.format(filename = f"{stem}.fastq.gz"))
+	(folder / f"{stem}_fastqc.html").write_text("<html></html>")
+	return filename
+
 
 def test_fastqc(tmp_path, sample_reads):
 	fastqc_workflow = fastqc.FastQC()
@@ -7,3 +74,133 @@ def test_fastqc(tmp_path, sample_reads):
 	output = fastqc_workflow.run(output_folder, *sample_reads.reads())
 
 	assert output.exists()
+
+
+def test_output_from_folder_with_reports_only(tmp_path):
+	for stem in ["AU1234_S0_R1_001", "AU1234_S0_R2_001"]:
+		write_archive(tmp_path, stem)
+
+	output = programio.FastQCOutput.from_folder(tmp_path)
+	assert output.name == "AU1234"
+	assert output.profile is None
+	assert output.exists()
+
+
+def test_parse_fastqc_data():
+	report = fastqc.parse_fastqc_data(FASTQC_DATA.format(filename = "AU1234_R1.fastq").splitlines(), "AU1234")
+	assert report.version == "0.11.9"
+	assert report.statuses == {"Basic Statistics": "pass", "Per base sequence quality": "warn", "Sequence Duplication Levels": "fail"}
+	assert report.basic_statistics["Total Sequences"] == "1000"
+
+	quality = report.modules["Per base sequence quality"]
+	assert quality.columns[:3] == ["Base", "Mean", "Median"]
+	assert quality.rows[1][:2] == ["2", "32.4"]
+
+	duplication = report.modules["Sequence Duplication Levels"]
+	assert duplication.values == {"Total Deduplicated Percentage": "51.3"}
+	assert duplication.columns == ["Duplication Level", "Percentage of deduplicated", "Percentage of total"]
+	assert duplication.rows == [["1", "90.5", "48.2"]]
+
+	row = report.to_row()
+	assert row["filename"] == "AU1234_R1.fastq"
+	assert row["%GC"] == "66"
+	assert row["Per base sequence quality"] == "warn"
+
+
+def test_get_command_threads(tmp_path):
+	workflow = fastqc.FastQC(threads = 4)
+	reads = [tmp_path / "A_R1.fastq", tmp_path / "A_R2.fastq"]
+	assert "--threads" not in workflow.get_command(tmp_path, reads)
+	command = workflow.get_command(tmp_path, reads, threads = 2)
+	assert command[command.index("--threads") + 1] == "2"
+	assert command[-2:] == [str(i) for i in reads]
+
+
+def test_load_reports_and_summarize(tmp_path):
+	outputs = list()
+	for name in ["AU1234", "AU5678"]:
+		folder = tmp_path / name
+		folder.mkdir()
+		reads = [folder / f"{name}_S0_R1_001.fastq.gz", folder / f"{name}_S0_R2_001.fastq.gz"]
+		for read in reads:
+			write_archive(folder, fastqio.get_read_stem(read))
+		output = fastqc.FastQC.get_output(folder, reads)
+		assert output.archives[0] == folder / f"{name}_S0_R1_001_fastqc.zip"
+		assert [i.version for i in output.load_reports()] == ["0.11.9", "0.11.9"]
+		outputs.append(output)
+	outputs.append(fastqc.FastQC.get_output(tmp_path, [tmp_path / "missing_R1.fastq"]))
+
+	table = tmp_path / "fastqc.tsv"
+	rows = fastqc.summarize(outputs, table, processes = 2)
+	assert [row["sample"] for row in rows] == ["AU1234", "AU1234", "AU5678", "AU5678"]
+	lines = table.read_text().splitlines()
+	assert lines[0].split("\t")[:3] == ["sample", "filename", "Total Sequences"]
+	assert len(lines) == 5
+
+
+def test_run_samples_in_batches(tmp_path, fake_fastqc):
+	samples = list()
+	for name in ["A", "B", "C"]:
+		reads = [tmp_path / f"{name}_R1.fastq", tmp_path / f"{name}_R2.fastq"]
+		for read in reads:
+			read.write_text("@read\nACGT\n+\nIIII\n")
+		samples.append((tmp_path / name, reads))
+
+	workflow = fastqc.FastQC(threads = 4)
+	outputs = workflow.run_samples(samples)
+	assert all(output.exists() for output in outputs)
+	assert outputs[2].reports == [tmp_path / "C" / "C_R1_fastqc.html", tmp_path / "C" / "C_R2_fastqc.html"]
+	assert outputs[1].load_reports()[0].basic_statistics["Filename"] == "B_R1.fastq"
+	assert not list(tmp_path.glob(".fastqc.batch.*"))
+
+	# Two samples fit in the first batch, and the third is analyzed by a second fastqc process.
+	calls = sorted(i.split() for i in (tmp_path / "calls.log").read_text().splitlines())
+	assert sorted(len([j for j in call if j.endswith(".fastq")]) for call in calls) == [2, 4]
+
+	# Samples which are already finished are skipped.
+	(tmp_path / "calls.log").unlink()
+	workflow.run_samples(samples)
+	assert not (tmp_path / "calls.log").exists()
+
+
+def test_run_samples_with_the_same_read_names(tmp_path, fake_fastqc):
+	samples = list()
+	for name in ["A", "B"]:
+		folder = tmp_path / name
+		folder.mkdir()
+		reads = [folder / "R1.fastq", folder / "R2.fastq"]
+		for read in reads:
+			read.write_text("@read\nACGT\n+\nIIII\n")
+		samples.append((folder / "fastqc", reads))
+
+	outputs = fastqc.FastQC(threads = 8).run_samples(samples)
+	# The reports of both samples would have the same names, so the samples can't share a fastqc process.
+	assert [len(i.read_text().splitlines()) for i in sorted(tmp_path.glob("*/calls.log"))] == [1, 1]
+	assert all(output.exists() for output in outputs)
+
+
+def test_run_samples_in_a_job_array(tmp_path, fake_fastqc, backend):
+	samples = list()
+	for name in ["A", "B"]:
+		reads = [tmp_path / f"{name}_R1.fastq", tmp_path / f"{name}_R2.fastq"]
+		for read in reads:
+			read.write_text("@read\nACGT\n+\nIIII\n")
+		samples.append((tmp_path / name, reads))
+
+	with systemio.command_runner.batch(backend, "fastqc") as stage:
+		outputs = fastqc.FastQC(threads = 4).run_samples(samples)
+		assert not any(output.exists() for output in outputs)
+	# Each sample is its own task, which moves its reports into place once fastqc finishes.
+	assert stage.exit_codes == [0, 0]
+	assert all(output.exists() for output in outputs)
+	assert not list(tmp_path.glob(".fastqc.batch.*"))
+
+
+def test_run_samples_fastqc_fails(tmp_path, fake_fastqc):
+	fake_fastqc.write_text("#!/bin/bash\nexit 2\n")
+	reads = [tmp_path / "A_R1.fastq", tmp_path / "A_R2.fastq"]
+	outputs = fastqc.FastQC().run_samples([(tmp_path / "A", reads)])
+	assert not outputs[0].exists()
+	# The batch folder is kept, since it has the logs of the failed run.
+	batch_folder = next(tmp_path.glob(".fastqc.batch.*"))
+	assert (batch_folder / "stderr.txt").exists()
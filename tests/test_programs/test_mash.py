@@ -0,0 +1,155 @@
+import numpy
+import pytest
+
+from pipelines import sampleio
+from pipelines.processes import generic
+from pipelines.programs import mash
+from pipelines.qc import BASE_CODES
+from tests.conftest import write_fasta
+
+GENOME_SIZE = 20000
+
+
+def random_genome(seed: int, length: int = GENOME_SIZE) -> str:
+	return "".join(numpy.random.default_rng(seed).choice(list("ACGT"), length))
+
+
+def mutate(genome: str, rate: float, seed: int) -> str:
+	generator = numpy.random.default_rng(seed)
+	bases = numpy.array(list(genome))
+	positions = generator.choice(len(bases), int(len(bases) * rate), replace = False)
+	bases[positions] = [{'A': 'C', 'C': 'G', 'G': 'T', 'T': 'A'}[i] for i in bases[positions]]
+	return "".join(bases)
+
+
+def reverse_complement(sequence: str) -> str:
+	return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+def write_sample(folder, name: str, genome: str, seed: int, count: int = 4000, length: int = 100) -> sampleio.SampleReads:
+	folder.mkdir(parents = True, exist_ok = True)
+	starts = numpy.random.default_rng(seed).integers(0, len(genome) - length, count)
+	forward, reverse = folder / f"{name}_S1_R1_001.fastq", folder / f"{name}_S1_R2_001.fastq"
+	forward.write_text("".join(f"@{name}.{i}\n{genome[s:s + length]}\n+\n{'I' * length}\n" for i, s in enumerate(starts)))
+	reverse.write_text("".join(f"@{name}.{i}\n{reverse_complement(genome[s:s + length])}\n+\n{'I' * length}\n" for i, s in enumerate(starts)))
+	return sampleio.SampleReads(name, forward, reverse, folder)
+
+
+def test_kmer_hashes_are_canonical():
+	sequence = random_genome(1, 200)
+	forward = mash.get_kmer_hashes(BASE_CODES[numpy.frombuffer(sequence.encode(), dtype = numpy.uint8)], 21, 42)
+	reverse = mash.get_kmer_hashes(BASE_CODES[numpy.frombuffer(reverse_complement(sequence).encode(), dtype = numpy.uint8)], 21, 42)
+	assert len(forward) == 180
+	assert numpy.array_equal(numpy.sort(forward), numpy.sort(reverse))
+
+
+def test_kmer_hashes_skip_invalid_bases():
+	codes = BASE_CODES[numpy.frombuffer(b"ACGTACGTAC\nACGTNACGTA", dtype = numpy.uint8)]
+	# Only the 4-mers entirely within "ACGTACGTAC", "ACGT", or "ACGTA" count.
+	assert len(mash.get_kmer_hashes(codes, 4, 0)) == 7 + 1 + 2
+
+
+def test_distance_matches_mutation_rate(tmp_path):
+	genome = random_genome(1)
+	sketcher = mash.Sketcher(sketch_size = 2000)
+	original = sketcher.sketch_assembly(write_fasta(tmp_path / "original.fasta", {"contig1": genome}))
+	identical = sketcher.sketch_assembly(write_fasta(tmp_path / "identical.fasta", {"contig1": genome}))
+	mutated = sketcher.sketch_assembly(write_fasta(tmp_path / "mutated.fasta", {"contig1": mutate(genome, 0.01, 2)}))
+	unrelated = sketcher.sketch_assembly(write_fasta(tmp_path / "unrelated.fasta", {"contig1": random_genome(3)}))
+
+	assert original.distance(identical) == 0
+	assert original.distance(mutated) == pytest.approx(0.01, abs = 0.004)
+	assert original.distance(unrelated) == 1.0
+
+
+def test_sketch_genbank(tmp_path):
+	genome = random_genome(1, 1000)
+	origin = "\n".join(f"{i + 1:>9} " + " ".join(genome[j:j + 10] for j in range(i, min(i + 60, len(genome)), 10)) for i in range(0, len(genome), 60))
+	genbank = tmp_path / "reference.gbk"
+	genbank.write_text(f"LOCUS       contig1    1000 bp    DNA     linear   BCT 01-JAN-2020\nORIGIN\n{origin}\n//\n")
+	fasta = write_fasta(tmp_path / "reference.fasta", {"contig1": genome})
+
+	sketcher = mash.Sketcher()
+	assert numpy.array_equal(sketcher.sketch_assembly(genbank).hashes, sketcher.sketch_assembly(fasta).hashes)
+
+
+def test_read_sketch_ignores_errors(tmp_path):
+	genome = random_genome(1)
+	sample = write_sample(tmp_path / "sample", "AU1234", genome, seed = 1)
+	# Add reads full of unique k-mers, which would fill the sketch if they were kept.
+	with sample.forward.open('a') as file1:
+		for index in range(200):
+			file1.write(f"@error.{index}\n{random_genome(100 + index, 100)}\n+\n{'I' * 100}\n")
+
+	sketcher = mash.Sketcher()
+	reference = sketcher.sketch_assembly(write_fasta(tmp_path / "reference.fasta", {"contig1": genome}))
+	assert sketcher.sketch_reads(sample).distance(reference) < 0.001
+
+
+def test_sketches_are_cached(tmp_path, cache_folder):
+	sample = write_sample(tmp_path / "sample", "AU1234", random_genome(1), seed = 1, count = 500)
+	sketcher = mash.Sketcher()
+	sketch = sketcher.sketch_reads(sample)
+	cache = cache_folder / "sketches" / "AU1234.sketch.npz"
+	assert cache.exists()
+	assert not (tmp_path / "sample" / "AU1234.sketch.npz").exists()
+
+	modified = cache.stat().st_mtime_ns
+	assert numpy.array_equal(sketcher.sketch_reads(sample).hashes, sketch.hashes)
+	assert cache.stat().st_mtime_ns == modified
+
+	# Different parameters need a different sketch.
+	assert len(mash.Sketcher(sketch_size = 10).sketch_reads(sample).hashes) == 10
+
+
+def test_cohort_checks(tmp_path):
+	genomes = {name: random_genome(seed) for seed, name in enumerate(["A", "B", "C"], start = 1)}
+	sketcher = mash.Sketcher(processes = 2)
+	samples = [write_sample(tmp_path / name, name, genome, seed = 1) for name, genome in genomes.items()]
+	# Sample D is a resequenced copy of sample A.
+	samples.append(write_sample(tmp_path / "D", "D", genomes["A"], seed = 2))
+	reads = sketcher.sketch_samples(samples)
+	assert sorted(reads) == ["A", "B", "C", "D"]
+
+	duplicates = mash.find_duplicates(list(reads.values()))
+	assert [(left, right) for left, right, _ in duplicates] == [("A", "D")]
+
+	matrix = mash.distance_matrix(list(reads.values()))
+	assert matrix.shape == (4, 4)
+	assert numpy.allclose(matrix, matrix.T)
+
+	# The assemblies of B and C were swapped.
+	assemblies = sketcher.sketch_assemblies({
+		"A": write_fasta(tmp_path / "A.fasta", {"contig1": genomes["A"]}),
+		"B": write_fasta(tmp_path / "B.fasta", {"contig1": genomes["C"]}),
+		"C": write_fasta(tmp_path / "C.fasta", {"contig1": genomes["B"]}),
+	})
+	checks = {i.name: i for i in mash.check_identity({k: v for k, v in reads.items() if k != "D"}, assemblies)}
+	assert not checks["A"].swapped and not checks["A"].contaminated
+	assert checks["B"].swapped and checks["B"].closest == "C"
+	assert checks["C"].contaminated
+
+
+def test_closest_reference(tmp_path):
+	genome = random_genome(1)
+	sample = write_sample(tmp_path / "sample", "AU1234", mutate(genome, 0.005, 1), seed = 1)
+	sketcher = mash.Sketcher()
+	references = {
+		"close": sketcher.sketch_assembly(write_fasta(tmp_path / "close.fasta", {"contig1": genome})),
+		"far": sketcher.sketch_assembly(write_fasta(tmp_path / "far.fasta", {"contig1": mutate(genome, 0.05, 2)}))
+	}
+	name, distance = mash.closest_reference(sketcher.sketch_reads(sample), references)
+	assert name == "close"
+	assert distance < 0.01
+
+
+def test_remove_duplicates(tmp_path):
+	genomes = {name: random_genome(seed) for seed, name in enumerate(["A", "B"], start = 1)}
+	samples = [write_sample(tmp_path / name, name, genome, seed = 1) for name, genome in genomes.items()]
+	samples.append(write_sample(tmp_path / "C", "C", genomes["A"], seed = 2))
+	samples.append(write_sample(tmp_path / "D", "D", genomes["A"], seed = 3))
+
+	workflow = generic.GenericVariantCalling(tmp_path / "project")
+	assert [i.name for i in workflow.remove_duplicates(samples)] == ["A", "B"]
+	# The sketches are cached in the project rather than next to the reads.
+	assert (tmp_path / "project" / ".cache" / "sketches" / "A.sketch.npz").exists()
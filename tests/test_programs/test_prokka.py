@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from pipelines import manifest, systemio
+from pipelines.programs import prokka
+
+# Stand-in for prokka which, like prokka, refuses to write into an existing folder unless `--force` is given.
+FAKE_PROKKA = """#!/bin/bash
+if [ "$1" == "--version" ]; then echo "prokka 1.14.6" >&2; exit 0; fi
+force=0
+while [ $# -gt 1 ]; do
+	case "$1" in
+		--force) force=1; shift;;
+		--outdir) outdir="$2"; shift 2;;
+		--prefix) prefix="$2"; shift 2;;
+		*) shift;;
+	esac
+done
+if [ -d "$outdir" ] && [ $force -eq 0 ]; then
+	echo "Folder '$outdir' already exists! Please change --outdir or use --force" >&2
+	exit 2
+fi
+mkdir -p "$outdir"
+for suffix in gff gbk fna ffn faa; do echo "$prefix" > "$outdir/$prefix.$suffix"; done
+"""
+
+
+@pytest.fixture
+def fake_prokka(tmp_path, monkeypatch) -> Path:
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "prokka"
+	program.write_text(FAKE_PROKKA)
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}:{os.environ['PATH']}")
+	return program
+
+
+def test_run_in_staged_output_folder(tmp_path, assembly, fake_prokka, command_runner, monkeypatch):
+	monkeypatch.setattr(systemio, "command_runner", command_runner)
+	output_folder = tmp_path / "prokka"
+	output = prokka.Prokka("Pseudomonas", "aeruginosa").run(assembly, output_folder)
+
+	# The staging folder already exists when prokka starts, so this only works with `--force`.
+	assert output.exists()
+	assert output.gff == output_folder / f"{assembly.stem}.gff"
+	assert not list(tmp_path.glob(".prokka.prokka.staging"))
+	assert manifest.Step(output_folder, "prokka", [], [], []).load() is not None
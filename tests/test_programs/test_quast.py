@@ -0,0 +1,100 @@
+import gzip
+
+import numpy
+import pytest
+
+from pipelines.programs import quast
+from tests.conftest import write_fasta
+
+CONTIGS = {
+	"contig1 length=6000": "ACGT" * 1500,
+	"contig2": "GGGGNNNNCC" * 300,
+	"contig3": "AT" * 500,
+	"contig4": "A" * 400
+}
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 2 ** 22])
+def test_get_contig_counts(tmp_path, chunk_size):
+	filename = write_fasta(tmp_path / "contigs.fa", CONTIGS)
+	lengths, gc, ns = quast.get_contig_counts(filename, chunk_size)
+	assert lengths.tolist() == [6000, 3000, 1000, 400]
+	assert gc.tolist() == [3000, 1800, 0, 0]
+	assert ns.tolist() == [0, 1200, 0, 0]
+
+
+def test_get_contig_counts_long_headers(tmp_path):
+	contigs = {"x" * 100: "ACGT" * 10, "y" * 50: "GC"}
+	lengths, gc, _ = quast.get_contig_counts(write_fasta(tmp_path / "contigs.fa", contigs), 16)
+	assert lengths.tolist() == [40, 2]
+	assert gc.tolist() == [20, 2]
+
+
+def test_get_nx():
+	lengths = numpy.array([100, 400, 200, 300])
+	assert quast.get_nx(lengths, 0.5) == (300, 2)
+	assert quast.get_nx(lengths, 0.9) == (200, 3)
+	assert quast.get_nx(numpy.zeros(0), 0.5) == (0, 0)
+
+
+def test_calculate_stats(tmp_path):
+	filename = write_fasta(tmp_path / "contigs.fa", CONTIGS)
+	stats = quast.calculate_stats(filename)
+	assert stats.contigs == 4
+	assert stats.total_length == 10400
+	assert stats.largest_contig == 6000
+	assert stats.n_count == 1200
+	assert stats.gc == pytest.approx(4800 / 9200)
+	assert (stats.n50, stats.l50) == (6000, 1)
+	assert (stats.n90, stats.l90) == (1000, 3)
+	assert stats.length_histogram == [1, 0, 2, 1] + [0] * 7
+
+	filtered = quast.calculate_stats(filename, min_length = 500)
+	assert filtered.contigs == 3
+	assert filtered.total_length == 10000
+
+
+def test_get_stats_is_cached(tmp_path):
+	filename = write_fasta(tmp_path / "contigs.fa", CONTIGS)
+	stats = quast.get_stats(filename, "sample1")
+	assert quast.get_stats_filename(filename).exists()
+	assert quast.load_stats(filename) == stats
+	assert quast.load_stats(filename, min_length = 500) is None
+
+	write_fasta(filename, {"contig1": "ACGT"})
+	assert quast.load_stats(filename) is None
+	assert quast.get_stats(filename).total_length == 4
+
+
+def test_get_assembly_name(tmp_path):
+	assert quast.get_assembly_name(tmp_path / "AU1234" / "shovill" / "contigs.fa") == "AU1234"
+	assert quast.get_assembly_name(tmp_path / "AU1234.fasta.gz") == "AU1234"
+
+
+def test_run_project(tmp_path):
+	for name in ["AU1234", "AU5678"]:
+		folder = tmp_path / name / "shovill"
+		folder.mkdir(parents = True)
+		write_fasta(folder / "contigs.fa", CONTIGS)
+	# Compressed assemblies can be read as well.
+	compressed = tmp_path / "reference.fa.gz"
+	compressed.write_bytes(gzip.compress(write_fasta(tmp_path / "reference.fa", CONTIGS).read_bytes()))
+
+	table = tmp_path / "assemblies.tsv"
+	results = quast.Quast(processes = 2).run_project(tmp_path, table)
+	assert [i.name for i in results] == ["AU1234", "AU5678"]
+	assert all(i.total_length == 10400 for i in results)
+
+	lines = table.read_text().splitlines()
+	assert len(lines) == 3
+	assert lines[0].split("\t")[:3] == ["name", "filename", "contigs"]
+	assert quast.Quast().run(compressed).total_length == 10400
+
+
+def test_shovill_output_stats(tmp_path):
+	from pipelines import programio
+	write_fasta(tmp_path / "contigs.fa", CONTIGS)
+	output = programio.ShovillOutput.expected(tmp_path, "AU1234")
+	stats = output.stats()
+	assert stats.name == "AU1234"
+	assert stats.n50 == 6000
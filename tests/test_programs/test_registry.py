@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from pipelines.programs import registry
+
+
+@pytest.fixture
+def fake_program(tmp_path, monkeypatch):
+	""" A program that counts how many times it was asked for its version."""
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "fakeprogram"
+	counter = tmp_path / "calls.txt"
+	program.write_text(f"#!/bin/bash\necho called >> {counter}\necho 'fakeprogram 1.2.3'\n")
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}{os.pathsep}{os.environ['PATH']}")
+	return program, counter
+
+
+def test_registry_probes_version(tmp_path, fake_program):
+	program, _ = fake_program
+	tool_registry = registry.ToolRegistry(tmp_path / "tools.json")
+
+	info = tool_registry.get("fakeprogram")
+	assert info.path == str(program)
+	assert info.version == "fakeprogram 1.2.3\n"
+
+
+def test_registry_uses_cache(tmp_path, fake_program):
+	program, counter = fake_program
+	cache = tmp_path / "tools.json"
+	registry.ToolRegistry(cache).version("fakeprogram")
+	registry.ToolRegistry(cache).version("fakeprogram")
+	assert counter.read_text().count("called") == 1
+
+	# Changing the program should invalidate the cache.
+	os.utime(program, (0, 0))
+	registry.ToolRegistry(cache).version("fakeprogram")
+	assert counter.read_text().count("called") == 2
+
+
+def test_registry_missing_program(tmp_path):
+	tool_registry = registry.ToolRegistry(tmp_path / "tools.json")
+	info = tool_registry.get("not_a_real_program_name")
+	assert not info.exists()
+	assert tool_registry.version("not_a_real_program_name") is None
+
+
+def test_registry_keeps_other_cached_programs(tmp_path, fake_program):
+	program, _ = fake_program
+	other = program.with_name("otherprogram")
+	other.write_text("#!/bin/bash\necho 'otherprogram 2.0'\n")
+	other.chmod(0o755)
+	cache = tmp_path / "tools.json"
+	registry.ToolRegistry(cache).version("fakeprogram")
+	registry.ToolRegistry(cache).version("otherprogram")
+
+	tool_registry = registry.ToolRegistry(cache)
+	assert set(tool_registry._read_cache()) == {"fakeprogram", "otherprogram"}
+
+
+def test_registry_does_not_cache_failed_probes(tmp_path, fake_program):
+	program, counter = fake_program
+	program.write_text(f"#!/bin/bash\necho called >> {counter}\nexit 1\n")
+	cache = tmp_path / "tools.json"
+	assert registry.ToolRegistry(cache).version("fakeprogram") is None
+	assert registry.ToolRegistry(cache).version("fakeprogram") is None
+	assert counter.read_text().count("called") == 2
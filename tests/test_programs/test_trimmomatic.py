@@ -1,3 +1,9 @@
+import os
+import subprocess
+
+import pytest
+
+from pipelines import fastqio, programio, utilities
 from pipelines.programs import trimmomatic
 
 
@@ -8,3 +14,171 @@ def test_trimmomatic(tmp_path, sample_reads):
 	output = trimmomatic_workflow.run(sample_reads.forward, sample_reads.reverse, output_folder)
 
 	assert output.exists()
+
+FAKE_TRIMMOMATIC = """#!/bin/bash
+# Writes a single read to each of the four output files.
+for output in "$7" "$8" "$9" "${10}"; do
+	printf '@read\\nACGT\\n+\\nIIII\\n' > "$output"
+done
+"""
+
+
+@pytest.fixture
+def fake_trimmomatic(tmp_path, monkeypatch):
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "trimmomatic"
+	program.write_text(FAKE_TRIMMOMATIC)
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}:{os.environ['PATH']}")
+	return program
+
+
+def test_trimmomatic_decompresses_unsupported_formats(tmp_path, fake_trimmomatic, monkeypatch):
+	# Copies the forward reads to the first output and never opens the reverse reads.
+	fake_trimmomatic.write_text('#!/bin/bash\ncat "$5" > "$7" && touch "$8" "$9" "${10}"\n')
+	monkeypatch.setattr(trimmomatic.systemio.command_runner, 'use_srun', False)
+	reads = [tmp_path / "AU1234_R1.fastq.zst", tmp_path / "AU1234_R2.fastq.zst"]
+	for filename in reads:
+		with fastqio.open_output(filename) as file1:
+			file1.write(b"@read\nACGT\n+\nIIII\n")
+
+	output_folder = tmp_path / "trimmed"
+	output = trimmomatic.Trimmomatic().run(*reads, output_folder, "AU1234")
+	assert output.forward.read_bytes() == b"@read\nACGT\n+\nIIII\n"
+	assert not fastqio.get_decompression_folder(output_folder, "trimmomatic").exists()
+
+
+def test_trimmomatic_rejects_unknown_compression():
+	with pytest.raises(ValueError):
+		trimmomatic.Trimmomatic(compression = "rar")
+
+
+def test_trimmomatic_gzip_is_native(tmp_path):
+	workflow = trimmomatic.Trimmomatic(compression = "gzip")
+	output = programio.TrimmomaticOutput.expected(tmp_path, "AU1234", ".fastq.gz")
+	command = workflow.get_command(tmp_path / "R1.fastq", tmp_path / "R2.fastq", output)
+	assert command[0] == "trimmomatic"
+	assert str(output.forward) in command
+
+
+@pytest.mark.parametrize("compression, level", [("gzip", 1), ("zstd", None)])
+def test_trimmomatic_compresses_through_pipes(tmp_path, fake_trimmomatic, compression, level):
+	workflow = trimmomatic.Trimmomatic(compression = compression, level = level)
+	output = programio.TrimmomaticOutput.expected(tmp_path, "AU1234", trimmomatic.COMPRESSION_SUFFIXES[compression])
+	command = workflow.get_command(tmp_path / "R1.fastq", tmp_path / "R2.fastq", output)
+	assert command[0] == "bash"
+
+	subprocess.run(command, check = True)
+	for filename in output.reads():
+		with fastqio.open_reads(filename) as file1:
+			assert file1.read() == b"@read\nACGT\n+\nIIII\n"
+	assert not list(tmp_path.glob("*.pipe"))
+
+	loaded = programio.TrimmomaticOutput.from_folder(tmp_path)
+	assert loaded.name == "AU1234"
+	assert loaded.forward == output.forward
+	assert loaded.unpaired_reverse == output.unpaired_reverse
+	assert utilities.get_folder_type(tmp_path) == 'trimmomatic'
+
+
+def test_trimmomatic_compression_failure(tmp_path, monkeypatch):
+	folder = tmp_path / "bin"
+	folder.mkdir()
+	program = folder / "trimmomatic"
+	program.write_text("#!/bin/bash\nexit 3\n")
+	program.chmod(0o755)
+	monkeypatch.setenv("PATH", f"{folder}:{os.environ['PATH']}")
+
+	workflow = trimmomatic.Trimmomatic(compression = "zstd")
+	output = programio.TrimmomaticOutput.expected(tmp_path, "AU1234", ".fastq.zst")
+	command = workflow.get_command(tmp_path / "R1.fastq", tmp_path / "R2.fastq", output)
+	result = subprocess.run(command, timeout = 30)
+	assert result.returncode != 0
+	assert not list(tmp_path.glob("*.pipe"))
+
+
+STREAMING_TRIMMOMATIC = """#!/bin/bash
+printf '@f1\\nAAAA\\n+\\nIIII\\n@f2\\nCCCC\\n+\\nIIII\\n' > "$7"
+printf '@uf\\nTTTT\\n+\\nIIII\\n' > "$8"
+printf '@r1\\nGGGG\\n+\\nIIII\\n@r2\\nTTTT\\n+\\nIIII\\n' > "$9"
+printf '@ur\\nAAAA\\n+\\nIIII\\n' > "${10}"
+"""
+
+
+@pytest.mark.parametrize("keep", [False, True])
+def test_trimmed_stream(tmp_path, fake_trimmomatic, keep):
+	fake_trimmomatic.write_text(STREAMING_TRIMMOMATIC)
+	workflow = trimmomatic.Trimmomatic()
+	stream = trimmomatic.TrimmedStream(workflow, tmp_path / "R1.fastq", tmp_path / "R2.fastq", tmp_path, "AU1234", keep = keep)
+	result = tmp_path / "consumed.fastq"
+	command = stream.wrap(["sh", "-c", 'cat "$1" > "$2"', "sh", stream.reads, result])
+
+	subprocess.run(command, check = True, timeout = 30)
+	expected = "@f1\nAAAA\n+\nIIII\n@r1\nGGGG\n+\nIIII\n@f2\nCCCC\n+\nIIII\n@r2\nTTTT\n+\nIIII\n"
+	assert result.read_text() == expected
+	assert not stream.pipe_folder.exists()
+	assert stream.output.exists() == keep
+	if keep:
+		with fastqio.open_reads(stream.output.unpaired_reverse) as file1:
+			assert file1.read() == b"@ur\nAAAA\n+\nIIII\n"
+
+
+def test_trimmed_stream_consumer_fails(tmp_path, fake_trimmomatic):
+	fake_trimmomatic.write_text(STREAMING_TRIMMOMATIC)
+	stream = trimmomatic.TrimmedStream(trimmomatic.Trimmomatic(), tmp_path / "R1.fastq", tmp_path / "R2.fastq", tmp_path, "AU1234", keep = True)
+	result = subprocess.run(stream.wrap(["false"]), timeout = 30)
+	assert result.returncode != 0
+	assert not stream.pipe_folder.exists()
+
+	# The copy of the trimmed reads may be incomplete, so it is removed rather than recorded.
+	stream.finish(succeeded = False)
+	assert not any(i.exists() for i in stream.output.reads())
+	assert not (tmp_path / ".trimmomatic.manifest.json").exists()
+
+
+def test_trimmed_stream_finish_requires_every_read(tmp_path, fake_trimmomatic):
+	fake_trimmomatic.write_text(STREAMING_TRIMMOMATIC)
+	stream = trimmomatic.TrimmedStream(trimmomatic.Trimmomatic(), tmp_path / "R1.fastq", tmp_path / "R2.fastq", tmp_path, "AU1234", keep = True)
+	subprocess.run(stream.wrap(["sh", "-c", 'cat "$1" > /dev/null', "sh", stream.reads]), check = True, timeout = 30)
+	stream.output.unpaired_forward.unlink()
+
+	stream.finish()
+	assert not any(i.exists() for i in stream.output.reads())
+	assert not (tmp_path / ".trimmomatic.manifest.json").exists()
+
+	subprocess.run(stream.wrap(["sh", "-c", 'cat "$1" > /dev/null', "sh", stream.reads]), check = True, timeout = 30)
+	stream.finish()
+	assert (tmp_path / ".trimmomatic.manifest.json").exists()
+
+
+# Writes every forward read before any reverse read, which is the most the paired outputs can get out of step.
+UNBALANCED_TRIMMOMATIC = """#!/bin/bash
+cat "$5" > "$7"
+cat "$6" > "$9"
+: > "$8"
+: > "${10}"
+"""
+
+
+@pytest.mark.parametrize("keep", [False, True])
+def test_trimmed_stream_large_inputs(tmp_path, fake_trimmomatic, keep):
+	fake_trimmomatic.write_text(UNBALANCED_TRIMMOMATIC)
+	reads = {
+		"R1": "".join(f"@f{i}\n{'ACGT' * 25}\n+\n{'I' * 100}\n" for i in range(20000)),
+		"R2": "".join(f"@r{i}\n{'TGCA' * 25}\n+\n{'I' * 100}\n" for i in range(20000))
+	}
+	for name, contents in reads.items():
+		(tmp_path / f"{name}.fastq").write_text(contents)
+	stream = trimmomatic.TrimmedStream(
+		trimmomatic.Trimmomatic(), tmp_path / "R1.fastq", tmp_path / "R2.fastq", tmp_path / "trimmed", "AU1234", keep = keep
+	)
+	stream.folder.mkdir()
+	result = tmp_path / "consumed.fastq"
+	command = stream.wrap(["sh", "-c", 'cat "$1" > "$2"', "sh", stream.reads, result])
+
+	subprocess.run(command, check = True, timeout = 60)
+	lines = result.read_text().splitlines()
+	assert len(lines) == 160000
+	assert lines[0::8][:3] == ["@f0", "@f1", "@f2"]
+	assert lines[4::8][-1] == "@r19999"
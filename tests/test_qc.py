@@ -0,0 +1,102 @@
+import gzip
+import random
+from pathlib import Path
+
+import numpy
+import pytest
+
+from pipelines import programio, qc
+
+
+def generate_reads(count: int, seed: int = 1):
+	generator = random.Random(seed)
+	reads = list()
+	for index in range(count):
+		length = generator.randint(20, 60)
+		sequence = "".join(generator.choice("ACGTN") for _ in range(length))
+		quality = "".join(chr(33 + generator.randint(2, 40)) for _ in range(length))
+		reads.append((f"read{index}", sequence, quality))
+	# A few exact duplicates.
+	reads += reads[:5]
+	return reads
+
+
+def write_reads(filename: Path, reads) -> Path:
+	contents = "".join(f"@{name}\n{sequence}\n+\n{quality}\n" for name, sequence, quality in reads)
+	if filename.suffix == '.gz':
+		filename.write_bytes(gzip.compress(contents.encode()))
+	else:
+		filename.write_text(contents)
+	return filename
+
+
+@pytest.fixture
+def reads():
+	return generate_reads(200)
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1000, 2 ** 20])
+def test_profile_reads(tmp_path, reads, chunk_size):
+	filename = write_reads(tmp_path / "sample_R1_001.fastq.gz", reads)
+	profile = qc.profile_reads(filename, chunk_size = chunk_size)
+
+	assert profile.reads == len(reads)
+	assert profile.bases == sum(len(i[1]) for i in reads)
+
+	longest = max(len(i[1]) for i in reads)
+	expected_quality = numpy.zeros(longest)
+	expected_count = numpy.zeros(longest)
+	expected_n = numpy.zeros(longest)
+	for _, sequence, quality in reads:
+		for position, (base, score) in enumerate(zip(sequence, quality)):
+			expected_quality[position] += ord(score) - 33
+			expected_count[position] += 1
+			expected_n[position] += base == 'N'
+	assert numpy.allclose(profile.mean_quality(), expected_quality / expected_count)
+	assert numpy.allclose(profile.n_content(), expected_n / expected_count)
+
+	assert profile.length_histogram.sum() == len(reads)
+	assert profile.length_histogram[len(reads[0][1])] >= 1
+	assert profile.gc_histogram.sum() == len(reads)
+	assert profile.duplicate_fraction == pytest.approx(5 / len(reads))
+
+
+def test_profile_reads_without_trailing_newline(tmp_path):
+	filename = tmp_path / "sample.fastq"
+	filename.write_text("@read1\nACGT\n+\nIIII\n@read2\nGGCC\n+\nIIII")
+	profile = qc.profile_reads(filename)
+	assert profile.reads == 2
+	assert profile.gc_content() == pytest.approx(0.75)
+
+
+def test_profile_empty_file(tmp_path):
+	filename = tmp_path / "sample.fastq"
+	filename.touch()
+	profile = qc.profile_reads(filename)
+	assert profile.reads == 0
+	assert profile.mean_length() == 0
+
+
+def test_quality_profiler(tmp_path):
+	forward = write_reads(tmp_path / "AU1234_S0_R1_001.fastq", generate_reads(50, seed = 1))
+	reverse = write_reads(tmp_path / "AU1234_S0_R2_001.fastq.gz", generate_reads(50, seed = 2))
+	output_folder = tmp_path / "qc"
+
+	profiler = qc.QualityProfiler(processes = 2)
+	try:
+		output = profiler.run(output_folder, forward, reverse)
+		assert output.exists()
+		assert output.profile == output_folder / "AU1234.qc.npz"
+		modified = output.profile.stat().st_mtime_ns
+		# The second run should reuse the saved profile.
+		profiler.run(output_folder, forward, reverse)
+		assert output.profile.stat().st_mtime_ns == modified
+	finally:
+		profiler.close()
+
+	loaded = programio.FastQCOutput.from_folder(output_folder)
+	assert loaded.name == "AU1234"
+	profiles = loaded.load()
+	assert list(profiles) == [forward.name, reverse.name]
+	assert profiles[forward.name].reads == 55
+	assert numpy.array_equal(profiles[reverse.name].quality_counts, qc.profile_reads(reverse).quality_counts)
@@ -0,0 +1,82 @@
+import gzip
+import os
+
+import pytest
+
+from pipelines import fastqio, readindex
+
+
+def write_reads(filename, count: int):
+	contents = "".join(f"@read{i}\n{'ACGT' * (1 + i % 5)}\n+\n{'I' * 4 * (1 + i % 5)}\n" for i in range(count))
+	if filename.suffix == '.gz':
+		filename.write_bytes(gzip.compress(contents.encode()))
+	else:
+		filename.write_text(contents)
+	return filename
+
+
+@pytest.mark.parametrize("name", ["sample_R1_001.fastq", "sample_R1_001.fastq.gz"])
+def test_build_index(tmp_path, name):
+	filename = write_reads(tmp_path / name, 23)
+	index = readindex.build_index(filename, interval = 5, chunk_size = 100)
+
+	assert index.reads == 23
+	assert index.bases == sum(4 * (1 + i % 5) for i in range(23))
+	assert index.min_length == 4
+	assert index.max_length == 20
+	assert len(index.offsets) == 5
+
+	with fastqio.open_reads(filename) as file1:
+		contents = file1.read()
+	assert index.stream_size == len(contents)
+	for number, offset in enumerate(index.offsets):
+		assert contents[offset:].startswith(f"@read{number * 5}\n".encode())
+
+
+def test_chunks_cover_every_read(tmp_path):
+	filename = write_reads(tmp_path / "sample_R1_001.fastq", 50)
+	index = readindex.build_index(filename, interval = 4)
+	chunks = index.chunks(3)
+	assert len(chunks) == 3
+	assert chunks[0][0] == 0
+	assert chunks[-1][1] == index.stream_size
+
+	count = 0
+	for start, end in chunks:
+		for _, newlines, _ in fastqio.iter_record_chunks(filename, 64, start, end):
+			count += len(newlines)
+	assert count == 50
+
+
+def test_get_index_is_saved_and_invalidated(tmp_path, cache_folder):
+	filename = write_reads(tmp_path / "sample_R1_001.fastq", 10)
+	index = readindex.get_index(filename)
+	# The index is saved in the cache folder, so the folder with the reads is left untouched.
+	assert readindex.get_index_filename(filename).parent == cache_folder / "reads"
+	assert readindex.get_index_filename(filename).exists()
+	assert sorted(i.name for i in tmp_path.iterdir()) == ["cache", "sample_R1_001.fastq"]
+	assert readindex.load_index(filename) == index
+
+	mtime = filename.stat().st_mtime_ns
+	write_reads(filename, 12)
+	os.utime(filename, ns = (mtime + 10 ** 9, mtime + 10 ** 9))
+	assert readindex.load_index(filename) is None
+	assert readindex.get_index(filename).reads == 12
+
+
+def test_estimate_coverage(tmp_path):
+	forward = write_reads(tmp_path / "sample_R1_001.fastq", 5)
+	reverse = write_reads(tmp_path / "sample_R2_001.fastq", 5)
+	bases = sum(4 * (1 + i % 5) for i in range(5))
+	assert readindex.estimate_coverage([forward, reverse], 10) == pytest.approx(2 * bases / 10)
+
+
+def test_index_filenames_are_unique(tmp_path):
+	for name in ["A", "B"]:
+		(tmp_path / name).mkdir()
+	first = write_reads(tmp_path / "A" / "reads_R1_001.fastq", 5)
+	second = write_reads(tmp_path / "B" / "reads_R1_001.fastq", 7)
+	assert readindex.get_index_filename(first) != readindex.get_index_filename(second)
+	assert readindex.get_index(first).reads == 5
+	assert readindex.get_index(second).reads == 7
+	assert readindex.load_index(first).reads == 5
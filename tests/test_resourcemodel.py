@@ -0,0 +1,65 @@
+import pytest
+
+from pipelines import ledger, resourcemodel
+
+
+def make_record(input_bytes: int, max_rss_mb: int, cpu_seconds: float = 40, wall_seconds: float = 10) -> ledger.LedgerRecord:
+	return ledger.LedgerRecord(
+		tool = "shovill",
+		command = ["shovill"],
+		start = "2019-01-01T00:00:00",
+		wall_seconds = wall_seconds,
+		user_seconds = cpu_seconds,
+		system_seconds = 0,
+		max_rss_kb = max_rss_mb * 1024,
+		exit_code = 0,
+		threads = 8,
+		inputs = {"reads.fastq": input_bytes}
+	)
+
+
+@pytest.fixture
+def run_ledger(tmp_path) -> ledger.RunLedger:
+	return ledger.RunLedger(tmp_path / "ledger.jsonl")
+
+
+def test_mem_per_cpu():
+	assert resourcemodel.ResourceRequest(4, 10000).mem_per_cpu == 2500
+	assert resourcemodel.ResourceRequest(4).mem_per_cpu == resourcemodel.FALLBACK_MEM_PER_CPU
+
+
+def test_predict_without_history(run_ledger):
+	model = resourcemodel.ResourceModel(run_ledger)
+	assert model.predict("shovill", 1000, 8) == resourcemodel.ResourceRequest(8, resourcemodel.DEFAULT_MEMORY['shovill'])
+	assert model.predict("unknown", 1000, 4) == resourcemodel.ResourceRequest(4, None)
+
+
+def test_predict_from_history(run_ledger):
+	for size, memory in [(1000, 2000), (2000, 3000), (3000, 4000)]:
+		run_ledger.append(make_record(size, memory))
+	# A failed run should be ignored.
+	failed = make_record(1000, 50000)
+	failed.exit_code = 1
+	run_ledger.append(failed)
+
+	model = resourcemodel.ResourceModel(run_ledger, headroom = 1.0)
+	result = model.predict("shovill", 4000, 8)
+
+	# The program only kept 4 cpus busy, but it still starts 8 threads.
+	assert result.cpus == 8
+	assert result.memory == 5000
+
+
+def test_predict_from_jobs(run_ledger):
+	for size, memory in [(1000, 2000), (2000, 3000), (3000, 4000)]:
+		record = make_record(size, memory)
+		record.srun = record.in_job = True
+		run_ledger.append(record)
+	# Only the srun client was measured, so this run says nothing about the program.
+	client = make_record(1000, 10)
+	client.srun = True
+	run_ledger.append(client)
+
+	model = resourcemodel.ResourceModel(run_ledger, headroom = 1.0)
+	assert len(model.history("shovill")) == 3
+	assert model.predict("shovill", 4000, 8) == resourcemodel.ResourceRequest(8, 5000)
@@ -0,0 +1,72 @@
+import subprocess
+from pathlib import Path
+
+from pipelines import ledger, slurm, systemio
+
+
+def test_submit_job_array(backend, tmp_path):
+	output_folders = [tmp_path / "A", tmp_path / "B"]
+	for folder in output_folders:
+		folder.mkdir()
+	tasks = [slurm.ArrayTask(["echo", folder.name], folder) for folder in output_folders]
+	job = backend.submit(tasks, "echo", threads = 4)
+
+	assert job.job_id == "1234"
+	assert "#SBATCH --array=1-2" in (job.folder / "job.sh").read_text()
+	assert backend.wait(job) == [0, 0]
+	assert (output_folders[0] / "stdout.txt").read_text() == "A\n"
+	assert (output_folders[1] / "command.txt").read_text() == "echo B"
+
+
+def test_failed_task_exit_code(backend):
+	job = backend.submit([slurm.ArrayTask(["true"]), slurm.ArrayTask(["false"])], "mixed")
+	assert backend.wait(job) == [0, 1]
+
+
+def test_multiline_commands(backend, tmp_path):
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	tasks = [slurm.ArrayTask(["bash", "-c", "echo one\necho two"], output_folder), slurm.ArrayTask(["true"])]
+	job = backend.submit(tasks, "multiline")
+	assert backend.wait(job) == [0, 0]
+	assert (output_folder / "stdout.txt").read_text() == "one\ntwo\n"
+
+
+def test_command_runner_batch_with_dependency(backend, tmp_path):
+	command_runner = systemio.CommandRunner(srun = False)
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+
+	with command_runner.batch(backend, "first", wait = False) as first:
+		assert command_runner.run(["echo", "abc"], output_folder) is None
+	with command_runner.batch(backend, "second", dependency = first.job) as second:
+		command_runner.run(["echo", "def"], output_folder)
+
+	assert len(first.tasks) == 1
+	assert second.exit_codes == [0]
+	calls = (Path(backend.sbatch).parent / "sbatch_calls.txt").read_text()
+	assert "--dependency=afterok:1234" in calls
+
+
+def test_command_runner_batch_records_usage(backend, tmp_path):
+	command_runner = systemio.CommandRunner(tmp_path / "commands.sh", srun = False)
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	with command_runner.batch(backend, "sleep"):
+		command_runner.run(["sh", "-c", "sleep 0.1"], output_folder, threads = 2)
+
+	records = command_runner.ledger.records()
+	assert [(i.tool, i.threads, i.in_job, i.exit_code) for i in records] == [("sh", 2, True, 0)]
+	assert records[0].command == ["sh", "-c", "sleep 0.1"]
+	assert records[0].wall_seconds >= 0.1
+	assert not ledger.get_usage_filename(output_folder, "sh").exists()
+
+
+def test_measure_command(tmp_path):
+	usage_file = tmp_path / "usage.json"
+	result = subprocess.run(ledger.measure_command(["sh", "-c", "exit 3"], usage_file), cwd = tmp_path)
+	assert result.returncode == 3
+	usage = ledger.read_usage(usage_file)
+	assert usage['exit_code'] == 3
+	assert usage['max_rss_kb'] > 0
+	assert not usage_file.exists()
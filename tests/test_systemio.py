@@ -50,3 +50,81 @@ def test_run_command_with_output_folder(command_runner, tmp_path):
 	assert (output_folder / "command.txt").exists()
 	assert (output_folder / "stdout.txt").exists()
 	assert (output_folder / "stderr.txt").exists()
+
+
+def test_resource_budget_limits_reserved_cpus():
+	budget = systemio.ResourceBudget(4)
+	with budget.reserve(3):
+		assert budget.available == 1
+	# Requests larger than the budget are clamped to the budget.
+	with budget.reserve(16) as cpus:
+		assert cpus == 4
+		assert budget.available == 0
+	assert budget.available == 4
+
+
+def test_resource_budget_limits_reserved_memory():
+	budget = systemio.ResourceBudget(4, memory = 1000)
+	with budget.reserve(1, 600):
+		assert budget.available_memory == 400
+	with budget.reserve(1, 5000):
+		assert budget.available_memory == 0
+	assert budget.available_memory == 1000
+
+
+def test_submit_returns_completed_process(command_runner):
+	future = command_runner.submit(["echo", "abcdefghIJKLM12345"], srun = False, threads = 1)
+	process = future.result()
+	assert process.returncode == 0
+	assert process.stdout == "abcdefghIJKLM12345\n"
+
+
+def test_map_preserves_order(command_runner):
+	values = ["a", "b", "c", "d", "e"]
+	result = command_runner.map(lambda value: command_runner.run(["echo", value], srun = False, threads = 1).stdout, values)
+	assert result == [i + "\n" for i in values]
+
+
+def test_run_command_streams_output_to_compressed_files(tmp_path):
+	import gzip
+	output_folder = tmp_path / "output"
+	output_folder.mkdir()
+	command_runner = systemio.CommandRunner(srun = False, log_compression = 'gzip')
+
+	command_runner.run(["echo", "abcdefghIJKLM12345"], output_folder, srun = False)
+
+	assert gzip.decompress((output_folder / "stdout.txt.gz").read_bytes()) == b"abcdefghIJKLM12345\n"
+	assert (output_folder / "stderr.txt.gz").exists()
+	# The partial logs next to the output folder should have been moved.
+	assert not (tmp_path / "output.stdout.txt.gz").exists()
+
+
+def test_output_stream_keeps_tail(tmp_path):
+	filename = tmp_path / "stdout.txt"
+	stream = systemio.OutputStream(filename, limit = 100)
+	for index in range(100):
+		stream.write(f"{index:>9}\n".encode())
+	stream.close()
+
+	lines = filename.read_text().split('\n')
+	assert lines[0] == "[... 900 bytes truncated ...]"
+	assert lines[-2].strip() == "99"
+	assert not stream.segment.exists() and not stream.previous_segment.exists()
+
+
+def test_run_command_writes_ledger(tmp_path):
+	from pipelines import ledger
+	input_file = tmp_path / "input.txt"
+	input_file.write_text("abcdefghIJKLM12345")
+	command_runner = systemio.CommandRunner(srun = False)
+	command_runner.set_command_log(tmp_path / "commandlog.sh")
+
+	command_runner.run(["cat", input_file], srun = False, threads = 1)
+
+	records = ledger.RunLedger(tmp_path / "ledger.jsonl").records()
+	assert len(records) == 1
+	record = records[0]
+	assert record.tool == "cat"
+	assert record.exit_code == 0
+	assert record.inputs == {str(input_file): 18}
+	assert record.max_rss_kb > 0
@@ -127,3 +127,45 @@ def test_get_longest_substring(left, right, expected):
 def test_get_folder_type(folder, expected):
 	result = utilities.get_folder_type(folder)
 	assert result == expected
+
+
+def test_folder_snapshot_is_cached(temporary_folder):
+	import os, time
+	(temporary_folder / "sample.gff").touch()
+	(temporary_folder / "sample.fna").touch()
+	(temporary_folder / "subfolder").mkdir()
+	# Folders which were just modified aren't cached.
+	os.utime(temporary_folder, ns = (0, time.time_ns() - 10 * 10 ** 9))
+
+	snapshot = utilities.FolderSnapshot.of(temporary_folder)
+	assert snapshot.names == ["sample.fna", "sample.gff", "subfolder"]
+	assert snapshot.folders == [temporary_folder / "subfolder"]
+	assert "sample.gff" in snapshot
+	assert utilities.FolderSnapshot.of(temporary_folder) is snapshot
+
+
+def test_folder_snapshot_is_invalidated(temporary_folder):
+	import os
+	snapshot = utilities.FolderSnapshot.of(temporary_folder)
+	(temporary_folder / "sample.gff").touch()
+	# Make sure the modification time changes even on filesystems with coarse timestamps.
+	os.utime(temporary_folder, ns = (0, snapshot.mtime + 10 ** 9))
+
+	updated = utilities.FolderSnapshot.of(temporary_folder)
+	assert updated is not snapshot
+	assert utilities.get_file_by_type(temporary_folder, "gff") == temporary_folder / "sample.gff"
+
+
+def test_folder_snapshot_with_coarse_timestamps(temporary_folder):
+	import os
+	(temporary_folder / "sample.fna").touch()
+	mtime = (os.stat(temporary_folder).st_mtime_ns // 10 ** 9) * 10 ** 9
+	os.utime(temporary_folder, ns = (0, mtime))
+	snapshot = utilities.FolderSnapshot.of(temporary_folder)
+
+	# A file added within the same second doesn't change a timestamp which is only stored to the second.
+	(temporary_folder / "sample.gff").touch()
+	os.utime(temporary_folder, ns = (0, mtime))
+	updated = utilities.FolderSnapshot.of(temporary_folder)
+	assert updated is not snapshot
+	assert "sample.gff" in updated
@@ -0,0 +1,103 @@
+import gzip
+import json
+
+import pytest
+
+from pipelines import sampleio, validation
+
+
+def make_records(count: int, direction: int, start: int = 0, style: str = "casava"):
+	records = list()
+	for index in range(start, start + count):
+		if style == "casava":
+			header = f"@M00123:1:000:1:1:{index}:1 {direction}:N:0:1"
+		else:
+			header = f"@read{index}/{direction}"
+		records.append(f"{header}\nACGTACGT\n+\nIIIIIIII\n")
+	return "".join(records)
+
+
+def write(filename, contents: str):
+	if filename.suffix == '.gz':
+		filename.write_bytes(gzip.compress(contents.encode()))
+	else:
+		filename.write_text(contents)
+	return filename
+
+
+@pytest.fixture
+def folder(tmp_path):
+	folder = tmp_path / "reads"
+	folder.mkdir()
+	return folder
+
+
+@pytest.mark.parametrize("style", ["casava", "mate suffix"])
+def test_validate_pair(folder, style):
+	forward = write(folder / "AU1234_S0_R1_001.fastq.gz", make_records(300, 1, style = style))
+	reverse = write(folder / "AU1234_S0_R2_001.fastq", make_records(300, 2, style = style))
+	verdict = validation.validate_pair("AU1234", forward, reverse, chunk_size = 512)
+	assert verdict.valid, verdict.errors
+	assert verdict.forward_reads == verdict.reverse_reads == 300
+
+
+def test_validate_pair_desynchronized(folder):
+	forward = write(folder / "R1.fastq", make_records(100, 1))
+	reverse = write(folder / "R2.fastq", make_records(40, 2) + make_records(60, 2, start = 41))
+	verdict = validation.validate_pair("AU1234", forward, reverse, chunk_size = 512)
+	assert not verdict.valid
+	assert "record 41" in verdict.errors[0]
+
+
+def test_validate_pair_different_counts(folder):
+	forward = write(folder / "R1.fastq", make_records(100, 1))
+	reverse = write(folder / "R2.fastq", make_records(80, 2))
+	verdict = validation.validate_pair("AU1234", forward, reverse, chunk_size = 256)
+	assert not verdict.valid
+	assert verdict.forward_reads == 100
+	assert verdict.reverse_reads == 80
+
+
+def test_validate_pair_truncated_gzip(folder):
+	forward = write(folder / "R1.fastq.gz", make_records(1000, 1))
+	reverse = write(folder / "R2.fastq.gz", make_records(1000, 2))
+	forward.write_bytes(forward.read_bytes()[:-200])
+	verdict = validation.validate_pair("AU1234", forward, reverse)
+	assert not verdict.valid
+
+
+def test_validate_pair_malformed_record(folder):
+	forward = write(folder / "R1.fastq", make_records(5, 1) + "@extra 1:N\nACGT\n+\nIII\n")
+	reverse = write(folder / "R2.fastq", make_records(5, 2) + "@extra 2:N\nACGT\n-\nIIII\n")
+	verdict = validation.validate_pair("AU1234", forward, reverse)
+	assert not verdict.valid
+	assert any("forward record 6" in i for i in verdict.errors)
+	assert any("reverse record 6" in i for i in verdict.errors)
+
+
+def test_validate_pair_partial_record(folder):
+	forward = write(folder / "R1.fastq", make_records(5, 1) + "@extra 1:N\nACGT\n")
+	reverse = write(folder / "R2.fastq", make_records(5, 2))
+	verdict = validation.validate_pair("AU1234", forward, reverse)
+	assert not verdict.valid
+
+
+def test_validate_samples_saves_verdicts(folder, cache_folder):
+	forward = write(folder / "AU1234_S0_R1_001.fastq", make_records(10, 1))
+	reverse = write(folder / "AU1234_S0_R2_001.fastq", make_records(10, 2))
+	sample = sampleio.SampleReads("AU1234", forward, reverse)
+
+	verdicts = validation.validate_samples([sample], processes = 1)
+	assert verdicts["AU1234"].valid
+	filename = validation.get_verdict_filename(cache_folder / "validation", "AU1234")
+	assert json.loads(filename.read_text())['contents']['valid']
+	assert validation.load_verdict(filename, forward, reverse) == verdicts["AU1234"]
+	# Nothing is written next to the reads.
+	assert sorted(i.name for i in folder.iterdir()) == [forward.name, reverse.name]
+	# A sample with the same name from another folder doesn't reuse the verdict.
+	assert validation.load_verdict(filename, folder / "other_R1.fastq", reverse) is None
+	assert sampleio.verify_samples([sample], deep = True)
+
+	write(reverse, make_records(9, 2))
+	assert validation.load_verdict(filename, forward, reverse) is None
+	assert not sampleio.verify_samples([sample], deep = True)